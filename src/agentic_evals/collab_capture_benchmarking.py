@@ -1,4 +1,5 @@
 from llm_coordination_agents.collab_capture_action_manager import Environment, Agent, Thief, GreedyAgent
+from llm_coordination_agents.llm_client import get_llm_client, run_in_parallel
 import time 
 import numpy as np 
 import argparse
@@ -62,13 +63,16 @@ def game_loop(model):
     MAX_TURNS = 30
     while True:
         state_for_llm = environment.get_state_for_llm(alice, bob, thief)
-        alice_action = alice.llm_agent.get_next_move(state_for_llm)
+        # Both players move simultaneously, query them at the same time
+        alice_action, bob_action = run_in_parallel([
+            lambda: alice.llm_agent.get_next_move(state_for_llm),
+            lambda: bob.llm_agent.get_next_move(state_for_llm),
+        ])
         if isinstance(alice_action, int):
             alice.plan_move(alice_action)
         elif alice_action.startswith("Press"):
             alice.plan_press_button()
 
-        bob_action = bob.llm_agent.get_next_move(state_for_llm)
         if isinstance(bob_action, int):
             bob.plan_move(bob_action)
         elif bob_action.startswith("Press"):
@@ -116,4 +120,5 @@ if __name__ == '__main__':
     print('Mean Turns to Capture: ', np.mean(turn_count))
     print('Standard Error: ', np.std(np.array(turn_count)) / np.sqrt(NUM_TRIALS))
     print(turn_count)
+    print(get_llm_client().metrics.format_summary())
     
\ No newline at end of file
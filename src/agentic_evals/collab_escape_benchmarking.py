@@ -4,6 +4,7 @@ import argparse
 
 from llm_coordination_agents.CollabEscapeMDP import Game
 from llm_coordination_agents.collab_escape_agent import LLMAgent
+from llm_coordination_agents.llm_client import get_llm_client
 
 
 parser = argparse.ArgumentParser(description='Run Collab Escape benchmark with a specific model.')
@@ -42,3 +43,4 @@ if __name__ == "__main__":
     # Save to a text file
     with open('collab_escape_results.txt', 'w') as file:
         file.write(results_to_save)
+    print(get_llm_client().metrics.format_summary())
@@ -4,6 +4,7 @@ from hanabi_learning_environment import pyhanabi
 from llm_coordination_agents.hanabi_agent import LLMAgent
 import datetime 
 from llm_coordination_agents.hanabi_action_manager import run_game
+from llm_coordination_agents.llm_client import get_llm_client
 import argparse
 
 parser = argparse.ArgumentParser(description='Run Hanabi benchmark with a specific model.')
@@ -41,4 +42,5 @@ if __name__ == "__main__":
         f.write("Scores: " + str(scores) + "\n")
         # write average score
         f.write("Average Score: " + str(np.mean(scores)) + "\n")
+    print(get_llm_client().metrics.format_summary())
 
@@ -1,12 +1,20 @@
-from src.overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld
-from src.llm_coordination_agents.overcooked_action_manager import LLMActionManager
-from src.overcooked_ai_py.mdp.actions import Action, Direction
-import time 
+from overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld
+from llm_coordination_agents.overcooked_action_manager import LLMActionManager
+from overcooked_ai_py.mdp.actions import Action, Direction
+from llm_coordination_agents.llm_client import get_llm_client, run_in_parallel
+from llm_coordination_agents.llm_metrics import CallMetrics, percentile
 import numpy as np 
 from tqdm import tqdm 
 import argparse 
 
-def main(layout_name, model_name):
+def format_extraction_times(times):
+    # How long the action managers took to turn game states into the LLM state, over every query
+    if len(times) == 0:
+        return "STATE EXTRACTION: no extractions"
+    return (f"STATE EXTRACTION: {len(times)} extractions, mean {np.mean(times) * 1000:.3f} ms, p50/p90/p99: "
+            + '/'.join(f"{percentile(times, p) * 1000:.3f}" for p in CallMetrics.PERCENTILES) + " ms")
+
+def main(layout_name, model_name, extraction_times):
     mdp = OvercookedGridworld.from_layout_name(layout_name)
     am = [LLMActionManager(mdp, 'player_0', layout_name, model_name), LLMActionManager(mdp, 'player_1', layout_name, model_name)]
     state = mdp.get_standard_start_state()
@@ -18,8 +26,10 @@ def main(layout_name, model_name):
     for tick in tqdm(range(NUM_TICKS)):
         joint_action = [Action.STAY] * 2
 
+        # Both players act simultaneously, so their LLM queries are sent at the same time
+        moves = run_in_parallel([lambda i=i: am[i].get_next_move(state, '') for i in range(2)])
         for i in range(2):
-            action, message = am[i].get_next_move(state, '')
+            action, message = moves[i]
             joint_action[i] = action 
         # print(joint_action)
         # Apply overcooked game logic to get state transition
@@ -40,7 +50,8 @@ def main(layout_name, model_name):
         print("Current Tick is: ", tick)
         print(mdp.state_string(state))
         print(f"Current score is : {score}")
-        time.sleep(0.5) # Delay to avoid overloading LLM API with calls 
+    for action_manager in am:
+        extraction_times.extend(action_manager.extraction_times)
     return score
 
 
@@ -61,19 +72,26 @@ print(f'Benchmarking model: {model_name}')
 if __name__ == '__main__':
     LAYOUTS = ['forced_coordination', 'cramped_room', 'counter_circuit_o_1order', 'asymmetric_advantages', 'coordination_ring']
     NUM_TRIALS = 3
+    all_extraction_times = []
     
     for layout_name in LAYOUTS:
         scores = []
         gpt_3_costs = []
         gpt_4_costs = []
+        extraction_times = []
         for idx in range(NUM_TRIALS):
-            score = main(layout_name, model_name)
+            score = main(layout_name, model_name, extraction_times)
             scores.append(score)
+        all_extraction_times.extend(extraction_times)
 
         with open(f'{layout_name}.txt', 'w') as f:
             f.write("MODEL: GPT4-turbo",)
             f.write(f"MEAN SCORE: {np.mean(scores)}\n")
             f.write(f"STD ERROR: {np.std(np.array(scores)) / np.sqrt(NUM_TRIALS)}\n")
             f.write(f"SAMPLE SCORES: {scores}\n")
+            f.write(f"LLM REQUEST COUNTERS: {get_llm_client().counter_summary()}\n")
+            f.write(format_extraction_times(extraction_times) + "\n")
+    print(get_llm_client().metrics.format_summary())
+    print(format_extraction_times(all_extraction_times))
 
     
@@ -1,7 +1,7 @@
 import random
 from llm_coordination_agents.collab_escape_agent import LLMAgent
+from llm_coordination_agents.llm_client import run_in_parallel
 import re 
-import time
 import os 
 
 class Room:
@@ -201,12 +201,12 @@ class Game:
                 killer_info += 'We also have information that the killer will certainly move to the room where ' + self.adversary.target_name + ' is. '
 
             # Inference for both agent's action selection:
-            # Alice's decision
-            alice_action_string = self.alice_llm_agent.get_next_move(current_state, killer_info)
-            
-            # Bob's decision
-            bob_action_string = self.bob_llm_agent.get_next_move(current_state, killer_info)
-            
+            # Alice and Bob decide simultaneously, so both are queried at the same time
+            alice_action_string, bob_action_string = run_in_parallel([
+                lambda: self.alice_llm_agent.get_next_move(current_state, killer_info),
+                lambda: self.bob_llm_agent.get_next_move(current_state, killer_info),
+            ])
+
 
             # Reset generators fix count if its fixing stopped before completion (according to latest action decisions)
             reset_generator_list = self.rooms.copy()
@@ -243,5 +243,3 @@ class Game:
 
             self.turn_count += 1
 
-            time.sleep(2.)
-
@@ -1,6 +1,8 @@
 import time 
 import os 
-from openai import OpenAI, AzureOpenAI
+from llm_coordination_agents.llm_client import get_llm_client, backend_for_model_type
+from llm_coordination_agents.llm_stream import action_parsed
+from llm_coordination_agents.llm_metrics import completion_cost
 import datetime 
 import re 
 from fuzzywuzzy import process 
@@ -18,9 +20,10 @@ class bcolors:
     UNDERLINE = '\033[4m'
 
 class LLMManager:
-    def __init__(self, model_name, model_type, cache_dir, temperature=0.6, do_sample=True, max_new_tokens=1000, top_p=0.9, frequency_penalty=0.0, presence_penalty=0.0, api_server=True):
+    def __init__(self, model_name, model_type, cache_dir, temperature=0.6, do_sample=True, max_new_tokens=1000, top_p=0.9, frequency_penalty=0.0, presence_penalty=0.0, api_server=True, agent_name=None):
         self.model_name = model_name 
         self.model_type = model_type
+        self.agent_name = agent_name if agent_name is not None else model_name
         self.temperature = temperature
         self.cache_dir = cache_dir
         self.do_sample = do_sample
@@ -32,27 +35,18 @@ class LLMManager:
         self.device = 'cuda'
         
         self.cost = 0
-        if self.model_type == 'openai':
-            self.akey = os.getenv("AZURE_OPENAI_ENDPOINT")
-            self.org = os.getenv("AZURE_OPENAI_API_KEY")
-            # self.client = OpenAI(api_key = self.akey, organization = self.org)
-            self.client = AzureOpenAI(
-                azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT"), 
-                api_key=os.getenv("AZURE_OPENAI_API_KEY"),  
-                api_version="2023-05-15"
-            )
-        else:
-            self.client = OpenAI(
-                api_key="EMPTY",
-                base_url="http://localhost:8000/v1"
-            )
+        self.backend = backend_for_model_type(self.model_type, azure=True)
+        self.client = get_llm_client()
         self.inference_fn = self.run_openai_inference                    
 
-    def run_openai_inference(self, messages):
+    def run_openai_inference(self, messages, call_type='generator', stop_when=None):
         api_call_start = time.time()
-        completion = self.client.chat.completions.create(
+        completion = self.client.chat(
+            self.backend,
             messages = messages,
             model=self.model_name,
+            call_info={'game': 'collab_capture', 'agent': self.agent_name, 'call_type': call_type},
+            stop_when=stop_when,
             temperature=self.temperature,
             top_p=self.top_p,
             frequency_penalty=self.frequency_penalty,
@@ -60,9 +54,7 @@ class LLMManager:
         )
         print(f"{bcolors.FAIL}LLM INFERENCE TIME: {time.time() - api_call_start}{bcolors.ENDC}")
         # print("INFERENCE STRING: ", completion.choices[0].message.content)
-        total_tokens = completion.usage.total_tokens
-        cur_cost =  0.015 * (total_tokens / 1000)
-        self.cost += cur_cost 
+        self.cost += completion_cost(self.model_name, completion.usage)
         print(f"COST SO FAR: {self.cost} USD")
         return completion.choices[0].message.content
 
@@ -93,7 +85,7 @@ class LLMAgent:
         else:
             self.model_type = 'mistral'
 
-        self.llm = LLMManager(model_name=self.model, model_type=self.model_type, cache_dir=os.getenv('HF_HOME'))
+        self.llm = LLMManager(model_name=self.model, model_type=self.model_type, cache_dir=os.getenv('HF_HOME'), agent_name=self.player_names[self.player_id])
 
         self.experiment_type = 'ai'
         
@@ -136,7 +128,8 @@ class LLMAgent:
         8. All rooms are connected by pathways with same length, and everyone can only move to connected rooms in each turn.'''
 
         # Without COT
-        self.base_prompt = f'''I {self.player_name} am playing the game """"Collab Capture"""" with Bob. I want to coordinate with Bob to catch the thief in the environment in the minimum number of steps. Coordination between Bob and Alice is important to trap the thief. 
+        # Player specific text comes last so both players' prompts share the same prefix
+        self.base_prompt = f'''Alice and Bob are playing the game """"Collab Capture"""". They want to coordinate to catch the thief in the environment in the minimum number of steps. Coordination between Bob and Alice is important to trap the thief. 
         Environment Layout:
         - Room 1 directly connects to Room 2 and Room 6.
         - Room 2 directly connects to Room 1, Room 3.
@@ -147,9 +140,10 @@ class LLMAgent:
         - Room 7 directly connects Room 5, Room 8.
         - Room 8 directly connects to Room 7.
         - Room 9 directly connects Room 6
-        There is a door between Room 1 and Room 2 controlled by a button in Room 9. There is a door between Room 3 and Room 4 controlled by a button in Room 8. Help me {self.player_name} select my next action. Format your response as: 
+        There is a door between Room 1 and Room 2 controlled by a button in Room 9. There is a door between Room 3 and Room 4 controlled by a button in Room 8. Help me select my next action. Format your response as: 
         Analysis: <brief explanation for your next action>.
-        Action: <your selected action from the list>.'''
+        Action: <your selected action from the list>.
+        I am {self.player_name} and my partner is {self.other_player_name}.'''
 
         self.assistant_response_initial = f'''Got it!'''
 
@@ -227,7 +221,7 @@ class LLMAgent:
         print(f"{bcolors.OKBLUE}{state_description}{bcolors.ENDC}")
         messages = self.message + [{'role': 'user', 'content': state_description}]
 
-        action_string = self.llm.inference_fn(messages=messages)
+        action_string = self.llm.inference_fn(messages=messages, stop_when=action_parsed(self.available_actions_list))
         print(f"{bcolors.OKGREEN}LLM Response: {action_string}{bcolors.ENDC}")
         selected_action = self.find_best_match(action_string)
 
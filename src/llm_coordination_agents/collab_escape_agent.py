@@ -1,8 +1,10 @@
 import time
 import datetime 
 import re 
-import openai
-from openai import OpenAI, AzureOpenAI
+from llm_coordination_agents.llm_client import get_llm_client, backend_for_model_type
+from llm_coordination_agents.llm_stream import action_parsed
+from llm_coordination_agents.llm_metrics import completion_cost
+from llm_coordination_agents.llm_retry import LLMRequestError
 from fuzzywuzzy import process
 import os 
 
@@ -100,31 +102,22 @@ class LLMAgent():
                         {"role": "assistant", "content": self.assistant_response_initial},
             ]
         
-        if self.model_type == 'openai':
-            self.akey = os.getenv("AZURE_OPENAI_ENDPOINT")
-            self.org = os.getenv("AZURE_OPENAI_API_KEY")
-            # self.client = OpenAI(api_key = self.akey, organization = self.org)
-            self.client = AzureOpenAI(
-                azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT"), 
-                api_key=os.getenv("AZURE_OPENAI_API_KEY"),  
-                api_version="2023-05-15"
-            )
-        else:
-            self.client = OpenAI(
-                api_key="EMPTY",
-                base_url="http://localhost:8000/v1"
-            )
+        self.backend = backend_for_model_type(self.model_type, azure=True)
+        self.client = get_llm_client()
         self.inference_fn = self.run_openai_inference
         self.num_api_calls = 0
         self.all_actions = [f'move to {r}' for r in ["room 1", "room 2", "room 3", "room 4", "room 5", "room 6", "room 7", "room 8", "room 9", "room 10"]]
         self.all_actions += ['fix generator in room 1', 'fix generator in room 6']
         self.all_actions += ['wait']
 
-    def run_openai_inference(self, messages):
+    def run_openai_inference(self, messages, call_type='generator', stop_when=None):
         api_call_start = time.time()
-        completion = self.client.chat.completions.create(
+        completion = self.client.chat(
+            self.backend,
             messages = messages,
             model=self.model_name,
+            call_info={'game': 'collab_escape', 'agent': self.player_name, 'call_type': call_type},
+            stop_when=stop_when,
             temperature=self.temperature,
             top_p=self.top_p,
             frequency_penalty=self.frequency_penalty,
@@ -135,9 +128,7 @@ class LLMAgent():
         self.num_api_calls += 1
         print(f"{bcolors.OKBLUE}Number of API calls made by {self.player_name}: {bcolors.ENDC}", self.num_api_calls)
         if self.model_type == 'openai':
-            total_tokens = completion.usage.total_tokens
-            cur_cost =  0.011 * (total_tokens / 1000)
-            self.cost += cur_cost 
+            self.cost += completion_cost(self.model_name, completion.usage)
             print(f"COST SO FAR: {self.cost} USD")
         return completion.choices[0].message.content
         
@@ -239,17 +230,18 @@ class LLMAgent():
         # Running inference here
         try:
             pi_input = self.partner_interpreter_message + [{"role": "user", "content": state_description}]
-            partner_interpretation = self.inference_fn(messages=pi_input)
+            partner_interpretation = self.inference_fn(messages=pi_input, call_type='partner_interpretation')
             gen_input = self.generator_message + [{"role": "user", "content": state_description + partner_interpretation}]
-            response = self.inference_fn(messages=gen_input)
+            response = self.inference_fn(messages=gen_input, stop_when=action_parsed(self.available_actions_list))
             print(f'''{bcolors.WARNING}LLM RESPONSE: {response}{bcolors.ENDC}''')
             action = self.find_best_match(response)
             with open('game_state_gpt4_ToM_14.txt', 'a') as file:
                 file.write(state_description + "\n")
                 #file.write(partner_interpretation + "\n")
                 file.write(response + "\n")
-        except Exception as e:
+        except LLMRequestError as e:
             action = 'wait' 
+            self.client.record_fallback(self.model_name)
             print(f'Failed to get response from openai api for player {self.player_id} due to {e}')
         print(self.all_actions)
         
@@ -1,10 +1,10 @@
 from __future__ import print_function
 
 import numpy as np
-import openai 
 import re 
 import os
-from openai import OpenAI, AzureOpenAI
+from llm_coordination_agents.llm_client import get_llm_client, backend_for_model_type, run_in_parallel
+from llm_coordination_agents.llm_stream import verification_decided
 import itertools
 import pandas as pd 
 import datetime 
@@ -50,21 +50,8 @@ class LLMAgent:
             self.model_type = 'mistral'
 
 
-        if self.model_type == 'openai':
-            print(f"API key: {os.getenv('AZURE_OPENAI_API_KEY')}")
-            # self.client = AzureOpenAI(
-            #     azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT"), 
-            #     api_key=os.getenv("AZURE_OPENAI_API_KEY"),  
-            #     api_version="2024-05-27"
-            # )
-            self.client = OpenAI(
-                api_key=os.getenv("AZURE_OPENAI_API_KEY")
-            )
-        else:
-            self.client = OpenAI(
-                    api_key="EMPTY",
-                    base_url="http://localhost:8000/v1",
-                )
+        self.backend = backend_for_model_type(self.model_type)
+        self.client = get_llm_client()
         self.time_stamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         self.action_regex = r"Action:\s*(.*)"
         self.color_map = {
@@ -166,10 +153,12 @@ class LLMAgent:
         15. **Play with Fear:**
             - Do not play a card unless you know for sure that it goes next on the stack when you only have 1 life token left. '''
 
+        # Rules and instructions are identical for both players and every game, the player specific text comes last
+        # so that all requests share the same prefix on the server
         self.base_prompt = f'''The card game Hanabi has the following rules:
         {self.rules}
-        I am {self.player_names[self.player_id]}, playing the card game Hanabi with {self.player_names[1 - self.player_id]}. 
-        At each time step I will provide you with the relevant information of the game. I will also provide you with the legal action, help me select the best next action. Remember I am playing as {self.player_names[self.player_id]}. Format your response as Explanation: <brief explanation for selecting the move>\nAction:<selected move>. Do not say anything else. Got it?'''
+        At each time step I will provide you with the relevant information of the game. I will also provide you with the legal action, help me select the best next action. Format your response as Explanation: <brief explanation for selecting the move>\nAction:<selected move>. Do not say anything else.
+        I am {self.player_names[self.player_id]}, playing the card game Hanabi with {self.player_names[1 - self.player_id]}. Remember I am playing as {self.player_names[self.player_id]}. Got it?'''
         
         ###
         self.verifier_base_prompt = f'''The card game Hanabi has the following rules:
@@ -194,11 +183,11 @@ class LLMAgent:
         
         self.epistemologist_base_prompt = f'''The card game Hanabi has the following rules:
         {self.rules}
-        I am {self.player_names[self.player_id]}, playing the card game Hanabi with {self.player_names[1-self.player_id]}. 
         You are a Theory of Mind inference agent for our game. You will be provided with my partner's selected action and my latest state information after my partner took their action. You will provide me with two things: 1.  An explanation for my partner’s previous action along with their intention and implicit communication. 2. What is the best information for me to give my partner based on their knowledge? 
         Format your response as:
         Partner Action Explanation:<1 sentence explanation of partner action>
         Clue Suggestion:<What information (specify rank or color) should I reveal to my partner based on their knowledge>.
+        I am {self.player_names[self.player_id]}, playing the card game Hanabi with {self.player_names[1-self.player_id]}. 
         '''
         ##
         self.verifier_system_prompt = '''You are an action verification agent for games. I will provide you with an action and you need to check whether the action satisfies the criteria: 1. Rule Following: It follows to the rules of the game. 2. Safety: It won't lead to the game ending immediately. Think about the action, the current state of the stack and the available lives and reveal tokens. End you response with "Verification: Okay" if selected action follows ***both*** criteria and "Verification: Not Okay" otherwise. Restrict your response to 4-5 sentences.'''
@@ -256,6 +245,10 @@ class LLMAgent:
         self.partner_card_uncertainty = []
         self.prev_state_description = ''
         self.no_interpretation_ablation = False  
+        # Verification budget: each round samples `num_candidates` moves in one call and verifies them concurrently,
+        # after `max_verification_rounds` rounds without an approved move a deterministic fallback is played
+        self.num_candidates = 3
+        self.max_verification_rounds = 2
         for i in range(5):
             self.my_card_uncertainty.append(0)
             self.partner_card_uncertainty.append(0)
@@ -502,7 +495,7 @@ class LLMAgent:
             # print(f'''{bcolors.OKGREEN}EPISTEMIC INPUT: {f"***{self.player_names[1-self.player_id]}'s selected action***: {partners_most_recent_action}\n\nMy current state information: {description}. Note that I have updated my knowledge of my cards based on partner's action. Think step by step about partners action. Think about the action. Think about what it implies. If I should give a clue next, think about what clue I can give my partner."}{bcolors.ENDC}''')
             print(f'''{bcolors.OKGREEN}EPISTEMIC INPUT: ***{self.player_names[1-self.player_id]}'s selected action***: {partners_most_recent_action}\n\nMy current state information: {description}. Note that I have updated my knowledge of my cards based on partner's action. Think step by step about partners action. Think about the action. Think about what it implies. If I should give a clue next, think about what clue I can give my partner.{bcolors.ENDC}''')
             
-            epistemic_response_string = self.llm_inference(epistemic_message)
+            epistemic_response_string = self.llm_inference(epistemic_message, call_type='partner_interpretation')
             
 
             partner_action_inference_description = f"Interpretation of {self.player_names[self.player_id-1]}'s Last Action: {epistemic_response_string}. \n You can use the clue suggestion if giving a hint (reveal) is the next best possible move and ignore it otherwise."
@@ -566,11 +559,14 @@ class LLMAgent:
         
         return description
         
-    def llm_inference(self, message):
+    def llm_inference(self, message, call_type='generator', stop_when=None):
         print(f"model: {self.model}")
-        response = self.client.chat.completions.create(
+        response = self.client.chat(
+                self.backend,
                 messages=message,
                 model=self.model,
+                call_info={'game': 'hanabi', 'agent': self.player_names[self.player_id], 'call_type': call_type},
+                stop_when=stop_when,
                 temperature=0.6,
                 top_p=1,
                 frequency_penalty=0,
@@ -579,6 +575,82 @@ class LLMAgent:
         response_string = response.choices[0].message.content
         return response_string
 
+    def llm_candidates(self, message, n):
+        response = self.client.chat(
+                self.backend,
+                messages=message,
+                model=self.model,
+                call_info={'game': 'hanabi', 'agent': self.player_names[self.player_id], 'call_type': 'generator'},
+                temperature=0.6,
+                top_p=1,
+                frequency_penalty=0,
+                presence_penalty=0,
+                n=n,
+            )
+        return [choice.message.content for choice in response.choices]
+
+    def _verifier_message(self, generator_description, move):
+        verifier_description = f"State: {generator_description.replace(self.partner_action_inference_string, '')}\n\n My Solution: {move}. Think step by step. Think about rules, think about conventions, and think about safety. " # https://arxiv.org/pdf/2401.04925.pdf
+        return self.verifier_base_message + [{"role": "user", "content": verifier_description}]
+
+    def _fallback_move(self, candidates):
+        # Never risk a life: discard the oldest card if discarding is legal, otherwise give a clue
+        for kind in ['discard', 'reveal']:
+            for tm in self.transformed:
+                if kind in tm.lower():
+                    return tm
+        return candidates[0] if len(candidates) > 0 else self.transformed[0]
+
+    def _select_verified_move(self, generator_description):
+        # Returns the first approved candidate (in sampling order), the generator response it came from and the verifier responses
+        verifier_responses = []
+        # Lowercased move -> (move, verifier response)
+        rejected = {}
+        candidates = []
+        sources = {}
+        action_strings = []
+        generator_message = self.generator_message
+        for round_number in range(self.max_verification_rounds):
+            action_strings = self.llm_candidates(generator_message, self.num_candidates)
+            candidates = []
+            sources = {}
+            for action_string in action_strings:
+                move = self.find_best_match(action_string)
+                if move not in sources and move.lower() not in rejected:
+                    candidates.append(move)
+                    sources[move] = action_string
+            print(f'''{bcolors.WARNING}LLM CANDIDATES (round {round_number}): {candidates}{bcolors.ENDC}''')
+
+            if len(candidates) > 0:
+                verifications = run_in_parallel([
+                    lambda move=move: self.llm_inference(self._verifier_message(generator_description, move), call_type='verifier', stop_when=verification_decided)
+                    for move in candidates
+                ])
+                for move, verification in zip(candidates, verifications):
+                    print(f'''{bcolors.OKCYAN}VERIFICATION RESPONSE ({move}): {verification}{bcolors.ENDC}''')
+                    verifier_responses.append(verification)
+                    if 'verification: okay' in verification.lower():
+                        return move, sources[move], verifier_responses
+                    rejected[move.lower()] = (move, verification)
+                generator_response = sources[candidates[0]]
+            else:
+                # Every sample was already rejected, the feedback still steers the next round away from them
+                generator_response = action_strings[0] if len(action_strings) > 0 else ''
+
+            # Regenerate from the original prompt plus one feedback turn, so the prompt does not grow with every round
+            feedback = ''.join(f"Your selected action: {move} is not appropriate. {verification}. " for move, verification in rejected.values())
+            feedback += "Please choose another action. List of Available Actions:\n"
+            for tm in self.transformed:
+                if tm.lower() not in rejected:
+                    feedback += tm
+                    feedback += '\n'
+            generator_message = self.generator_message + [{"role": "assistant", "content": generator_response}, {"role": "user", "content": feedback}]
+
+        move = self._fallback_move(candidates)
+        print(f'''{bcolors.FAIL}NO CANDIDATE APPROVED, FALLING BACK TO: {move}{bcolors.ENDC}''')
+        self.client.record_fallback(self.model)
+        return move, sources.get(move, action_strings[0] if len(action_strings) > 0 else ''), verifier_responses
+
     def find_best_match(self, action_string):
         match = re.search(self.action_regex, action_string.strip())
         if match:
@@ -621,47 +693,7 @@ class LLMAgent:
         if len(self.player_actions) > 0:
             selected_move = self.player_actions.pop(0)
         else:
-            action_string = self.llm_inference(self.generator_message)
-            print(f'''{bcolors.WARNING}LLM RESPONSE: {action_string}{bcolors.ENDC}''')
-            selected_move = self.find_best_match(action_string)
-        ###### GENERATION ######
-                
-            #### VERIFICATION ####
-            verification_response_string = ''
-            verifier_responses = []
-            verifier_description = f"State: {generator_description.replace(self.partner_action_inference_string, '')}\n\n My Solution: {selected_move}. Think step by step. Think about rules, think about conventions, and think about safety. " # https://arxiv.org/pdf/2401.04925.pdf
-            print(f'''{bcolors.WARNING}VERIFIER INPUT: {verifier_description}{bcolors.ENDC}''')
-            self.verifier_message = self.verifier_base_message + [{"role": "user", "content": verifier_description}]
-            verification_response_string = self.llm_inference(self.verifier_message)
-            verifier_responses.append(verification_response_string)
-            print(f'''{bcolors.OKCYAN}VERIFICATION RESPONSE: {verification_response_string}{bcolors.ENDC}''')
-            counter = 0 
-            while 'verification: okay' not in verification_response_string.lower():   
-                counter += 1
-                self.generator_message.append({"role": "assistant", "content": action_string})
-                updated_generator_message = f"Your selected action: {selected_move} is not appropriate. {verification_response_string}. Please choose another action. List of Available Actions:\n"
-                for tm in self.transformed:
-                    if tm.lower() != selected_move.lower():
-                        updated_generator_message += tm 
-                        updated_generator_message += '\n'
-
-                self.generator_message.append({"role": "user", "content": updated_generator_message})
-                
-                action_string = self.llm_inference(self.generator_message)
-                print(f"{bcolors.WARNING}LLM CORRECTED RESPONSE: {action_string}{bcolors.ENDC}") 
-                selected_move = self.find_best_match(action_string)
-                # Two Step Verification Only 
-                # if counter == 2:
-                #     break 
-                
-                # self.verifier_message.append({"role": "assistant", "content": verification_response_string})
-                # self.verifier_message.append({"role": "user", "content": f"New Solution: {selected_move}. "})
-                self.verifier_message[-1]["content"] = f"State: {generator_description.replace(self.partner_action_inference_string, '')}\n\n My Solution: {selected_move}. Think step by step. Think about rules, think about conventions, and think about safety. "
-                print(self.verifier_message)
-                verification_response_string = self.llm_inference(self.verifier_message)
-                verifier_responses.append(verification_response_string) 
-                print(f'''{bcolors.OKCYAN}VERIFICATION RESPONSE: {verification_response_string}{bcolors.ENDC}''')
-                
+            selected_move, action_string, verifier_responses = self._select_verified_move(generator_description)
             add_to_dict_list(self.log_csv_dict, 'VERIFICATION Response', ' ***** '.join(verifier_responses)) 
 
 
@@ -826,7 +858,7 @@ class LLMAgentHanabiLive(LLMAgent):
             partner_move_string = self.convert_pyhanabi_partner_move(partner_action)
             print("PARTNER's MOVE: ", partner_move_string)
             epistemic_message = self.epistemologist_message + [{"role": "user", "content": f"***{self.player_names[1-self.player_id]}'s selected action***: {self.player_names[1-self.player_id]} {partner_move_string}\n\nMy current state information: {description}. Note that I have updated my knowledge of my cards based on partner's action. Think step by step about partners action. Think about the action. Think about what it implies. If I should give a clue next, think about what clue I can give my partner."}]
-            epistemic_response_string = self.llm_inference(epistemic_message)
+            epistemic_response_string = self.llm_inference(epistemic_message, call_type='partner_interpretation')
             partner_action_inference_description = f"Interpretation of {self.player_names[self.player_id-1]}'s Last Action: {epistemic_response_string}. \n"
             self.partner_action_inference_string = partner_action_inference_description
         return partner_action_inference_description
@@ -903,50 +935,7 @@ class LLMAgentHanabiLive(LLMAgent):
         if len(self.player_actions) > 0:
             selected_move = self.player_actions.pop(0)
         else:
-            # Generate initial player action 
-            action_string = self.llm_inference(self.generator_message)
-            print(f'''{bcolors.WARNING}LLM RESPONSE: {action_string}{bcolors.ENDC}''')
-            selected_move = self.find_best_match(action_string)
-        
-                
-            # Initial verification 
-            verification_response_string = ''
-            verifier_responses = []
-            verifier_description = f"State: {generator_description.replace(self.partner_action_inference_string, '')}\n\n My Solution: {selected_move}. Think step by step. Think about rules, think about conventions, and think about safety. " # https://arxiv.org/pdf/2401.04925.pdf
-            print(f'''{bcolors.WARNING}VERIFIER INPUT: {verifier_description}{bcolors.ENDC}''')
-            self.verifier_message = self.verifier_base_message + [{"role": "user", "content": verifier_description}]
-            verification_response_string = self.llm_inference(self.verifier_message)
-            verifier_responses.append(verification_response_string)
-            print(f'''{bcolors.OKCYAN}VERIFICATION RESPONSE: {verification_response_string}{bcolors.ENDC}''')
-            counter = 0 
-
-            # Repeat generation and verification, till verification: okay
-            while 'verification: okay' not in verification_response_string.lower():   
-                counter += 1
-                
-                # Add verifier feedback to generator messages 
-                self.generator_message.append({"role": "assistant", "content": action_string})
-                updated_generator_message = f"Your selected action: {selected_move} is not appropriate. {verification_response_string}. Please choose another action. List of Available Actions:\n"
-                
-                # Remove the action that was rejected from the list of available actions 
-                for tm in self.transformed:
-                    if tm.lower() != selected_move.lower():
-                        updated_generator_message += tm 
-                        updated_generator_message += '\n'
-                self.generator_message.append({"role": "user", "content": updated_generator_message})
-                
-                # Generate a new action 
-                action_string = self.llm_inference(self.generator_message)
-                print(f"{bcolors.WARNING}LLM CORRECTED RESPONSE: {action_string}{bcolors.ENDC}") 
-                selected_move = self.find_best_match(action_string)
-                
-                # Verify new action 
-                self.verifier_message[-1]["content"] = f"State: {generator_description.replace(self.partner_action_inference_string, '')}\n\n My Solution: {selected_move}. Think step by step. Think about rules, think about conventions, and think about safety. "
-                print(self.verifier_message)
-                verification_response_string = self.llm_inference(self.verifier_message)
-                verifier_responses.append(verification_response_string) 
-                print(f'''{bcolors.OKCYAN}VERIFICATION RESPONSE: {verification_response_string}{bcolors.ENDC}''')
-                
+            selected_move, action_string, verifier_responses = self._select_verified_move(generator_description)
             add_to_dict_list(self.log_csv_dict, 'VERIFICATION Response', ' ***** '.join(verifier_responses)) 
 
 
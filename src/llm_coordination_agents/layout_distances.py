@@ -0,0 +1,157 @@
+import heapq
+import math
+import threading
+from array import array
+from collections import deque
+
+UNREACHABLE = -1
+
+
+class LayoutDistances:
+    '''Shortest walking distances between every pair of cells a player can stand on in one layout.
+
+    Built from the layout's shared `LayoutGeometry`, with gates counted as walkable so a single table
+    serves every gate state. `distance` takes the dynamic
+    blockers of a query: `walls` are never entered (closed gates), `sinks` can be walked onto but not
+    through (the partner). The table answers the query directly unless a blocker lies on a shortest path,
+    only then one BFS from the source is run, and kept for the next query with the same blockers.
+
+    `next_hop[a][b]` is the neighbour of cell a to step to on a shortest path to cell b, so following a
+    route is one lookup per step. A route through blocked cells is replaced by an A* detour search that
+    uses the table as its (exact on the open layout) heuristic.
+    '''
+    def __init__(self, geometry, max_detours=256):
+        self.cells = sorted(geometry.passable_cells, key=lambda cell: (cell[1], cell[0]))
+        self.index = {cell: i for i, cell in enumerate(self.cells)}
+        self.neighbors = [[self.index[p] for p in geometry.neighbors(cell, through_gates=True)] for cell in self.cells]
+        self.table = [self._bfs(i) for i in range(len(self.cells))]
+        self.next_hop = [self._next_hops(i) for i in range(len(self.cells))]
+        self.max_detours = max_detours
+        self._detours = {}
+        self._lock = threading.Lock()
+
+    def _bfs(self, source, walls=frozenset(), sinks=frozenset()):
+        dist = array('i', [UNREACHABLE]) * len(self.cells)
+        dist[source] = 0
+        queue = deque([source])
+        while queue:
+            i = queue.popleft()
+            if i in sinks and i != source:
+                continue
+            for j in self.neighbors[i]:
+                if dist[j] == UNREACHABLE and j not in walls:
+                    dist[j] = dist[i] + 1
+                    queue.append(j)
+        return dist
+
+    def _next_hops(self, a):
+        hops = array('i', [UNREACHABLE]) * len(self.cells)
+        for b in range(len(self.cells)):
+            if b != a and self.table[a][b] != UNREACHABLE:
+                hops[b] = next(j for j in self.neighbors[a] if self.table[j][b] == self.table[a][b] - 1)
+        return hops
+
+    def _on_shortest_path(self, a, b, cell):
+        d_a, d_b = self.table[a][cell], self.table[cell][b]
+        return d_a != UNREACHABLE and d_b != UNREACHABLE and d_a + d_b == self.table[a][b]
+
+    def _detour(self, a, walls, sinks):
+        key = (a, walls, sinks)
+        dist = self._detours.get(key)
+        if dist is None:
+            dist = self._bfs(a, walls, sinks)
+            with self._lock:
+                if len(self._detours) >= self.max_detours:
+                    self._detours.clear()
+                self._detours[key] = dist
+        return dist
+
+    def distance(self, p1, p2, walls=(), sinks=()):
+        # Number of steps from p1 to p2, math.inf if p2 cannot be reached
+        if p1 not in self.index or p2 not in self.index or p2 in walls:
+            return math.inf
+        a, b = self.index[p1], self.index[p2]
+        d = self.table[a][b]
+        if d == UNREACHABLE:
+            return math.inf
+        wall_ids = frozenset(self.index[p] for p in walls if p in self.index)
+        sink_ids = frozenset(self.index[p] for p in sinks if p in self.index and p != p1)
+        blocked = [cell for cell in wall_ids | sink_ids if cell != a and cell != b and self._on_shortest_path(a, b, cell)]
+        if len(blocked) > 0:
+            d = self._detour(a, wall_ids, sink_ids - {a})[b]
+            if d == UNREACHABLE:
+                return math.inf
+        return d
+
+    def distances_from(self, p, walls=()):
+        # Distances from p to every cell (by `index`) on paths that avoid `walls`, UNREACHABLE where there is none
+        a = self.index[p]
+        wall_ids = frozenset(self.index[w] for w in walls if w in self.index and w != p)
+        return self.table[a] if len(wall_ids) == 0 else self._detour(a, wall_ids, frozenset())
+
+    def _detour_path(self, a, b, walls):
+        # A* from a to b around `walls`, the open layout distance to b is an admissible heuristic
+        counter = 0
+        open_list = [(self.table[a][b], 0, counter, a)]
+        parents = {a: None}
+        costs = {a: 0}
+        while open_list:
+            _, g, _, i = heapq.heappop(open_list)
+            if i == b:
+                path = []
+                while i != a:
+                    path.append(i)
+                    i = parents[i]
+                return path[::-1]
+            if g > costs[i]:
+                continue
+            for j in self.neighbors[i]:
+                if j in walls or self.table[j][b] == UNREACHABLE:
+                    continue
+                if j not in costs or g + 1 < costs[j]:
+                    costs[j] = g + 1
+                    parents[j] = i
+                    counter += 1
+                    heapq.heappush(open_list, (g + 1 + self.table[j][b], g + 1, counter, j))
+        return None
+
+    def _route(self, p1, p2, walls):
+        # (a, b, wall ids, whether the table route can be followed), None if p2 cannot be reached
+        if p1 not in self.index or p2 not in self.index or p2 in walls:
+            return None
+        a, b = self.index[p1], self.index[p2]
+        if self.table[a][b] == UNREACHABLE:
+            return None
+        wall_ids = frozenset(self.index[p] for p in walls if p in self.index and p != p1)
+        return a, b, wall_ids, not any(self._on_shortest_path(a, b, cell) for cell in wall_ids)
+
+    def next_step(self, p1, p2, walls=()):
+        # The cell to move to from p1 on a shortest path to p2 that avoids `walls`, None if p1 == p2 or there is no path
+        route = self._route(p1, p2, walls)
+        if route is None or p1 == p2:
+            return None
+        a, b, wall_ids, unblocked = route
+        if unblocked:
+            return self.cells[self.next_hop[a][b]]
+        path = self._detour_path(a, b, wall_ids)
+        return self.cells[path[0]] if path else None
+
+    def path(self, p1, p2, walls=()):
+        # The cells of a shortest path from p1 to p2 (p1 excluded) that avoids `walls`, None if there is none
+        route = self._route(p1, p2, walls)
+        if route is None:
+            return None
+        a, b, wall_ids, unblocked = route
+        if not unblocked:
+            path = self._detour_path(a, b, wall_ids)
+            return None if path is None else [self.cells[i] for i in path]
+        path = []
+        while a != b:
+            a = self.next_hop[a][b]
+            path.append(self.cells[a])
+        return path
+
+
+def get_layout_distances(mdp):
+    '''The distance table of the layout of `mdp`, built on first use and kept with the layout's shared geometry.'''
+    return mdp.geometry.memoize('llm_layout_distances', lambda: LayoutDistances(mdp.geometry))
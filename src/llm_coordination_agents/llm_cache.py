@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def cache_key(model, messages, params, cache_seed=None):
+    # Content address of a request: identical model, messages and sampling parameters share a response.
+    # `cache_seed` lets callers that deliberately resample the same prompt (e.g. eval trials) keep separate entries.
+    payload = json.dumps({'model': model, 'messages': messages, 'params': params, 'seed': cache_seed}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    '''Disk-backed LLM response cache shared by every process that points at the same file.
+
+    Responses are stored in SQLite (WAL mode, so concurrent readers and writers from several
+    benchmark processes are safe) and keyed by `cache_key`. Once more than `max_entries` rows are
+    stored, the least recently used `evict_fraction` of them is dropped.
+    '''
+    def __init__(self, path, max_entries=200000, evict_fraction=0.1, timeout=30.):
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_fraction = evict_fraction
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+        self._counter_lock = threading.Lock()
+
+        cache_dir = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        conn = self._connection()
+        with conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                created REAL,
+                last_used REAL
+            )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared across threads, keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+        with self._counter_lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            return None
+        with conn:
+            conn.execute('UPDATE responses SET last_used = ? WHERE key = ?', (time.time(), key))
+        return row[0]
+
+    def put(self, key, model, response):
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO responses (key, model, response, created, last_used) VALUES (?, ?, ?, ?, ?)',
+                         (key, model, response, now, now))
+        self._evict_if_needed(conn)
+
+    def _evict_if_needed(self, conn):
+        num_entries = conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        if num_entries <= self.max_entries:
+            return
+        num_to_evict = max(num_entries - self.max_entries, int(self.max_entries * self.evict_fraction))
+        with conn:
+            conn.execute('DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used ASC LIMIT ?)', (num_to_evict,))
+        with self._counter_lock:
+            self.evictions += num_to_evict
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0.,
+            'evictions': self.evictions,
+            'entries': len(self),
+        }
+
+    def clear(self):
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM responses')
@@ -0,0 +1,390 @@
+import asyncio
+import inspect
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import openai
+from openai import AsyncOpenAI, AsyncAzureOpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from openai.types.completion_usage import CompletionUsage
+
+from llm_coordination_agents.llm_cache import LLMResponseCache, cache_key
+from llm_coordination_agents.llm_metrics import CallMetrics, CallRecord, completion_cost
+from llm_coordination_agents.llm_retry import CircuitBreaker, LLMRequestError, RetryPolicy, is_retryable
+from llm_coordination_agents.rate_limiter import RateLimiter, estimate_prompt_tokens
+
+# Endpoint of the vLLM OpenAI-compatible server used for open source models. Agent prompts keep the static rules
+# first and the per-turn state last, so serve with automatic prefix caching enabled where vLLM supports it.
+LOCAL_BASE_URL = os.getenv("LLM_LOCAL_BASE_URL", "http://localhost:8000/v1")
+AZURE_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2023-05-15")
+
+BACKENDS = ['openai', 'azure', 'local']
+
+# Backends asked for the usage of streamed responses (stream_options). The Azure API version in use and vLLM 0.3.2
+# reject it, a stream without it gets its usage estimated from the text.
+STREAM_USAGE_BACKENDS = [b for b in os.getenv("LLM_STREAM_USAGE_BACKENDS", "openai").split(',') if b]
+
+
+def sdk_supports_stream_options():
+    # openai<1.26 (the version in requirements.txt) has no stream_options argument
+    return 'stream_options' in inspect.signature(openai.resources.chat.AsyncCompletions.create).parameters
+
+
+def load_generation_limits():
+    # Generation parameters applied per call type unless the caller sets them, e.g.
+    # LLM_GENERATION_LIMITS='{"verifier": {"max_tokens": 200}, "generator": {"max_tokens": 400, "stop": ["\\n\\n"]}}'
+    # (or a path to a JSON file). Empty by default so responses are not truncated unless configured.
+    limits = os.getenv("LLM_GENERATION_LIMITS")
+    if not limits:
+        return {}
+    if os.path.isfile(limits):
+        with open(limits, 'r') as f:
+            limits = f.read()
+    return json.loads(limits)
+
+
+def openai_api_key():
+    # The 'openai' backend reads its key from API_KEY (and ORGANIZATION). Setups from before the shared client kept it in
+    # AZURE_OPENAI_API_KEY, which is still read if API_KEY is not set.
+    if os.getenv("API_KEY"):
+        return os.getenv("API_KEY")
+    if os.getenv("AZURE_OPENAI_API_KEY"):
+        print("API_KEY is not set, using AZURE_OPENAI_API_KEY for the openai backend. Set API_KEY to silence this warning.")
+        return os.getenv("AZURE_OPENAI_API_KEY")
+    raise ValueError("No API key for the openai backend: set API_KEY (and ORGANIZATION if your key needs it)")
+
+
+def backend_for_model_type(model_type, azure=False):
+    # Agents only distinguish between openai models and everything else (served locally through vLLM).
+    # LLM_BACKEND_OVERRIDE routes every agent to one backend, e.g. 'local' to run against mock_llm_server.
+    if os.getenv("LLM_BACKEND_OVERRIDE"):
+        return os.getenv("LLM_BACKEND_OVERRIDE")
+    if model_type == 'openai':
+        return 'azure' if azure else 'openai'
+    return 'local'
+
+
+class LLMClient:
+    '''Process-wide asyncio client shared by the agents of every game.
+
+    All requests run on one background event loop, so every agent shares the same pool of
+    keep-alive connections per backend and at most `max_concurrency` requests are in flight.
+    Synchronous agents call `chat`; callers with several independent queries can `submit`
+    coroutines to have them in flight at the same time. If a `cache` is given, identical requests
+    are answered from it instead of the API. Requests that reach the API are paced by `rate_limiter`
+    so every game in the process stays within the requests and tokens per minute of each model.
+    Transient errors are retried according to `retry_policy`, and a circuit breaker per model
+    pauses its queue while the provider keeps failing. Retries, timeouts, breaker trips, failed
+    requests and agent fallbacks are counted in `counters`. Every call, cached or not, adds a
+    `CallRecord` to `metrics`, tagged with the `call_info` (game, agent, call_type) of the caller.
+    Callers that pass `stop_when` get a streamed response that is cancelled as soon as
+    `stop_when(text_so_far)` is True (see llm_stream); `generation_limits` sets max_tokens and stop
+    sequences per call type.
+    '''
+    def __init__(self, max_concurrency=8, max_connections=32, max_keepalive_connections=16, keepalive_expiry=120., timeout=600., cache=None, rate_limiter=None,
+                 retry_policy=None, failure_threshold=5, breaker_cooldown=30., metrics=None, streaming=True, generation_limits=None, stream_usage_backends=None):
+        self.cache = cache
+        self.streaming = streaming
+        stream_usage_backends = stream_usage_backends if stream_usage_backends is not None else STREAM_USAGE_BACKENDS
+        self.stream_usage_backends = set(stream_usage_backends) if sdk_supports_stream_options() else set()
+        self.generation_limits = generation_limits if generation_limits is not None else load_generation_limits()
+        self.metrics = metrics if metrics is not None else CallMetrics()
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.counters = Counter()
+        self._counters_lock = threading.Lock()
+        self._breakers = {}
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+
+        self._clients = {}
+        self._semaphore = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='llm-client-loop', daemon=True)
+        self._thread.start()
+
+    def _make_client(self, backend):
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=self.timeout,
+        )
+        if backend == 'azure':
+            return AsyncAzureOpenAI(
+                azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+                api_version=AZURE_API_VERSION,
+                http_client=http_client,
+                max_retries=0,
+            )
+        elif backend == 'openai':
+            return AsyncOpenAI(
+                api_key=openai_api_key(),
+                organization=os.getenv("ORGANIZATION"),
+                http_client=http_client,
+                max_retries=0,
+            )
+        elif backend == 'local':
+            return AsyncOpenAI(
+                api_key="EMPTY",
+                base_url=LOCAL_BASE_URL,
+                http_client=http_client,
+                max_retries=0,
+            )
+        raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}")
+
+    def _get_client(self, backend):
+        # Only ever called on the event loop thread, so no locking is needed
+        if backend not in self._clients:
+            self._clients[backend] = self._make_client(backend)
+        return self._clients[backend]
+
+    def _get_breaker(self, backend, model):
+        if (backend, model) not in self._breakers:
+            self._breakers[(backend, model)] = CircuitBreaker(self.failure_threshold, self.breaker_cooldown)
+        return self._breakers[(backend, model)]
+
+    def record(self, event, model):
+        with self._counters_lock:
+            self.counters[(event, model)] += 1
+
+    def record_fallback(self, model):
+        # Called by agents that substitute a default action because a request failed
+        self.record('fallbacks', model)
+
+    def counter_summary(self):
+        with self._counters_lock:
+            summary = {}
+            for (event, model), count in self.counters.items():
+                summary.setdefault(model, {})[event] = count
+            return summary
+
+    async def _stream(self, backend, client, model, messages, request_timeout, params, stop_when):
+        # Streams one choice and cancels the request once `stop_when` is satisfied. The usage the server reports in
+        # its last chunk is kept where it can be asked for (`stream_usage_backends`). Otherwise, or when the stream is
+        # cut short before that chunk, the usage is estimated from the text instead.
+        sent = time.monotonic()
+        if backend in self.stream_usage_backends:
+            params = {**params, 'stream_options': {'include_usage': True}}
+        stream = await client.chat.completions.create(model=model, messages=messages, timeout=request_timeout, stream=True, **params)
+        text = ''
+        ttft = None
+        usage = None
+        completion_id = None
+        finish_reason = 'stop'
+        early_stop = False
+        try:
+            async for chunk in stream:
+                completion_id = chunk.id
+                if getattr(chunk, 'usage', None) is not None:
+                    usage = chunk.usage
+                if len(chunk.choices) == 0:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta.content:
+                    if ttft is None:
+                        ttft = time.monotonic() - sent
+                    text += choice.delta.content
+                if choice.finish_reason is not None:
+                    finish_reason = choice.finish_reason
+                if stop_when(text):
+                    early_stop = True
+                    break
+        finally:
+            await stream.response.aclose()
+        if early_stop:
+            self.record('early_stops', model)
+
+        estimated_usage = usage is None
+        if estimated_usage:
+            prompt_tokens = estimate_prompt_tokens(messages)
+            completion_tokens = len(text) // 4
+            usage = CompletionUsage(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens)
+        completion = ChatCompletion(
+            id=completion_id or 'stream',
+            object='chat.completion',
+            created=int(time.time()),
+            model=model,
+            choices=[Choice(index=0, finish_reason=finish_reason, message=ChatCompletionMessage(role='assistant', content=text))],
+            usage=usage,
+        )
+        return completion, ttft, estimated_usage
+
+    async def _create(self, backend, model, messages, params, stop_when=None):
+        client = self._get_client(backend)
+        breaker = self._get_breaker(backend, model)
+        policy = self.retry_policy
+        deadline = time.monotonic() + policy.deadline
+        estimated_tokens = self.rate_limiter.estimate_tokens(messages, params)
+        attempt = 0
+        queue_wait = 0.
+        ttft = None
+        estimated_usage = False
+        while True:
+            queued = time.monotonic()
+            probe = False
+            try:
+                # Waiting for the breaker and the rate limiter counts against the deadline too
+                probe = await asyncio.wait_for(breaker.wait(), max(0., deadline - time.monotonic()))
+                await asyncio.wait_for(self.rate_limiter.acquire(backend, model, estimated_tokens), max(0., deadline - time.monotonic()))
+            except asyncio.TimeoutError as e:
+                breaker.release(probe)
+                self.record('failures', model)
+                raise LLMRequestError(f"Request to {model} on {backend} could not be sent before its deadline") from e
+            except asyncio.CancelledError:
+                breaker.release(probe)
+                raise
+            request_timeout = max(1., min(policy.request_timeout, deadline - time.monotonic()))
+            try:
+                async with self._semaphore:
+                    queue_wait += time.monotonic() - queued
+                    if stop_when is None:
+                        completion = await client.chat.completions.create(model=model, messages=messages, timeout=request_timeout, **params)
+                    else:
+                        completion, ttft, estimated_usage = await self._stream(backend, client, model, messages, request_timeout, params, stop_when)
+            except asyncio.CancelledError:
+                breaker.release(probe)
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    breaker.release(probe)
+                    raise
+                self.record('timeouts' if isinstance(e, openai.APITimeoutError) else 'errors', model)
+                if breaker.record_failure():
+                    self.record('breaker_trips', model)
+                attempt += 1
+                delay = policy.backoff(attempt, e)
+                if attempt > policy.max_retries or time.monotonic() + delay >= deadline:
+                    self.record('failures', model)
+                    raise LLMRequestError(f"Request to {model} on {backend} failed after {attempt} attempts: {e}") from e
+                self.record('retries', model)
+                await asyncio.sleep(delay)
+                continue
+            breaker.record_success()
+            if completion.usage is not None:
+                self.rate_limiter.settle(backend, model, estimated_tokens, completion.usage.total_tokens)
+            return completion, attempt + 1, queue_wait, ttft, estimated_usage
+
+    def _record(self, call_info, backend, model, completion, latency, cached, attempts=1, queue_wait=0., stable_prefix=None, ttft=None, estimated_usage=False):
+        call_info = call_info or {}
+        usage = completion.usage
+        details = getattr(usage, 'prompt_tokens_details', None)
+        self.metrics.add(CallRecord(
+            game=call_info.get('game', 'unknown'),
+            agent=call_info.get('agent', 'unknown'),
+            call_type=call_info.get('call_type', 'generator'),
+            backend=backend,
+            model=model,
+            prompt_tokens=usage.prompt_tokens if usage is not None else 0,
+            completion_tokens=usage.completion_tokens if usage is not None else 0,
+            cached_prompt_tokens=(getattr(details, 'cached_tokens', 0) or 0) if not cached else 0,
+            stable_prefix=stable_prefix,
+            queue_wait=queue_wait,
+            ttft=ttft,
+            latency=latency,
+            # An estimated usage is not billed usage, it is left out of the cost
+            cost=0. if cached or estimated_usage else completion_cost(model, usage),
+            cached=cached,
+            estimated_usage=estimated_usage,
+            attempts=attempts,
+        ))
+
+    async def achat(self, backend, model, messages, cache_seed=None, call_info=None, stop_when=None, **params):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        start = time.monotonic()
+        group = tuple((call_info or {}).get(k) for k in ['game', 'agent', 'call_type']) + (model,)
+        stable_prefix = self.metrics.measure_prefix(group, messages)
+        params = {**self.generation_limits.get((call_info or {}).get('call_type', 'generator'), {}), **params}
+        if not self.streaming or params.get('n', 1) > 1:
+            stop_when = None
+
+        key = None
+        if self.cache is not None:
+            # Responses cut short by `stop_when` are cached separately from complete ones
+            key = cache_key(model, messages, params if stop_when is None else {**params, 'early_stop': True}, cache_seed)
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                completion = ChatCompletion.model_validate_json(cached)
+                self._record(call_info, backend, model, completion, time.monotonic() - start, cached=True, stable_prefix=stable_prefix)
+                return completion
+
+        completion, attempts, queue_wait, ttft, estimated_usage = await self._create(backend, model, messages, params, stop_when)
+        self._record(call_info, backend, model, completion, time.monotonic() - start, cached=False, attempts=attempts, queue_wait=queue_wait, stable_prefix=stable_prefix, ttft=ttft,
+                     estimated_usage=estimated_usage)
+
+        if key is not None:
+            await asyncio.to_thread(self.cache.put, key, model, completion.model_dump_json())
+        return completion
+
+    def submit(self, coro):
+        # Schedule a coroutine on the shared loop, returns a concurrent.futures.Future
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def chat(self, backend, model, messages, cache_seed=None, call_info=None, stop_when=None, **params):
+        return self.submit(self.achat(backend, model, messages, cache_seed=cache_seed, call_info=call_info, stop_when=stop_when, **params)).result()
+
+    def close(self):
+        async def _close_clients():
+            for client in self._clients.values():
+                await client.close()
+            self._clients = {}
+        self.submit(_close_clients()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            cache = None
+            if os.getenv("LLM_CACHE_PATH"):
+                cache = LLMResponseCache(os.getenv("LLM_CACHE_PATH"), max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", 200000)))
+            retry_policy = RetryPolicy(
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", 6)),
+                request_timeout=float(os.getenv("LLM_REQUEST_TIMEOUT", 120.)),
+                deadline=float(os.getenv("LLM_REQUEST_DEADLINE", 600.)),
+            )
+            metrics = CallMetrics(log_path=os.getenv("LLM_CALL_LOG"))
+            _shared_client = LLMClient(max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 8)), cache=cache, retry_policy=retry_policy, metrics=metrics,
+                                       streaming=os.getenv("LLM_STREAMING", "1") != "0")
+        return _shared_client
+
+
+def configure_llm_client(**kwargs):
+    # Replace the process-wide client, e.g. to change the concurrency limit before a run
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is not None:
+            _shared_client.close()
+        _shared_client = LLMClient(**kwargs)
+        return _shared_client
+
+
+def run_in_parallel(fns):
+    # Run independent blocking calls (e.g. agents choosing simultaneous moves) at the same time so their
+    # LLM requests are in flight together on the shared client. Results keep the order of `fns`.
+    if len(fns) <= 1:
+        return [fn() for fn in fns]
+    with ThreadPoolExecutor(max_workers=len(fns)) as executor:
+        futures = [executor.submit(fn) for fn in fns]
+        return [f.result() for f in futures]
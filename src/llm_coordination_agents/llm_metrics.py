@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+
+# USD per 1K (prompt, completion) tokens, matched by longest model name prefix. Models served locally cost nothing.
+# Override with LLM_PRICES='{"gpt-4-0125": [0.01, 0.03]}' or a JSON file path.
+DEFAULT_PRICES = {
+    'gpt-4-0125': (0.01, 0.03),
+    'gpt-4-1106': (0.01, 0.03),
+    'gpt-4-turbo': (0.01, 0.03),
+    'gpt-4-32k': (0.06, 0.12),
+    'gpt-4': (0.03, 0.06),
+    'gpt-4o': (0.005, 0.015),
+    'gpt-35-turbo': (0.0005, 0.0015),
+    'gpt-3.5-turbo': (0.0005, 0.0015),
+}
+
+CALL_TYPES = ['generator', 'verifier', 'partner_interpretation']
+
+
+def load_prices():
+    prices = dict(DEFAULT_PRICES)
+    override = os.getenv("LLM_PRICES")
+    if override:
+        if os.path.isfile(override):
+            with open(override, 'r') as f:
+                override = f.read()
+        prices.update({model: tuple(price) for model, price in json.loads(override).items()})
+    return prices
+
+
+PRICES = load_prices()
+
+
+def match_model_prefix(table, model):
+    best = None
+    for prefix in table:
+        if model.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return None if best is None else table[best]
+
+
+def completion_cost(model, usage, prices=None):
+    price = match_model_prefix(PRICES if prices is None else prices, model)
+    if price is None or usage is None:
+        return 0.
+    return (usage.prompt_tokens * price[0] + usage.completion_tokens * price[1]) / 1000
+
+
+def prompt_prefix_text(messages):
+    return ''.join(f"<{m['role']}>{m['content']}" for m in messages)
+
+
+def percentile(values, q):
+    # Linear interpolation between closest ranks, same as numpy's default
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+@dataclass
+class CallRecord:
+    game: str
+    agent: str
+    call_type: str
+    backend: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # Prompt tokens the server answered from its prefix cache (when it reports them)
+    cached_prompt_tokens: int = 0
+    # Share of the prompt identical to the previous prompt of the same game, agent and call type
+    stable_prefix: float = None
+    queue_wait: float = 0.
+    ttft: float = None
+    latency: float = 0.
+    cost: float = 0.
+    cached: bool = False
+    # Token counts estimated from the text (a stream cut short before the server reported its usage), not in `cost`
+    estimated_usage: bool = False
+    attempts: int = 1
+    timestamp: float = field(default_factory=time.time)
+
+
+class CallMetrics:
+    '''Collects one `CallRecord` per LLM call made through the shared client.
+
+    If `log_path` is set every record is also appended to it as a JSON line as soon as it is made.
+    `summary` aggregates the records per (game, agent, call_type), including the server side
+    prefix-cache hit rate and the share of each prompt that is a stable prefix across turns.
+    '''
+    PERCENTILES = [50, 90, 99]
+    TIMINGS = ['queue_wait', 'ttft', 'latency']
+
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self.records = []
+        self._last_prompts = {}
+        self._lock = threading.Lock()
+
+    def measure_prefix(self, group, messages):
+        # What a prefix cache could reuse: the part of this prompt identical to the previous one of the same group
+        prompt = prompt_prefix_text(messages)
+        with self._lock:
+            previous = self._last_prompts.get(group)
+            self._last_prompts[group] = prompt
+        if previous is None or len(prompt) == 0:
+            return None
+        return len(os.path.commonprefix([previous, prompt])) / len(prompt)
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+            if self.log_path is not None:
+                with open(self.log_path, 'a') as f:
+                    f.write(json.dumps(asdict(record)) + '\n')
+
+    def summary(self, keys=('game', 'agent', 'call_type')):
+        with self._lock:
+            records = list(self.records)
+        groups = {}
+        for record in records:
+            groups.setdefault(tuple(getattr(record, k) for k in keys), []).append(record)
+
+        summary = {}
+        for group, group_records in sorted(groups.items()):
+            stats = {
+                'calls': len(group_records),
+                'cached': sum(r.cached for r in group_records),
+                'estimated_usage': sum(r.estimated_usage for r in group_records),
+                'prompt_tokens': sum(r.prompt_tokens for r in group_records),
+                'completion_tokens': sum(r.completion_tokens for r in group_records),
+                'cost': sum(r.cost for r in group_records),
+            }
+            served = [r for r in group_records if not r.cached]
+            served_prompt_tokens = sum(r.prompt_tokens for r in served)
+            stable_prefixes = [r.stable_prefix for r in group_records if r.stable_prefix is not None]
+            stats['prefix_cache_hit_rate'] = sum(r.cached_prompt_tokens for r in served) / served_prompt_tokens if served_prompt_tokens > 0 else 0.
+            stats['stable_prefix'] = sum(stable_prefixes) / len(stable_prefixes) if len(stable_prefixes) > 0 else None
+            for timing in self.TIMINGS:
+                values = [getattr(r, timing) for r in group_records if getattr(r, timing) is not None and not r.cached]
+                for p in self.PERCENTILES:
+                    stats[f'{timing}_p{p}'] = percentile(values, p)
+            summary[group] = stats
+        return summary
+
+    def total_cost(self):
+        with self._lock:
+            return sum(r.cost for r in self.records)
+
+    def format_summary(self, keys=('game', 'agent', 'call_type')):
+        lines = []
+        for group, stats in self.summary(keys).items():
+            timings = ', '.join(
+                f"{timing} p50/p90/p99: " + '/'.join('-' if stats[f'{timing}_p{p}'] is None else f"{stats[f'{timing}_p{p}']:.2f}s" for p in self.PERCENTILES)
+                for timing in self.TIMINGS
+            )
+            lines.append(f"{' / '.join(str(g) for g in group)}: {stats['calls']} calls ({stats['cached']} cached, {stats['estimated_usage']} with estimated usage), "
+                         f"{stats['prompt_tokens']} prompt + {stats['completion_tokens']} completion tokens, ${stats['cost']:.4f}, {timings}, "
+                         f"prefix cache hit rate: {stats['prefix_cache_hit_rate']:.1%}, stable prefix: " + ('-' if stats['stable_prefix'] is None else f"{stats['stable_prefix']:.1%}"))
+        lines.append(f"TOTAL COST: ${self.total_cost():.4f}")
+        return '\n'.join(lines)
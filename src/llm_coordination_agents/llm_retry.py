@@ -0,0 +1,121 @@
+import asyncio
+import random
+import time
+
+import openai
+
+
+class LLMRequestError(Exception):
+    # Raised once a request has exhausted its retries or its deadline
+    pass
+
+
+def is_retryable(error):
+    if isinstance(error, openai.APIConnectionError):
+        # Also covers openai.APITimeoutError
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def retry_after(error):
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    '''Jittered exponential backoff for transient API errors.
+
+    Each attempt is bounded by `request_timeout` and all attempts of one request together by
+    `deadline` (seconds). A server supplied retry-after is honoured when it is longer than the backoff.
+    '''
+    def __init__(self, max_retries=6, base_delay=1., max_delay=60., request_timeout=120., deadline=600., seed=None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.request_timeout = request_timeout
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+
+    def backoff(self, attempt, error=None):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        delay = self.rng.uniform(delay / 2, delay)
+        server_delay = retry_after(error) if error is not None else None
+        if server_delay is not None:
+            delay = max(delay, server_delay)
+        return delay
+
+
+class CircuitBreaker:
+    '''Pauses every request to one model while its provider is degraded.
+
+    After `failure_threshold` consecutive failed attempts the breaker opens for `cooldown` seconds and
+    queued requests wait instead of adding load. Once the cooldown is over the breaker is half-open: one
+    request goes through as a probe while the others keep waiting for its result. A successful probe
+    closes the breaker, a failed one opens it again.
+    '''
+    def __init__(self, failure_threshold=5, cooldown=30.):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.open_until = 0.
+        self.half_open = False
+        self.probing = False
+        self.trips = 0
+        self._probe_done = None
+
+    def is_open(self):
+        return time.monotonic() < self.open_until
+
+    async def wait(self):
+        # Returns True if the caller is the probe of a half-open breaker, it must then record its outcome or `release`
+        while True:
+            if self.is_open():
+                await asyncio.sleep(self.open_until - time.monotonic())
+            elif self.half_open and self.probing:
+                await self._probe_done.wait()
+            elif self.half_open:
+                self.probing = True
+                self._probe_done = asyncio.Event()
+                return True
+            else:
+                return False
+
+    def _end_probe(self):
+        if self.probing:
+            self.probing = False
+            self._probe_done.set()
+
+    def release(self, probe):
+        # The probe ended without telling whether the provider recovered (cancelled or a non-retryable error),
+        # the next waiting request probes instead
+        if probe:
+            self._end_probe()
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.half_open = False
+        self._end_probe()
+
+    def _trip(self):
+        self.open_until = time.monotonic() + self.cooldown
+        self.half_open = True
+        self.trips += 1
+
+    def record_failure(self):
+        # Returns True when this failure (re)opens the breaker
+        self.consecutive_failures += 1
+        if self.probing:
+            self._trip()
+            self._end_probe()
+            return True
+        if self.consecutive_failures >= self.failure_threshold and not self.half_open:
+            self._trip()
+            return True
+        return False
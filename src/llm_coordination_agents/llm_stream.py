@@ -0,0 +1,36 @@
+import re
+
+
+# Stop conditions for streamed responses. Each takes the text received so far and returns True once the rest
+# of the response cannot change what the agent extracts from it, the client then cancels the stream.
+
+def action_parsed(options, marker='Action:'):
+    '''Stops once the line after the last `marker` is complete: either a newline follows it, or it is
+    exactly one of `options` and no longer option starts with it (so 'room 1' waits for 'room 10').'''
+    normalized = [o.strip().lower() for o in options]
+    marker_regex = re.compile(re.escape(marker) + r"\s*(.*)", re.IGNORECASE | re.DOTALL)
+
+    def is_complete(candidate):
+        if candidate == '' or candidate not in normalized:
+            return False
+        return not any(o != candidate and o.startswith(candidate) for o in normalized)
+
+    def stop_when(text):
+        position = text.lower().rfind(marker.lower())
+        if position == -1:
+            return False
+        match = marker_regex.match(text, position)
+        selected = match.group(1)
+        if '\n' in selected.lstrip():
+            return True
+        selected = selected.strip().lower()
+        if selected.endswith('.') and selected.rstrip('.') in normalized:
+            # A full stop ends the action even if a longer option starts with it
+            return True
+        return is_complete(selected)
+    return stop_when
+
+
+def verification_decided(text):
+    lowered = text.lower()
+    return 'verification: okay' in lowered or 'verification: not okay' in lowered
@@ -0,0 +1,235 @@
+'''Offline stand-in for the OpenAI chat-completions API.
+
+Answers Overcooked, Hanabi, Collab Escape, Collab Capture and reasoning-eval prompts with a valid
+action picked from the prompt's own action list (or from a script of canned responses), with
+configurable latency and injected errors. Point the harness at it to profile agents and runners
+without an API key or a GPU:
+
+    python -m llm_coordination_agents.mock_llm_server --port 8000 --latency 0.8 --error-rate 0.02
+    LLM_LOCAL_BASE_URL=http://localhost:8000/v1 LLM_BACKEND_OVERRIDE=local python overcooked_agent_benchmarking.py gpt-4-0125
+'''
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+
+from aiohttp import web
+
+
+def count_tokens(text):
+    # Rough estimate, good enough for load testing (~4 characters per token)
+    return max(1, len(text) // 4)
+
+
+def extract_options(prompt):
+    # Overcooked lists actions inline as "Available Actions:\n[a, b, c]"
+    match = re.search(r"Available Actions:\s*\[(.*?)\]", prompt, re.DOTALL)
+    if match:
+        return [a.strip() for a in match.group(1).split(',') if a.strip() != '']
+
+    # Hanabi, Collab Capture and the reasoning evals use lettered lists "A. ...", "B. ..."
+    lettered = []
+    for line in prompt.split('Available')[-1].split('\n'):
+        line = line.strip()
+        if len(line) > 1 and line[0] == chr(65 + len(lettered)) and line[1] in '. ':
+            lettered.append(line)
+    if lettered:
+        return lettered
+
+    # Collab Escape lists actions comma separated on one line
+    match = re.search(r"Available Actions:\s*(.*)", prompt)
+    if match:
+        return [a.strip() for a in match.group(1).split(',') if a.strip() != '']
+    return []
+
+
+class MockPolicy:
+    '''Builds a plausible response for a chat request.
+
+    `policy` is 'random' (seeded) or 'first'. `script` maps regular expressions to lists of
+    responses, a matching request gets the next response of its list (cycling).
+    '''
+    def __init__(self, policy='random', seed=0, script=None):
+        self.policy = policy
+        self.rng = random.Random(seed)
+        self.script = [(re.compile(pattern, re.DOTALL), responses) for pattern, responses in (script or {}).items()]
+        self.script_position = [0] * len(self.script)
+
+    def choose(self, options):
+        if len(options) == 0:
+            return 'wait.'
+        if self.policy == 'first':
+            return options[0]
+        return self.rng.choice(options)
+
+    def respond(self, messages):
+        system = ' '.join(m['content'] for m in messages if m['role'] == 'system')
+        prompt = messages[-1]['content'] if len(messages) > 0 else ''
+        everything = system + ' ' + ' '.join(m['content'] for m in messages)
+
+        for i, (pattern, responses) in enumerate(self.script):
+            if pattern.search(prompt):
+                response = responses[self.script_position[i] % len(responses)]
+                self.script_position[i] += 1
+                return response
+
+        # Verifiers (Hanabi, Overcooked)
+        if 'My Solution:' in prompt or 'verification agent' in system:
+            return 'Reasoning: The action follows the rules and is safe.\nVerification: Okay'
+        # Partner interpretation (Hanabi epistemologist, Overcooked and Collab Escape ToM)
+        if "selected action***" in prompt:
+            return 'Partner Action Explanation: My partner is following our conventions.\nClue Suggestion: Reveal the next playable card.'
+        if 'Theory of Mind inference agent for the game Collab Escape' in everything:
+            return 'My partner intends to move towards a generator while avoiding the killer.'
+        if "partner's intentions" in everything:
+            return 'My partner intends to continue with the current soup.'
+
+        choice = self.choose(extract_options(prompt))
+        if 'Available Answers' in prompt or 'Available Answers' in everything:
+            return f'Explanation: Mock reasoning.\nAnswer: {choice}'
+        if 'Collab Capture' in everything:
+            return f'Analysis: Mock analysis.\nAction: {choice}'
+        if 'Hanabi' in everything:
+            return f'Explanation: Mock explanation.\nAction: {choice}'
+        return f'Action: {choice}'
+
+
+class MockLLMServer:
+    def __init__(self, policy, latency=0.0, latency_jitter=0.0, tokens_per_second=0.0, error_rate=0.0, error_codes=(429, 500, 503), seed=0):
+        self.policy = policy
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.error_codes = list(error_codes)
+        self.rng = random.Random(seed)
+        self.num_requests = 0
+        self.num_errors = 0
+        self.num_cancelled_streams = 0
+
+    def _completion(self, model, contents, prompt_tokens):
+        completion_tokens = sum(count_tokens(c) for c in contents)
+        return {
+            'id': f'chatcmpl-{uuid.uuid4().hex}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [
+                {'index': i, 'message': {'role': 'assistant', 'content': c}, 'finish_reason': 'stop', 'logprobs': None}
+                for i, c in enumerate(contents)
+            ],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens},
+        }
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        self.num_requests += 1
+        messages = body.get('messages', [])
+        model = body.get('model', 'mock')
+        n = int(body.get('n') or 1)
+        prompt_tokens = sum(count_tokens(m.get('content', '')) for m in messages)
+
+        delay = max(0.0, self.latency + self.rng.uniform(-self.latency_jitter, self.latency_jitter))
+        if self.rng.random() < self.error_rate:
+            await asyncio.sleep(delay)
+            self.num_errors += 1
+            status = self.rng.choice(self.error_codes)
+            headers = {'retry-after': '1'} if status == 429 else {}
+            return web.json_response({'error': {'message': 'Injected error', 'type': 'mock_error', 'code': status}}, status=status, headers=headers)
+
+        contents = [self.policy.respond(messages) for _ in range(n)]
+        if body.get('stream'):
+            include_usage = (body.get('stream_options') or {}).get('include_usage', False)
+            return await self._stream(request, model, contents[0], delay, prompt_tokens if include_usage else None)
+        if self.tokens_per_second > 0:
+            delay += sum(count_tokens(c) for c in contents) / self.tokens_per_second
+        await asyncio.sleep(delay)
+        return web.json_response(self._completion(model, contents, prompt_tokens))
+
+    async def _stream(self, request, model, content, delay, prompt_tokens=None):
+        # Server-sent events in the OpenAI chunk format, one ~4 character token per chunk. The usage is sent in a
+        # last chunk without choices if `prompt_tokens` is given (stream_options include_usage)
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        created = int(time.time())
+
+        def chunk(delta, finish_reason=None):
+            payload = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason, 'logprobs': None}],
+            }
+            return f'data: {json.dumps(payload)}\n\n'.encode('utf-8')
+
+        await asyncio.sleep(delay)
+        try:
+            await response.write(chunk({'role': 'assistant', 'content': ''}))
+            for i in range(0, len(content), 4):
+                if self.tokens_per_second > 0:
+                    await asyncio.sleep(1. / self.tokens_per_second)
+                await response.write(chunk({'content': content[i:i + 4]}))
+            await response.write(chunk({}, finish_reason='stop'))
+            if prompt_tokens is not None:
+                completion_tokens = count_tokens(content)
+                usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens}
+                payload = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model, 'choices': [], 'usage': usage}
+                await response.write(f'data: {json.dumps(payload)}\n\n'.encode('utf-8'))
+            await response.write(b'data: [DONE]\n\n')
+            await response.write_eof()
+        except (ConnectionResetError, asyncio.CancelledError):
+            # The client stopped reading early
+            self.num_cancelled_streams += 1
+            raise
+        return response
+
+    async def models(self, request):
+        return web.json_response({'object': 'list', 'data': [{'id': 'mock', 'object': 'model', 'owned_by': 'mock'}]})
+
+    async def stats(self, request):
+        return web.json_response({'requests': self.num_requests, 'errors': self.num_errors, 'cancelled_streams': self.num_cancelled_streams})
+
+    def make_app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post('/v1/chat/completions', self.chat_completions)
+        # Azure style deployment routes
+        app.router.add_post('/openai/deployments/{deployment}/chat/completions', self.chat_completions)
+        app.router.add_get('/v1/models', self.models)
+        app.router.add_get('/stats', self.stats)
+        return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run an offline OpenAI-compatible server for load testing.')
+    parser.add_argument('--host', type=str, default='localhost')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--policy', type=str, default='random', choices=['random', 'first'], help='How to pick an action from the prompt')
+    parser.add_argument('--script', type=str, default=None, help='JSON file mapping regexes to lists of canned responses')
+    parser.add_argument('--latency', type=float, default=0.0, help='Base latency of each request in seconds')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help='Uniform jitter added to the latency in seconds')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help='Simulated generation speed, 0 disables')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with an error')
+    parser.add_argument('--error-codes', type=int, nargs='+', default=[429, 500, 503])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    script = None
+    if args.script is not None:
+        with open(args.script, 'r') as f:
+            script = json.load(f)
+
+    server = MockLLMServer(
+        MockPolicy(policy=args.policy, seed=args.seed, script=script),
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        error_codes=args.error_codes,
+        seed=args.seed,
+    )
+    web.run_app(server.make_app(), host=args.host, port=args.port)
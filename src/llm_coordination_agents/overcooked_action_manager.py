@@ -6,6 +6,7 @@ import random
 import datetime
 from overcooked_ai_py.mdp.actions import Action, Direction, LLMActionSet
 from llm_coordination_agents.overcooked_agent import LLMAgent
+from llm_coordination_agents.layout_distances import UNREACHABLE, get_layout_distances
 import re
 
 def set_global_seed(seed):
@@ -70,6 +71,28 @@ storage_counter_locations = {
 }
 
 
+COUNTER_OBJECT_NAMES = {'onion': 'onion', 'dish': 'plate', 'soup': 'soup in plate'}
+HELD_OBJECT_NAMES = {'dish': 'plate', 'soup': 'soup in plate'}
+
+
+class StagePlan(object):
+    '''An LLM stage compiled into what executing it takes: the object to go to, the cells next to it a player
+    can use it from (each with the orientation that faces it), the cell currently headed for, and the
+    interaction to do once there. `kind` is 'wait', 'away' or 'move'.
+    '''
+    def __init__(self, stage, kind, location=None, location_id=None, location_coords=None, interaction=None):
+        self.stage = stage
+        self.kind = kind
+        self.location = location
+        self.location_id = location_id
+        self.location_coords = location_coords
+        self.interaction = interaction
+        self.approach = {}
+        self.approach_order = []
+        self.target = None
+        self.gates = None
+
+
 class LLMActionManager(object):
     def __init__(self, mdp, player_name, layout_name, model_name): 
         self.layout_name = layout_name
@@ -87,6 +110,8 @@ class LLMActionManager(object):
         }
         # Shared counter should not be counted twice 
         self.object_location['k']  = [k for k in self.object_location['k'] if k not in self.object_location['s']]
+        # All-pairs walking distances of this layout, shared with every other action manager in the process
+        self.layout_distances = get_layout_distances(self.mdp)
         self.trajectory = []
         self.selected_action = None 
         self.pot_state = 0 
@@ -140,6 +165,15 @@ class LLMActionManager(object):
         self.save_low_level_trajectory = True
         self.prev_directive = 'wait.'
 
+        # Pots and counters by position, so extracting a state only revisits the ones whose object changed
+        self.pot_index = {pos: idx for idx, pos in enumerate(self.object_location['c'])}
+        self.counter_index = {pos: ('kitchen', idx) for idx, pos in enumerate(self.object_location['k'])}
+        self.counter_index.update({pos: ('storage', idx) for idx, pos in enumerate(self.object_location['s'])})
+        self.last_extracted = None
+        self.extraction_times = []
+        self.accessible_points = None
+        self.plan = None
+
     
 
     def get_next_move(self, state, other_player_message):
@@ -161,35 +195,34 @@ class LLMActionManager(object):
         
         print(self.current_stage)
 
-        if 'wait' in self.current_stage.lower():
+        # The stage is compiled once, every tick after only follows the plan
+        if self.plan is None or self.plan.stage != self.current_stage:
+            self.plan = self.compile_stage(self.current_stage)
+
+        if self.plan.kind == 'wait':
             self.selected_action = Action.STAY 
             self.should_get_stage_from_llm = True 
         
-        elif 'away' in self.current_stage.lower():
+        elif self.plan.kind == 'away':
             self.selected_action = self.move_away_deterministic()
             self.should_get_stage_from_llm = True
 
+        elif self.plan.location_id == None:
+            self.selected_action = Action.STAY
         else:
-            location, location_id = extract_location(self.current_stage)
-            assert location in list(self.object_location.keys())
-            if location_id == None:
-                self.selected_action = Action.STAY
-            else:
-                self.selected_action = self.move_to(location, int(location_id))
-                if self.selected_action == Action.REACHED:
-                    if 'pick' in self.current_stage:
-                        self.selected_action = self.pick_up(state)
-                    elif 'place' in self.current_stage or 'put' in self.current_stage:
-                        self.selected_action = self.place(state)
-                    elif 'load' in self.current_stage:    
-                        self.selected_action = self.load_plate(state, int(location_id))
-                    elif 'open' in self.current_stage:
-                        self.selected_action = self.open(state)
-                    # elif 'deliver' in self.current_stage:
-                    #     self.selected_action = self.place(state)
-                    else:
-                        # print(f"{bcolors.FAIL}ERROR: Unknown action type in {self.current_stage}{bcolors.FAIL}")
-                        self.selected_action = Action.STAY
+            self.selected_action = self.follow_plan(self.plan)
+            if self.selected_action == Action.REACHED:
+                if self.plan.interaction == 'pick':
+                    self.selected_action = self.pick_up(state)
+                elif self.plan.interaction == 'place':
+                    self.selected_action = self.place(state)
+                elif self.plan.interaction == 'load':
+                    self.selected_action = self.load_plate(state, self.plan.location_id)
+                elif self.plan.interaction == 'open':
+                    self.selected_action = self.open(state)
+                else:
+                    # print(f"{bcolors.FAIL}ERROR: Unknown action type in {self.current_stage}{bcolors.FAIL}")
+                    self.selected_action = Action.STAY
         
         self.handle_stalemate()
         self.assign_prev_action_directive()
@@ -293,34 +326,63 @@ class LLMActionManager(object):
         # # print(f"ERROR: No position found to move away to")
         return Action.STAY
     
-    def move_to(self, location, location_id=0):
-        # target_locs_arr, pseudo_obj_loc_arr = self.get_nearest_unblocked_object_locations(self.player_position[0], self.player_position[1], obj=location)
-        location_coords = self.object_location[location][location_id]
-        target_locs_arr = self.get_adjacent_empty_points(location_coords)
-        if target_locs_arr == None:
-            # Another stalemate handler 
-            self.should_get_stage_from_llm = True 
-            return Action.STAY
-        
-        # TODO: Make a decision about this 
-        elif len(target_locs_arr) == 0:
+    def compile_stage(self, stage):
+        if 'wait' in stage.lower():
+            return StagePlan(stage, 'wait')
+        if 'away' in stage.lower():
+            return StagePlan(stage, 'away')
+        location, location_id = extract_location(stage)
+        assert location in list(self.object_location.keys())
+        if location_id == None:
+            return StagePlan(stage, 'move', location)
+        location_id = int(location_id)
+        if 'pick' in stage:
+            interaction = 'pick'
+        elif 'place' in stage or 'put' in stage:
+            interaction = 'place'
+        elif 'load' in stage:
+            interaction = 'load'
+        elif 'open' in stage:
+            interaction = 'open'
+        else:
+            interaction = None
+        return StagePlan(stage, 'move', location, location_id, self.object_location[location][location_id], interaction)
+
+    def _plan_approach(self, plan):
+        # Cells next to the object a player can stand on, depends on the gates only
+        plan.gates = self.closed_gates()
+        x, y = plan.location_coords
+        adjacent_points = [(x, y-1), (x, y+1), (x-1, y), (x+1, y)]
+        plan.approach_order = [p for p in adjacent_points if 0 <= p[0] < self.mdp.width and 0 <= p[1] < self.mdp.height and self.mdp.get_terrain_type_at_pos(p) == " "]
+        plan.approach = {p: self.calculate_desired_orientation(p, plan.location_coords) for p in plan.approach_order}
+        plan.target = None
+
+    def follow_plan(self, plan):
+        if plan.gates != self.closed_gates():
+            self._plan_approach(plan)
+        target_locs_arr = [p for p in plan.approach_order if p != self.other_player_position]
+        if len(target_locs_arr) == 0:
             self.should_get_stage_from_llm = True 
             return Action.STAY
-        if self.player_position in target_locs_arr:
-            idx = target_locs_arr.index(self.player_position)
-            desired_orientation = self.calculate_desired_orientation(self.player_position, location_coords)
-            if desired_orientation!= self.player_orientation:
-                return desired_orientation                    
-            else:
-                self.selected_action = Action.REACHED
-            return self.selected_action 
-                
-        return self.go_to_position(target_locs_arr, self.player_position, self.player_orientation)
-    
+        if self.player_position in plan.approach:
+            if plan.approach[self.player_position] != self.player_orientation:
+                return plan.approach[self.player_position]
+            return Action.REACHED
+
+        # Head for the first cell in `approach_order` that can be reached, so a cell ahead of the current target that
+        # opens up (the partner moved away) is switched to
+        blockers = plan.gates + (self.other_player_position,)
+        plan.target = None
+        for target in target_locs_arr:
+            next_position = self.layout_distances.next_step(self.player_position, target, walls=blockers)
+            if next_position is not None:
+                plan.target = target
+                return self.get_next_action(self.player_position, self.player_orientation, [next_position])
+        return Action.STAY
+
     def pick_up(self, state):
-        state_dict = state.to_dict()
         # Add assertions to check whether player is actually next to item and facing it 
-        if state_dict['players'][int(self.player_id)]['held_object'] == None:
+        if state.players[self.player_id].held_object == None:
             self.should_get_stage_from_llm = True 
             return Action.INTERACT
         else:
@@ -328,8 +390,8 @@ class LLMActionManager(object):
             return Action.STAY
         
     def load_plate(self, state, location_id):
-        state_dict = state.to_dict()
-        if state_dict['players'][int(self.player_id)]['held_object']['name'] == 'dish':
+        held_object = state.players[self.player_id].held_object
+        if held_object != None and held_object.name == 'dish':
             pot_states_dict = self.mdp.get_pot_states(state)
             if 'ready' in pot_states_dict['onion']:
                 if self.object_location['c'][location_id] in pot_states_dict['onion']['ready']:
@@ -340,9 +402,8 @@ class LLMActionManager(object):
 
 
     def place(self, state):
-        state_dict = state.to_dict()
         # Add assertions to check whether player is actually next to location and facing it 
-        if state_dict['players'][int(self.player_id)]['held_object'] != None:
+        if state.players[self.player_id].held_object != None:
             self.should_get_stage_from_llm = True 
             return Action.INTERACT
         else:
@@ -350,51 +411,48 @@ class LLMActionManager(object):
             return Action.STAY
     
     def open(self, state):
-        state_dict = state.to_dict()
-        if state_dict['players'][int(self.player_id)]['held_object'] == None:
+        if state.players[self.player_id].held_object == None:
             self.should_get_stage_from_llm = True 
             return Action.INTERACT
         
 
-    def _populate_distances(self):
+    def _populate_distances(self, column, moved_blocker=None):
+        # Column 0 holds my distances, with my partner in the way, column 1 my partner's, with me in the way. If only
+        # the player in the way moved, `moved_blocker` is its (previous, current) cell and only the distances it can
+        # change are recomputed
+        if column == 0:
+            source, blocker = self.player_position, self.other_player_position
+        else:
+            source, blocker = self.other_player_position, self.player_position
+        walls = self.closed_gates()
+        if self.accessible_points is None or self.accessible_points[0] != walls:
+            # Which cells next to an object can be stood on only changes when a gate opens or closes
+            self.accessible_points = (walls, {k: [self.get_adjacent_accessible_points(location) for location in self.object_location[k[0]]]
+                                              for k in self.state_for_llm['distances']})
+        if moved_blocker is not None:
+            from_source = self.layout_distances.distances_from(source, walls)
+            from_blocker = [(cell, self.layout_distances.distances_from(cell, walls)) for cell in moved_blocker]
         for k, v in self.state_for_llm['distances'].items():
-            for i in range(len(self.state_for_llm['distances'][k])):
-
-                # Find all distances for me 
-                adjc_accessible_points = self.get_adjacent_accessible_points(self.object_location[k[0]][i])
+            for i in range(len(v)):
+                adjc_accessible_points = self.accessible_points[1][k][i]
                 if len(adjc_accessible_points) <= 0:
-                    self.state_for_llm['distances'][k][i][0] = 'infinite'
-                else:
-
-                    # dest = self._find_closest_point(self.player_position, self.other_player_position, adjc_accessible_points)
-                    # distances = self.find_shortest_distance(self.player_position, adjc_accessible_points, self.other_player_position)
-                    dist, dest = self.find_shortest_distance(self.player_position, adjc_accessible_points, self.other_player_position)
-                    # for point in adjc_accessible_points:
-                    #     s_dist = self.find_shortest_distance(self.player_position, point, self.other_player_position)
-
-                    # if dist == None:
-                    #     dist = 'infinite'
-                    # elif dest == self.other_player_position:
-                    #     dist = 'blocked'
-                    self.state_for_llm['distances'][k][i][0] = str(dist)
-
-                    adjc_accessible_points, dest, dist = None, None, None 
-
-                # Find all distances for my partner 
-                adjc_accessible_points = self.get_adjacent_accessible_points(self.object_location[k[0]][i])
-                if len(adjc_accessible_points) <= 0:
-                    self.state_for_llm['distances'][k][i][0] = 'infinite'
-                else:
-                    # dest = self._find_closest_point(self.other_player_position, self.player_position, adjc_accessible_points)
-                    # dist = self.find_shortest_distance(self.other_player_position, dest, self.player_position)
-                    dist, dest = self.find_shortest_distance(self.other_player_position, adjc_accessible_points, self.player_position)
-                    # if dist == None:
-                    #     dist = 'infinite'
-                    # elif dest == self.player_position:
-                    #     dist = 'blocked'
-                    self.state_for_llm['distances'][k][i][1] = str(dist)
-
-
+                    v[i][column] = 'infinite'
+                    continue
+                if moved_blocker is not None and not any(self._in_the_way(from_source, cell, from_cell, adjc_accessible_points) for cell, from_cell in from_blocker):
+                    continue
+                dist, dest = self.find_shortest_distance(source, adjc_accessible_points, blocker)
+                v[i][column] = str(dist)
+
+    def _in_the_way(self, from_source, cell, from_cell, points):
+        # Whether a player standing on `cell` can change the distance (`from_source`) to the closest of `points`: it
+        # is one of them, or it lies on a shortest path to one of them
+        if cell in points:
+            return True
+        index = self.layout_distances.index
+        to_cell = from_source[index[cell]]
+        if to_cell == UNREACHABLE:
+            return False
+        return any(from_cell[index[p]] != UNREACHABLE and to_cell + from_cell[index[p]] == from_source[index[p]] for p in points)
 
     def _find_closest_point(self, p1, other_player_position, p_list):
         # closest_point = None
@@ -439,92 +497,55 @@ class LLMActionManager(object):
     
 
     def _populate_pot_states(self, state):
-        for idx, pot_pos in enumerate(self.object_location['c']):
-            if not state.has_object(pot_pos):
-                # # print(f"{bcolors.OKGREEN}SOUP IS NOT COOKING in c{idx} and there are 0 onions{bcolors.ENDC}")
-                self.state_for_llm['num_onions_in_pot'][idx] = 0 
-                self.state_for_llm['soup_in_cooker_status'][idx] = 'not cooking'
+        for idx in range(len(self.object_location['c'])):
+            self._populate_pot_state(state, idx)
+
+    def _populate_pot_state(self, state, idx):
+        pot_pos = self.object_location['c'][idx]
+        if not state.has_object(pot_pos):
+            # # print(f"{bcolors.OKGREEN}SOUP IS NOT COOKING in c{idx} and there are 0 onions{bcolors.ENDC}")
+            self.state_for_llm['num_onions_in_pot'][idx] = 0 
+            self.state_for_llm['soup_in_cooker_status'][idx] = 'not cooking'
+            self.state_for_llm['cooker_status'][idx] = 'off'
+        else:
+            soup = state.get_object(pot_pos)
+            if self.is_ready(soup):
+                # # print(f"{bcolors.OKGREEN}SOUP IS READY in c{idx} {bcolors.ENDC}")
+                self.state_for_llm['soup_in_cooker_status'][idx] = 'cooked'
                 self.state_for_llm['cooker_status'][idx] = 'off'
+                self.state_for_llm['num_onions_in_pot'][idx] = 3
+            elif self.is_cooking(soup):
+                # # print(f"{bcolors.OKGREEN}SOUP IS COOKING in c{idx} {bcolors.ENDC}")
+                self.state_for_llm['soup_in_cooker_status'][idx] = 'still cooking'
+                self.state_for_llm['cooker_status'][idx] = 'on'
+                self.state_for_llm['num_onions_in_pot'][idx] = 3
+                _, _, cook_time = soup.state 
+                self.state_for_llm['soup_in_cooker_remaining_time'][idx] = cook_time
             else:
-                soup = state.get_object(pot_pos)
-                if self.is_ready(soup):
-                    # # print(f"{bcolors.OKGREEN}SOUP IS READY in c{idx} {bcolors.ENDC}")
-                    self.state_for_llm['soup_in_cooker_status'][idx] = 'cooked'
-                    self.state_for_llm['cooker_status'][idx] = 'off'
-                    self.state_for_llm['num_onions_in_pot'][idx] = 3
-                elif self.is_cooking(soup):
-                    # # print(f"{bcolors.OKGREEN}SOUP IS COOKING in c{idx} {bcolors.ENDC}")
-                    self.state_for_llm['soup_in_cooker_status'][idx] = 'still cooking'
-                    self.state_for_llm['cooker_status'][idx] = 'on'
-                    self.state_for_llm['num_onions_in_pot'][idx] = 3
-                    _, _, cook_time = soup.state 
-                    self.state_for_llm['soup_in_cooker_remaining_time'][idx] = cook_time
-                else:
-                    # # print(f"{bcolors.OKGREEN}SOUP IS NOT COOKING in c{idx} and there are {self.state_for_llm['num_onions_in_pot'][idx]} onions {bcolors.ENDC}")
-                    _, num_ingredients, _ = soup.state 
-                    self.state_for_llm['soup_in_cooker_status'][idx] = 'not cooking'
-                    self.state_for_llm['cooker_status'][idx] = 'off'
-                    self.state_for_llm['num_onions_in_pot'][idx] = num_ingredients
+                # # print(f"{bcolors.OKGREEN}SOUP IS NOT COOKING in c{idx} and there are {self.state_for_llm['num_onions_in_pot'][idx]} onions {bcolors.ENDC}")
+                _, num_ingredients, _ = soup.state 
+                self.state_for_llm['soup_in_cooker_status'][idx] = 'not cooking'
+                self.state_for_llm['cooker_status'][idx] = 'off'
+                self.state_for_llm['num_onions_in_pot'][idx] = num_ingredients
 
     def _populate_counter_objects(self, state, counter_type='kitchen'):
-        counter_objects = {}
-        inv_counter_objects = self.mdp.get_counter_objects_dict(state, counter_subset=self.object_location[f'{counter_type[0]}']) 
-        if 'onion' in inv_counter_objects:
-            for pos in inv_counter_objects['onion']:
-                counter_objects[pos] = 'onion'
-        if 'dish' in inv_counter_objects:
-            for pos in inv_counter_objects['dish']:
-                counter_objects[pos] = 'plate'
-        if 'soup' in inv_counter_objects:
-            for pos in inv_counter_objects['soup']:
-                counter_objects[pos] = 'soup in plate'
-        for idx, pos in enumerate(self.object_location[f'{counter_type[0]}']):
-            if pos in counter_objects:
-                self.state_for_llm[f'{counter_type}_counter_objects'][idx] = counter_objects[pos]
-            else:
-                self.state_for_llm[f'{counter_type}_counter_objects'][idx] = 'empty'
-    
-    
-
-    def get_stage_from_llm(self, state, other_player_message):
-        state_dict = state.to_dict()
-
-        # Deal with objects on the counter
-        
-        if self.layout_name in ['forced_coordination', 'counter_circuit_o_1order', 'soup_passing']:
-            self._populate_counter_objects(state, counter_type='storage')
-        
-        self._populate_counter_objects(state, counter_type='kitchen')
-
-        # # print(f"{bcolors.FAIL}{self.state_for_llm['counter_objects']}{bcolors.ENDC}")
-        # What are the 2 players holding? 
-        if state_dict['players'][int(self.player_id)]['held_object'] != None:
-            if state_dict['players'][int(self.player_id)]['held_object']['name']  == 'dish':
-                self.state_for_llm[self.player_id]['held_object'] = 'plate'
-            elif state_dict['players'][int(self.player_id)]['held_object']['name'] == 'soup':
-               self.state_for_llm[self.player_id]['held_object'] = 'soup in plate' 
-            else:
-                self.state_for_llm[self.player_id]['held_object'] = state_dict['players'][int(self.player_id)]['held_object']['name']
-        else:
-            self.state_for_llm[self.player_id]['held_object'] = 'nothing'
-        
-        if state_dict['players'][int(self.other_player_id)]['held_object'] != None:
-            if state_dict['players'][int(self.other_player_id)]['held_object']['name']  == 'dish':
-                self.state_for_llm[self.other_player_id]['held_object'] = 'plate'
-            elif state_dict['players'][int(self.other_player_id)]['held_object']['name'] == 'soup':
-               self.state_for_llm[self.other_player_id]['held_object'] = 'soup in plate' 
+        for idx in range(len(self.object_location[f'{counter_type[0]}'])):
+            self._populate_counter_object(state, counter_type, idx)
+
+    def _populate_counter_object(self, state, counter_type, idx):
+        pos = self.object_location[f'{counter_type[0]}'][idx]
+        obj_name = state.get_object(pos).name if state.has_object(pos) else None
+        self.state_for_llm[f'{counter_type}_counter_objects'][idx] = COUNTER_OBJECT_NAMES.get(obj_name, 'empty')
+
+    def _populate_held_objects(self, state):
+        for player_id in [self.player_id, self.other_player_id]:
+            held_object = state.players[player_id].held_object
+            if held_object is None:
+                self.state_for_llm[player_id]['held_object'] = 'nothing'
             else:
-                self.state_for_llm[self.other_player_id]['held_object'] = state_dict['players'][int(self.other_player_id)]['held_object']['name']
-        else:
-            self.state_for_llm[self.other_player_id]['held_object'] = 'nothing'
-        
+                self.state_for_llm[player_id]['held_object'] = HELD_OBJECT_NAMES.get(held_object.name, held_object.name)
 
-
-        
-        # pots, num onions in each pot and status of each pot 
-
-        self._populate_distances()
-        self._populate_pot_states(state)
+    def _populate_gate_states(self):
         for idx, gate in enumerate(self.object_location['g']):
             x, y = gate
             if self.mdp.terrain_mtx[y][x] == ' ':
@@ -533,6 +554,50 @@ class LLMActionManager(object):
             else:
                 self.state_for_llm['gate_status'][idx] = 'closed'
                 self.state_for_llm['gate_open_time'][idx] = 0
+
+    def extract_state_for_llm(self, state):
+        # Updates `state_for_llm` from the difference between `state` and the last extracted state: only pots and
+        # counters whose object changed, held objects if one changed, and the distances a move or a gate change affects
+        start_time = time.perf_counter()
+        self.set_player_pos_or(state)
+        objects = {pos: (obj.name, obj.state) for pos, obj in state.objects.items()}
+        held_objects = tuple(None if player.held_object is None else player.held_object.name for player in state.players)
+        gates = tuple((self.mdp.terrain_mtx[y][x], self.mdp.gate_states[(x, y)]) for x, y in self.object_location['g'])
+        walls = self.closed_gates()
+        positions = (self.player_position, self.other_player_position)
+
+        previous = self.last_extracted
+        if previous is None:
+            changed = set(self.pot_index) | set(self.counter_index)
+        else:
+            changed = {pos for pos in objects.keys() | previous['objects'].keys() if objects.get(pos) != previous['objects'].get(pos)}
+
+        for pos in changed:
+            if pos in self.pot_index:
+                self._populate_pot_state(state, self.pot_index[pos])
+            elif pos in self.counter_index:
+                self._populate_counter_object(state, *self.counter_index[pos])
+        if previous is None or previous['held_objects'] != held_objects:
+            self._populate_held_objects(state)
+        if previous is None or previous['gates'] != gates:
+            self._populate_gate_states()
+        if previous is None or previous['walls'] != walls:
+            self._populate_distances(0)
+            self._populate_distances(1)
+        else:
+            # Each player's distances are recomputed if they moved, and only where the other player moved in or out of the way otherwise
+            for column, other in [(0, 1), (1, 0)]:
+                if previous['positions'][column] != positions[column]:
+                    self._populate_distances(column)
+                elif previous['positions'][other] != positions[other]:
+                    self._populate_distances(column, moved_blocker=(previous['positions'][other], positions[other]))
+
+        self.last_extracted = {'objects': objects, 'held_objects': held_objects, 'gates': gates, 'walls': walls, 'positions': positions}
+        self.extraction_times.append(time.perf_counter() - start_time)
+        return self.state_for_llm
+
+    def get_stage_from_llm(self, state, other_player_message):
+        self.extract_state_for_llm(state)
         prev_stage = self.current_stage
         # if self.current_stage == 'put onion in c0.' and self.state_for_llm['num_onions_in_pot'][0] == 3:
         #     self.current_stage = 'turn on c0.'
@@ -540,6 +605,7 @@ class LLMActionManager(object):
         #     self.current_stage = 'turn on c1.'
         # else:
         self.current_stage, self.message = self.llm_agent.get_player_action(self.state_for_llm, other_player_message)
+        self.plan = None
         
         # if self.current_stage == 'move away from cooker.':
         #     if prev_stage.startswith('put onion in pot.'):
@@ -555,39 +621,7 @@ class LLMActionManager(object):
         self.should_get_stage_from_llm = False 
     
     def generate_state_for_llm(self, state):
-        state_dict = state.to_dict()
-
-        # Deal with objects on the counter
-        
-        if self.layout_name in ['forced_coordination', 'counter_circuit_o_1order']:
-            self._populate_counter_objects(state, counter_type='storage')
-        
-        self._populate_counter_objects(state, counter_type='kitchen')
-
-        # # print(f"{bcolors.FAIL}{self.state_for_llm['counter_objects']}{bcolors.ENDC}")
-        # What are the 2 players holding? 
-        if state_dict['players'][int(self.player_id)]['held_object'] != None:
-            if state_dict['players'][int(self.player_id)]['held_object']['name']  == 'dish':
-                self.state_for_llm[self.player_id]['held_object'] = 'plate'
-            else:
-                self.state_for_llm[self.player_id]['held_object'] = state_dict['players'][int(self.player_id)]['held_object']['name']
-        else:
-            self.state_for_llm[self.player_id]['held_object'] = 'nothing'
-        
-        if state_dict['players'][int(self.other_player_id)]['held_object'] != None:
-            if state_dict['players'][int(self.other_player_id)]['held_object']['name']  == 'dish':
-                self.state_for_llm[self.other_player_id]['held_object'] = 'plate'
-            else:
-                self.state_for_llm[self.other_player_id]['held_object'] = state_dict['players'][int(self.other_player_id)]['held_object']['name']
-        else:
-            self.state_for_llm[self.other_player_id]['held_object'] = 'nothing'
-        
-        # pots, num onions in each pot and status of each pot 
-
-        self._populate_distances()
-        self._populate_pot_states(state)
-
-        return self.state_for_llm
+        return self.extract_state_for_llm(state)
     
     def process_message(self, state, other_player_message):
         if other_player_message == '':
@@ -602,21 +636,19 @@ class LLMActionManager(object):
                 pass
             
     def set_player_pos_or(self, state):
-        state_dict = state.to_dict()
-        player_info = state_dict['players'][self.player_id]
-        self.player_position = player_info['position']
-        self.player_orientation = player_info['orientation']
+        player = state.players[self.player_id]
+        self.player_position = player.position
+        self.player_orientation = player.orientation
 
-        self.other_player_position = state_dict['players'][self.other_player_id]['position']
+        self.other_player_position = state.players[self.other_player_id].position
 
     def go_to_position(self, target_locs_arr, player_position, player_orientation):
+        blockers = self.closed_gates() + (self.other_player_position,)
         for target in target_locs_arr:
-            path = self.find_shortest_path(player_position, target)
-            if path:
-                next_action = self.get_next_action(player_position, player_orientation, path)
+            next_position = self.layout_distances.next_step(player_position, target, walls=blockers)
+            if next_position is not None:
+                next_action = self.get_next_action(player_position, player_orientation, [next_position])
                 return next_action
-            else:
-                continue
         return Action.STAY
 
     def fix_orientation(self, position, orientation, target_position):
@@ -694,37 +726,14 @@ class LLMActionManager(object):
         
         return locations_sorted_by_distance, pseudo_object_locations
 
-    def find_shortest_distance(self, p1, p_arr, other_player_position):
-        # Given a starting point and an array of points, find the shortest distance to any point in the array
-        shortest_distances = {p:math.inf for p in p_arr}
-        for p2 in p_arr:
-            directions = [(0, -1), (0, 1), (1, 0), (-1, 0)]  # Up, Down, Right, Left
-            queue = deque([(p1, 0)])
-            visited = set()
-
-            while queue:
-                current_pos, distance = queue.popleft()
-
-                if current_pos == p2:
-                    shortest_distances[p2] = distance
-
-                if current_pos in visited:
-                    continue
-
-                visited.add(current_pos)
-
-                for dx, dy in directions:
-                    new_x = current_pos[0] + dx
-                    new_y = current_pos[1] + dy
-                    new_pos = (new_x, new_y)
-
-                    if (self.mdp.get_terrain_type_at_pos(new_pos) == " ") and new_pos not in visited:
-                        if new_pos == other_player_position:
-                            if new_pos == p2:
-                                queue.append((new_pos, distance + 1))
-                        else:
-                            queue.append((new_pos, distance + 1))
+    def closed_gates(self):
+        return tuple(gate for gate in self.object_location['g'] if self.mdp.is_gate_closed(gate))
 
+    def find_shortest_distance(self, p1, p_arr, other_player_position):
+        # Given a starting point and an array of points, find the shortest distance to any point in the array.
+        # The other player can only be walked onto as the destination, closed gates not at all.
+        closed_gates = self.closed_gates()
+        shortest_distances = {p: self.layout_distances.distance(p1, p, walls=closed_gates, sinks=(other_player_position,)) for p in p_arr}
 
         min_dist = math.inf
         min_dest = None
@@ -813,35 +822,8 @@ class LLMActionManager(object):
     #     return None
     
     def find_shortest_path(self, p1, p2):
-        # Given two points, find the shortest path between them
-        directions = [(0, -1), (0, 1), (1, 0), (-1, 0)]  # Up, Down, Right, Left
-        queue = deque([(p1, [])])
-        visited = set()
-
-        while queue:
-            current_pos, path = queue.popleft()
-
-            if current_pos == p2:
-                return path
-
-            if current_pos in visited:
-                continue
-
-            visited.add(current_pos)
-
-            for dx, dy in directions:
-                new_x = current_pos[0] + dx
-                new_y = current_pos[1] + dy
-                new_pos = (new_x, new_y)
-
-                if self.mdp.get_terrain_type_at_pos(new_pos) == " " and new_pos not in visited and new_pos != self.other_player_position:
-                    queue.append((new_pos, path + [new_pos]))
-                
-                # TODO: Make a decision about this 
-                # elif str(self.mdp.get_terrain_type_at_pos(new_pos)) in ["1", "2"]:
-                #     self.should_get_stage_from_llm = True 
-
-        return None
+        # Given two points, find the shortest path between them, around the other player and closed gates
+        return self.layout_distances.path(p1, p2, walls=self.closed_gates() + (self.other_player_position,))
 
 
     def get_next_action(self, player_position, player_orientation, path):
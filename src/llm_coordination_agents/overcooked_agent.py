@@ -1,4 +1,3 @@
-from openai import OpenAI, AzureOpenAI
 import csv
 from tqdm import tqdm 
 import numpy as np  
@@ -12,6 +11,9 @@ import datetime
 import random 
 
 from overcooked_ai_py.mdp.actions import LLMActionSet
+from llm_coordination_agents.llm_client import get_llm_client, backend_for_model_type
+from llm_coordination_agents.llm_stream import action_parsed
+from llm_coordination_agents.llm_retry import LLMRequestError
 logging.basicConfig(filename='debug.log', level=logging.DEBUG)
 logging.debug('Initiated Logger...')
 import time 
@@ -80,9 +82,10 @@ EnvDescriptions_SingleAgentAblation = {
 }
 
 class LLMManager:
-    def __init__(self, model_name, model_type, cache_dir, temperature=0.6, do_sample=True, max_new_tokens=1000, top_p=0.9, frequency_penalty=0.0, presence_penalty=0.0, api_server=True):
+    def __init__(self, model_name, model_type, cache_dir, temperature=0.6, do_sample=True, max_new_tokens=1000, top_p=0.9, frequency_penalty=0.0, presence_penalty=0.0, api_server=True, agent_name=None):
         self.model_name = model_name 
         self.model_type = model_type
+        self.agent_name = agent_name if agent_name is not None else model_name
         self.temperature = temperature
         self.cache_dir = cache_dir
         self.do_sample = do_sample
@@ -96,30 +99,19 @@ class LLMManager:
         self.gpt_4_base_cost = 0.011
         self.gpt3_cost = 0
         self.gpt4_cost = 0
-        if self.model_type == 'openai':
-            self.akey = os.getenv("AZURE_OPENAI_ENDPOINT")
-            self.org = os.getenv("AZURE_OPENAI_API_KEY")
-            # self.client = OpenAI(api_key = self.akey, organization = self.org)
-            # self.client = AzureOpenAI(
-            #     azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT"), 
-            #     api_key=os.getenv("AZURE_OPENAI_API_KEY"),  
-            #     api_version="2023-05-15"
-            # )
-            self.client = OpenAI(
-                api_key=os.getenv("AZURE_OPENAI_API_KEY")
-            )
-        else:
-            self.client = OpenAI(
-                api_key="EMPTY",
-                base_url="http://localhost:8000/v1"
-            )
+        # All agents share one pooled client, openai models go through the OpenAI API and others through the local vLLM server
+        self.backend = backend_for_model_type(self.model_type)
+        self.client = get_llm_client()
         self.inference_fn = self.run_openai_inference                    
 
-    def run_openai_inference(self, messages):
+    def run_openai_inference(self, messages, call_type='generator', stop_when=None):
         api_call_start = time.time()
-        completion = self.client.chat.completions.create(
+        completion = self.client.chat(
+            self.backend,
             messages = messages,
             model=self.model_name,
+            call_info={'game': 'overcooked', 'agent': self.agent_name, 'call_type': call_type},
+            stop_when=stop_when,
             temperature=self.temperature,
             top_p=self.top_p,
             frequency_penalty=self.frequency_penalty,
@@ -140,9 +132,7 @@ class LLMAgent:
         
 
         # Controls 
-        self.DEBUG = False      
-        self.enable_cache = False # True    
-        self.write_to_cache = False 
+        self.DEBUG = False
         self.save_trajectory = True # True 
         # Enable kitchen counters only for GPT-4, other models cannot handle the complexity
         self.enable_kitchen_counters = True   
@@ -171,7 +161,7 @@ class LLMAgent:
             self.model_type = 'mistral'
             self.model = 'mixtral'
 
-        self.llm = LLMManager(model_name=self.model_name, model_type=self.model_type, cache_dir=os.getenv('HF_HOME'))
+        self.llm = LLMManager(model_name=self.model_name, model_type=self.model_type, cache_dir=os.getenv('HF_HOME'), agent_name=self.player_names[self.player_id])
 
         self.experiment_type = 'ai'
         
@@ -215,11 +205,17 @@ class LLMAgent:
         self.conventions = f'''1. We want to be efficient and prepare for the next soup while the current soup is cooking. 
         '''
 
-        self.pi_prompt = f'''I am {self.player_names[self.player_id]}. I am playing the game Overcooked with my partner {self.player_names[self.other_player_id]}. {EnvDescriptions[self.layout_name]} 
-        Overcooked has the following rules: {self.rules}. We have agreed to follow the following conventions: {self.conventions}. I'll provide my action history, current state, teammate's status, and my possible actions. Help me understand my partner's intentions and needs. describe what my partner intends to do or needs in one sentence only. Do not say anything else.'''
+        # Prompts go from the most to the least widely shared text (game, layout, player) so that requests of every
+        # turn, and of every game on the same layout, start with the same bytes and hit the server's prefix cache
+        self.game_prompt = f'''I am playing the game Overcooked with my partner. Overcooked has the following rules: {self.rules}. We have agreed to follow the following conventions: {self.conventions}.'''
+        self.player_prompt = f'''{EnvDescriptions[self.layout_name]}
+        I am {self.player_names[self.player_id]} and my partner is {self.player_names[self.other_player_id]}.'''
+
+        self.pi_prompt = f'''{self.game_prompt} I'll provide my action history, current state, teammate's status, and my possible actions. Help me understand my partner's intentions and needs. describe what my partner intends to do or needs in one sentence only. Do not say anything else.
+        {self.player_prompt}'''
 
-        self.verifier_prompt = f'''I am {self.player_names[self.player_id]}. I am playing the game Overcooked with my partner {self.player_names[self.other_player_id]}. {EnvDescriptions[self.layout_name]} 
-        Overcooked has the following rules: {self.rules}. We have agreed to follow the following conventions: {self.conventions}.'''
+        self.verifier_prompt = f'''{self.game_prompt}
+        {self.player_prompt}'''
 
         self.verifier_system_prompt = 'You are an action verification agent for Overcooked. I will provide you with my inventory, location information, and state information for me and my partner and my selected action. You need to check whether the action satisfies the criteria: 1. Rule Following: It follows to the rules of the game. 2. Convention Following: It adheres to the mentioned conventions 3. Safety: The selected action does not lead to the game being stuck. Your response should be Reasoning:<Brief Reasoning for Verification> followed by "Verification: Okay" if selected action follows **all three** criteria and "Verification: Not Okay" otherwise. Do not say anything else. Got it?'
         
@@ -229,8 +225,8 @@ class LLMAgent:
         # Overcooked has the following rules: {self.rules}. We have agreed to follow the following conventions: {self.conventions}. I'll provide my action history, current state, teammate's status, and my possible actions. Help me select the best action from the list. Format your response as: Explanation:<Brief explanation for my next action>. Action: <action>. Only select one action. Do not say anything else. Got it?'''
 
         # Without COT
-        self.base_prompt = f'''I am {self.player_names[self.player_id]}. I am playing the game Overcooked with my partner {self.player_names[self.other_player_id]}. {EnvDescriptions[self.layout_name]}
-        Overcooked has the following rules: {self.rules}. We have agreed to follow the following conventions: {self.conventions}. I'll provide my action history, current state, teammate's status, and my possible actions. Help me select the best action from the list. Format your response as: Action: <action>. Only select one action. Do not say anything else. Got it?'''
+        self.base_prompt = f'''{self.game_prompt} I'll provide my action history, current state, teammate's status, and my possible actions. Help me select the best action from the list. Format your response as: Action: <action>. Only select one action. Do not say anything else.
+        {self.player_prompt} Got it?'''
 
         # self.base_prompt = f'''I am {self.player_names[self.player_id]}. I am playing the game Overcooked with my partner {self.player_names[self.other_player_id]}. Overcooked has the following rules: {self.rules}. We have agreed to follow the following conventions: {self.conventions}. I'll provide my action history, current state, teammate's status, and my possible actions. Help me select the best action from the list. Format your response as: Action: <action>. Only select one action. Do not say anything else. Got it?'''
         self.assistant_response_initial = f'''Got it!'''
@@ -260,15 +256,9 @@ class LLMAgent:
                     ]
 
         self.summary_so_far = ''
-        self.tokens_used = 0 
-        if self.enable_cache:  
-            if os.path.isfile(self.cache_path):
-                self.cache = json.load(open(self.cache_path, 'r'))
-            else:
-                self.cache = {}
-        else:
-            self.cache = {}
-        
+        self.tokens_used = 0
+        # Identical requests are served from the shared client's response cache (set LLM_CACHE_PATH to enable)
+
         self.all_actions = []
         for key, value in self.action_set.items():
             if isinstance(value, list):
@@ -570,7 +560,7 @@ class LLMAgent:
 
     def infer_partner_state(self, description):
         partner_inference_message = self.pi_message + [{"role": "user", "content": f"{description}"}]
-        epistemic_response_string = self.llm.inference_fn(partner_inference_message)
+        epistemic_response_string = self.llm.inference_fn(partner_inference_message, call_type='partner_interpretation')
         print(f"{bcolors.OKGREEN}PARTNER INFERENCE: {epistemic_response_string}{bcolors.ENDC}")
         return epistemic_response_string
 
@@ -641,70 +631,62 @@ class LLMAgent:
                 np.save(self.trajectory_path,self.action_history)
         else:
             try: 
-                # cache which contains the selected action as value 
-                state_only_desc = state_description[state_description.find('state:'):]
-                if self.enable_cache and state_only_desc in self.cache:
-                    action, message = self.cache[state_only_desc]
-                else:
-                    if len(self.available_actions_list) > 1:
-                        messages = self.message + [{"role": "user", "content": state_description}]
-                        response_string = self.llm.inference_fn(messages=messages)
-                        print(f'''{bcolors.WARNING}LLM RESPONSE: {response_string}{bcolors.ENDC}''')
-                        action = self.find_best_match(response_string)
-
-
-                        ### Uncomment for verifier LLM ###
-                        # verification_response_string = ''
-                        # verifier_responses = []
-                        # verifier_description = f"State: {state_description.replace(self.partner_action_inference_string, '')}\n\n My Solution: {action}. Think step by step. Think about safety, think about rules, think about conventions. "
-                        # print(f'''{bcolors.WARNING}VERIFIER INPUT: {verifier_description}{bcolors.ENDC}''')
-                        # self.verifier_message = self.verifier_base_message + [{"role": "user", "content": verifier_description}]
-                        # verification_response_string = self.llm.inference_fn(self.verifier_message)
-                        # self.num_api_calls += 1
-                        # verifier_responses.append(verification_response_string)
-                        # print(f'''{bcolors.OKCYAN}VERIFICATION RESPONSE: {verification_response_string}{bcolors.ENDC}''')
-                        # counter = 0 
-                        # while 'verification: okay' not in verification_response_string.lower(): 
-                        #     if action in self.available_actions_list:  
-                        #         self.available_actions_list.remove(action)
-                        #     counter += 1
-                        #     self.generator_message.append({"role": "assistant", "content": response_string})
-                        #     updated_generator_message = f"Your selected action: {action} is not appropriate. {verification_response_string}. Please choose another action. List of Available Actions:\n{self.available_actions_list}"
-
-
-                        #     messages.append({"role": "user", "content": updated_generator_message})
-                            
-                        #     response_string = self.llm.inference_f(messages)
-                        #     self.num_api_calls += 1
-                        #     print(f"{bcolors.WARNING}LLM CORRECTED RESPONSE: {response_string}{bcolors.ENDC}") 
-                        #     action = self.find_best_match(response_string)
-
-                        #     self.verifier_message[-1]["content"] = f"State: {state_description.replace(self.partner_action_inference_string, '')}\n\n My Solution: {action}. Think step by step. Think about safety, think about rules, think about conventions. "
-
-                        #     verification_response_string = self.llm.inference_f(self.verifier_message)
-                        #     self.num_api_calls += 1
-                        #     verifier_responses.append(verification_response_string) 
-                        #     print(f'''{bcolors.OKCYAN}VERIFICATION RESPONSE: {verification_response_string}{bcolors.ENDC}''')
-                            
-                        # add_to_dict_list(self.log_csv_dict, 'VERIFICATION Response', ' ***** '.join(verifier_responses)) 
-
-                        # verification_string = self.llm.inference_fn(messages=self.verifier_message + [{"role": "user", "content": f"My selected Action: {action}"}])
-                        # print('VERIFIER RESPONSE: ', verification_string)
-                        # while 'Verification: Okay' not in verification_string:
-                        #     messages += [{"role": "assistant", "content": response_string}] 
-                        #     messages += [{"role": "user", "content": verification_string}]
-                        #     response_string = self.llm.inference_fn(messages=messages)
-                        #     print(f'''{bcolors.WARNING}LLM RESPONSE: {response_string}{bcolors.ENDC}''')
-                        #     action = self.find_best_match(response_string)
-                            
-                        #     verification_string = self.llm.inference_fn(messages=self.verifier_message + [{"role": "user", "content": f"My selected Action: {action}"}])
+                if len(self.available_actions_list) > 1:
+                    messages = self.message + [{"role": "user", "content": state_description}]
+                    # Stop streaming as soon as the action line is complete
+                    response_string = self.llm.inference_fn(messages=messages, stop_when=action_parsed(self.available_actions_list))
+                    print(f'''{bcolors.WARNING}LLM RESPONSE: {response_string}{bcolors.ENDC}''')
+                    action = self.find_best_match(response_string)
+
+
+                    ### Uncomment for verifier LLM ###
+                    # verification_response_string = ''
+                    # verifier_responses = []
+                    # verifier_description = f"State: {state_description.replace(self.partner_action_inference_string, '')}\n\n My Solution: {action}. Think step by step. Think about safety, think about rules, think about conventions. "
+                    # print(f'''{bcolors.WARNING}VERIFIER INPUT: {verifier_description}{bcolors.ENDC}''')
+                    # self.verifier_message = self.verifier_base_message + [{"role": "user", "content": verifier_description}]
+                    # verification_response_string = self.llm.inference_fn(self.verifier_message)
+                    # self.num_api_calls += 1
+                    # verifier_responses.append(verification_response_string)
+                    # print(f'''{bcolors.OKCYAN}VERIFICATION RESPONSE: {verification_response_string}{bcolors.ENDC}''')
+                    # counter = 0 
+                    # while 'verification: okay' not in verification_response_string.lower(): 
+                    #     if action in self.available_actions_list:  
+                    #         self.available_actions_list.remove(action)
+                    #     counter += 1
+                    #     self.generator_message.append({"role": "assistant", "content": response_string})
+                    #     updated_generator_message = f"Your selected action: {action} is not appropriate. {verification_response_string}. Please choose another action. List of Available Actions:\n{self.available_actions_list}"
+
+
+                    #     messages.append({"role": "user", "content": updated_generator_message})
+                        
+                    #     response_string = self.llm.inference_f(messages)
+                    #     self.num_api_calls += 1
+                    #     print(f"{bcolors.WARNING}LLM CORRECTED RESPONSE: {response_string}{bcolors.ENDC}") 
+                    #     action = self.find_best_match(response_string)
+
+                    #     self.verifier_message[-1]["content"] = f"State: {state_description.replace(self.partner_action_inference_string, '')}\n\n My Solution: {action}. Think step by step. Think about safety, think about rules, think about conventions. "
+
+                    #     verification_response_string = self.llm.inference_f(self.verifier_message)
+                    #     self.num_api_calls += 1
+                    #     verifier_responses.append(verification_response_string) 
+                    #     print(f'''{bcolors.OKCYAN}VERIFICATION RESPONSE: {verification_response_string}{bcolors.ENDC}''')
+                        
+                    # add_to_dict_list(self.log_csv_dict, 'VERIFICATION Response', ' ***** '.join(verifier_responses)) 
+
+                    # verification_string = self.llm.inference_fn(messages=self.verifier_message + [{"role": "user", "content": f"My selected Action: {action}"}])
+                    # print('VERIFIER RESPONSE: ', verification_string)
+                    # while 'Verification: Okay' not in verification_string:
+                    #     messages += [{"role": "assistant", "content": response_string}] 
+                    #     messages += [{"role": "user", "content": verification_string}]
+                    #     response_string = self.llm.inference_fn(messages=messages)
+                    #     print(f'''{bcolors.WARNING}LLM RESPONSE: {response_string}{bcolors.ENDC}''')
+                    #     action = self.find_best_match(response_string)
+                        
+                    #     verification_string = self.llm.inference_fn(messages=self.verifier_message + [{"role": "user", "content": f"My selected Action: {action}"}])
 
-                    else:
-                        action = 'wait.'
-                    self.cache[state_only_desc] = (action, message)
-                    if self.write_to_cache:
-                        with open(self.cache_save_path, 'w') as f:
-                            json.dump(self.cache, f)
+                else:
+                    action = 'wait.'
                 print(f"{bcolors.OKBLUE}Number of API calls made by player {self.player_id}: {bcolors.ENDC}", self.num_api_calls)
                 # if action in self.all_actions:
                 if action in self.available_actions_list:
@@ -713,12 +695,11 @@ class LLMAgent:
                     print("WARNING: LLM returned an action that is not in the defined action set. ")
                     selected_action = 'wait.'
 
-            except Exception as e:
+            except LLMRequestError as e:
+                # Transient errors were already retried by the client, count the fallback so it shows up in the run summary
                 selected_action = 'wait.' 
+                self.llm.client.record_fallback(self.model_name)
                 print(f'Failed to get response from openai api for player {self.player_id} due to {e}')
-                # sys.exit(0)
-                time.sleep(1.)
-                pass
             add_to_dict_list(self.log_csv_dict, 'full_state_description', state_description)
             add_to_dict_list(self.log_csv_dict, 'selected_action', selected_action)
             add_to_dict_list(self.log_csv_dict, 'llm_response', response_string) 
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import os
+import time
+
+# (requests per minute, tokens per minute) of the deployments used for benchmarking. Model names are
+# matched by longest prefix. Override with LLM_RATE_LIMITS='{"gpt-4-0125": [480, 80000]}' or a JSON file path.
+DEFAULT_RATE_LIMITS = {
+    'openai': {
+        'gpt-4': (500, 300000),
+        'gpt-4o': (500, 300000),
+        'gpt-35-turbo': (3500, 160000),
+        'gpt-3.5-turbo': (3500, 160000),
+    },
+    'azure': {
+        'gpt-4': (480, 80000),
+        'gpt-4o': (480, 80000),
+        'gpt-35-turbo': (1440, 240000),
+    },
+    # The local vLLM server batches requests itself, only the client concurrency limit applies
+    'local': {},
+}
+
+# Completion tokens assumed for a request that does not set max_tokens, corrected once usage is known
+DEFAULT_COMPLETION_TOKENS = 256
+
+
+def estimate_prompt_tokens(messages):
+    return sum(len(m['content']) for m in messages) // 4
+
+
+def load_rate_limits():
+    limits = {backend: dict(models) for backend, models in DEFAULT_RATE_LIMITS.items()}
+    override = os.getenv("LLM_RATE_LIMITS")
+    if override:
+        if os.path.isfile(override):
+            with open(override, 'r') as f:
+                override = f.read()
+        override = json.loads(override)
+        # Either {"model": [rpm, tpm]} applied to every remote backend, or {"backend": {"model": [rpm, tpm]}}
+        for key, value in override.items():
+            if isinstance(value, dict):
+                limits.setdefault(key, {}).update({m: tuple(v) for m, v in value.items()})
+            else:
+                for backend in ['openai', 'azure']:
+                    limits[backend][key] = tuple(value)
+    return limits
+
+
+class TokenBucket:
+    '''Token bucket refilled continuously at `capacity` per minute.
+
+    Waiters are served in arrival order. `adjust` corrects a previous acquisition once the real
+    cost is known; the bucket may go into debt, which delays later requests accordingly.
+    '''
+    def __init__(self, capacity_per_minute):
+        self.capacity = float(capacity_per_minute)
+        self.rate = self.capacity / 60.
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, delta):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class RateLimiter:
+    '''Admits requests as fast as the requests-per-minute and tokens-per-minute limits of each
+    (backend, model) allow, shared by every game running in the process.'''
+    def __init__(self, limits=None):
+        self.limits = limits if limits is not None else load_rate_limits()
+        self._buckets = {}
+        self.wait_time = 0.
+
+    def _limit_for(self, backend, model):
+        best = None
+        for prefix, limit in self.limits.get(backend, {}).items():
+            if model.startswith(prefix) and (best is None or len(prefix) > len(best[0])):
+                best = (prefix, limit)
+        return None if best is None else best[1]
+
+    def _buckets_for(self, backend, model):
+        key = (backend, model)
+        if key not in self._buckets:
+            limit = self._limit_for(backend, model)
+            if limit is None:
+                self._buckets[key] = None
+            else:
+                rpm, tpm = limit
+                self._buckets[key] = (TokenBucket(rpm), TokenBucket(tpm))
+        return self._buckets[key]
+
+    def estimate_tokens(self, messages, params):
+        return estimate_prompt_tokens(messages) + params.get('max_tokens', DEFAULT_COMPLETION_TOKENS) * params.get('n', 1)
+
+    async def acquire(self, backend, model, estimated_tokens):
+        buckets = self._buckets_for(backend, model)
+        if buckets is None:
+            return
+        start = time.monotonic()
+        request_bucket, token_bucket = buckets
+        await request_bucket.acquire(1)
+        try:
+            await token_bucket.acquire(estimated_tokens)
+        except asyncio.CancelledError:
+            # Given up on (e.g. past its deadline), hand the request slot back
+            request_bucket.adjust(-1)
+            raise
+        self.wait_time += time.monotonic() - start
+
+    def settle(self, backend, model, estimated_tokens, actual_tokens):
+        buckets = self._buckets_for(backend, model)
+        if buckets is None or actual_tokens is None:
+            return
+        buckets[1].adjust(actual_tokens - estimated_tokens)
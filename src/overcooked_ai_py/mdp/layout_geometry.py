@@ -0,0 +1,177 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+from overcooked_ai_py.mdp.actions import Direction
+
+UNREACHABLE = -1
+
+
+def _frozen(array):
+    array.setflags(write=False)
+    return array
+
+
+class LayoutGeometry(object):
+    """Static geometry of one layout: what can be walked on, what is next to what, and how far apart
+    cells are. Built once per terrain and shared by every mdp, planner and agent of the process through
+    `get_layout_geometry`, so nothing in it may be mutated; derived results are memoized on first use.
+
+    Gates are closed in the base terrain ('G'). `passable` adds them to `walkable` for callers that
+    route through gates which may be opened.
+
+    Args:
+        terrain: rows of terrain characters, as in `OvercookedGridworld.terrain_mtx` before any gate opens
+    """
+
+    def __init__(self, terrain):
+        self.rows = tuple("".join(row) for row in terrain)
+        self.terrain = _frozen(np.array([list(row) for row in self.rows]))
+        self.height, self.width = self.terrain.shape
+        self.walkable = _frozen(self.terrain == " ")
+        self.gates = _frozen(self.terrain == "G")
+        self.passable = _frozen(self.walkable | self.gates)
+
+        # Positions of every terrain type in row-major order, like `OvercookedGridworld.terrain_pos_dict`
+        self.terrain_positions = {
+            str(t): tuple((int(x), int(y)) for y, x in np.argwhere(self.terrain == t))
+            for t in np.unique(self.terrain)
+        }
+        self.valid_player_positions = self.terrain_positions.get(" ", ())
+        self.walkable_cells = frozenset(self.valid_player_positions)
+        self.passable_cells = frozenset(self.valid_player_positions + self.terrain_positions.get("G", ()))
+
+        # The cells around every cell, in `Direction.ALL_DIRECTIONS` order (all 4 of them inside the border)
+        self.adjacent = {
+            (x, y): tuple(
+                (x + dx, y + dy)
+                for dx, dy in Direction.ALL_DIRECTIONS
+                if 0 <= x + dx < self.width and 0 <= y + dy < self.height
+            )
+            for y in range(self.height)
+            for x in range(self.width)
+        }
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        # Unpickling (or deep copying) an mdp or planner resolves to the shared geometry of its terrain
+        return (get_layout_geometry, (self.rows,))
+
+    def memoize(self, key, build):
+        """Returns the value stored under `key`, calling `build()` to compute it the first time."""
+        if key not in self._memo:
+            value = build()
+            with self._lock:
+                self._memo.setdefault(key, value)
+        return self._memo[key]
+
+    def terrain_at(self, pos):
+        x, y = pos
+        return self.rows[y][x]
+
+    def is_walkable(self, pos):
+        return pos in self.walkable_cells
+
+    def move(self, pos, direction):
+        """Position after stepping from `pos` in `direction` with every gate closed."""
+        new_pos = (pos[0] + direction[0], pos[1] + direction[1])
+        return new_pos if new_pos in self.walkable_cells else pos
+
+    def neighbors(self, pos, through_gates=False):
+        cells = self.passable_cells if through_gates else self.walkable_cells
+        return self.memoize(
+            ("neighbors", pos, through_gates),
+            lambda: tuple(p for p in self.adjacent.get(pos, ()) if p in cells),
+        )
+
+    def adjacent_features(self, pos):
+        """(cell, terrain type) of the 4 cells around `pos`, in `Direction.ALL_DIRECTIONS` order. Cells past the
+        border are indexed like `terrain_mtx` would be, as `OvercookedGridworld.get_adjacent_features` always did."""
+        return self.memoize(
+            ("adjacent_features", pos),
+            lambda: tuple(
+                ((pos[0] + dx, pos[1] + dy), self.terrain_at((pos[0] + dx, pos[1] + dy)))
+                for dx, dy in Direction.ALL_DIRECTIONS
+            ),
+        )
+
+    def interaction_cells(self, feature_pos):
+        """(cell, orientation) pairs a player can stand at and face to interact with the feature at `feature_pos`."""
+
+        def build():
+            x, y = feature_pos
+            cells = []
+            for direction in Direction.ALL_DIRECTIONS:
+                cell = (x - direction[0], y - direction[1])
+                if cell in self.walkable_cells:
+                    cells.append((cell, direction))
+            return tuple(cells)
+
+        return self.memoize(("interaction_cells", feature_pos), build)
+
+    def region_labels(self, through_gates=False):
+        """Grid of the connected region of every walkable (or passable) cell, -1 on the other cells."""
+
+        def build():
+            cells = self.passable_cells if through_gates else self.walkable_cells
+            labels = np.full(self.terrain.shape, -1, dtype=np.int32)
+            num_regions = 0
+            for start in sorted(cells, key=lambda p: (p[1], p[0])):
+                if labels[start[1], start[0]] != -1:
+                    continue
+                labels[start[1], start[0]] = num_regions
+                queue = deque([start])
+                while queue:
+                    pos = queue.popleft()
+                    for p in self.neighbors(pos, through_gates):
+                        if labels[p[1], p[0]] == -1:
+                            labels[p[1], p[0]] = num_regions
+                            queue.append(p)
+                num_regions += 1
+            return _frozen(labels)
+
+        return self.memoize(("region_labels", through_gates), build)
+
+    def same_region(self, pos1, pos2, through_gates=False):
+        labels = self.region_labels(through_gates)
+        return labels[pos1[1], pos1[0]] != -1 and labels[pos1[1], pos1[0]] == labels[pos2[1], pos2[0]]
+
+    def distances_from(self, pos, through_gates=False):
+        """Grid of walking distances from `pos` to every cell, -1 where a cell cannot be reached."""
+
+        def build():
+            distances = np.full(self.terrain.shape, UNREACHABLE, dtype=np.int32)
+            distances[pos[1], pos[0]] = 0
+            queue = deque([pos])
+            while queue:
+                current = queue.popleft()
+                for p in self.neighbors(current, through_gates):
+                    if distances[p[1], p[0]] == UNREACHABLE:
+                        distances[p[1], p[0]] = distances[current[1], current[0]] + 1
+                        queue.append(p)
+            return _frozen(distances)
+
+        return self.memoize(("distances_from", pos, through_gates), build)
+
+    def distance(self, pos1, pos2, through_gates=False):
+        """Walking distance between two cells, np.inf if there is no path."""
+        d = self.distances_from(pos1, through_gates)[pos2[1], pos2[0]]
+        return np.inf if d == UNREACHABLE else int(d)
+
+
+_shared_geometries = {}
+_shared_geometries_lock = threading.Lock()
+
+
+def get_layout_geometry(terrain):
+    """The shared `LayoutGeometry` of `terrain`, built the first time the terrain is seen in this process."""
+    key = tuple("".join(row) for row in terrain)
+    geometry = _shared_geometries.get(key)
+    if geometry is None:
+        with _shared_geometries_lock:
+            if key not in _shared_geometries:
+                _shared_geometries[key] = LayoutGeometry(key)
+            geometry = _shared_geometries[key]
+    return geometry
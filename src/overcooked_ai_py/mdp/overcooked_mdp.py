@@ -3322,6 +3322,7 @@ from collections import defaultdict
 from overcooked_ai_py.utils import pos_distance, load_from_json
 from overcooked_ai_py.utils import read_layout_dict
 from overcooked_ai_py.mdp.actions import Action, Direction
+from overcooked_ai_py.mdp.layout_geometry import get_layout_geometry
 
 
 
@@ -3697,6 +3698,7 @@ class OvercookedGridworld(object):
         self.width = len(terrain[0])
         self.shape = (self.width, self.height)
         self.terrain_mtx = terrain
+        self.geometry = get_layout_geometry(terrain)
         self.terrain_pos_dict = self._get_terrain_type_pos_dict()
         self.initialize_gates()
         self.start_player_positions = start_player_positions
@@ -3882,6 +3884,9 @@ class OvercookedGridworld(object):
     def get_valid_player_positions(self):
         return self.terrain_pos_dict[' '] 
 
+    def is_valid_player_position(self, pos):
+        return self.geometry.is_walkable(pos)
+
     def get_valid_joint_player_positions(self):
         """Returns all valid tuples of the form (p0_pos, p1_pos, p2_pos, ...)"""
         valid_positions = self.get_valid_player_positions() 
@@ -3911,9 +3916,11 @@ class OvercookedGridworld(object):
     def get_adjacent_features(self, player):
         adj_feats = []
         pos = player.position
-        for d in Direction.ALL_DIRECTIONS:
-            adj_pos = Action.move_in_direction(pos, d)
-            adj_feats.append((pos, self.get_terrain_type_at_pos(adj_pos)))
+        for adj_pos, feat in self.geometry.adjacent_features(pos):
+            if feat == 'G':
+                # Gates are the only terrain that changes during a game
+                feat = self.get_terrain_type_at_pos(adj_pos)
+            adj_feats.append((pos, feat))
         return adj_feats
 
     def is_gate_closed(self, pos):
@@ -4215,9 +4222,8 @@ class OvercookedGridworld(object):
 
     def _get_terrain_type_pos_dict(self):
         pos_dict = defaultdict(list)
-        for y, terrain_row in enumerate(self.terrain_mtx):
-            for x, terrain_type in enumerate(terrain_row):
-                pos_dict[terrain_type].append((x, y))
+        for terrain_type, positions in self.geometry.terrain_positions.items():
+            pos_dict[terrain_type] = list(positions)
         return pos_dict
 
     def _move_if_direction(self, position, orientation, action):
@@ -4227,8 +4233,8 @@ class OvercookedGridworld(object):
             return position, orientation
         new_pos = Action.move_in_direction(position, action)
         new_orientation = orientation if action == Action.STAY else action
-        if new_pos not in self.get_valid_player_positions():
-            if new_pos in self.get_gate_locations():
+        if not self.is_valid_player_position(new_pos):
+            if new_pos in self.gate_states:
                 if self.gate_states[new_pos][0] == 'open':
                     return new_pos, new_orientation
             return position, new_orientation
@@ -4252,7 +4258,7 @@ class OvercookedGridworld(object):
                 # TODO: If agent is standing on gate, move him to the position it came from 
                 assert self.gate_states[pos][0] == 'open'
             else:
-                assert pos in self.get_valid_player_positions()
+                assert self.is_valid_player_position(pos)
 
             # Check that held objects have the same position
             if player_state.held_object is not None:
@@ -313,13 +313,25 @@ class MotionPlanner(object):
         return action_plan, pos_and_or_path, len(action_plan)
 
     def _graph_from_grid(self):
-        """Creates a graph adjacency matrix from an Overcooked MDP class."""
-        state_decoder = {}
-        for state_index, motion_state in enumerate(
-            self.mdp.get_valid_player_positions_and_orientations()
-        ):
-            state_decoder[state_index] = motion_state
+        """Creates a graph adjacency matrix from an Overcooked MDP class.
+
+        The graph only depends on the layout geometry, so it is built once per layout
+        and planner class and shared by every planner of the process.
+        """
+        geometry = self.mdp.geometry
+        return geometry.memoize(
+            ("motion_graph", type(self).__name__),
+            lambda: self._build_graph(geometry),
+        )
 
+    def _build_graph(self, geometry):
+        state_decoder = dict(
+            enumerate(
+                (pos, d)
+                for pos in geometry.valid_player_positions
+                for d in Direction.ALL_DIRECTIONS
+            )
+        )
         pos_encoder = {
             motion_state: state_index
             for state_index, motion_state in state_decoder.items()
@@ -327,14 +339,14 @@ class MotionPlanner(object):
         num_graph_nodes = len(state_decoder)
 
         adjacency_matrix = np.zeros((num_graph_nodes, num_graph_nodes))
-        for state_index, start_motion_state in state_decoder.items():
-            for (
-                action,
-                successor_motion_state,
-            ) in self._get_valid_successor_motion_states(start_motion_state):
-                adj_pos_index = pos_encoder[successor_motion_state]
+        for state_index, (position, orientation) in state_decoder.items():
+            for action in Action.ALL_ACTIONS:
+                if action in Direction.ALL_DIRECTIONS:
+                    successor_motion_state = (geometry.move(position, action), action)
+                else:
+                    successor_motion_state = (position, orientation)
                 adjacency_matrix[state_index][
-                    adj_pos_index
+                    pos_encoder[successor_motion_state]
                 ] = self._graph_action_cost(action)
 
         return Graph(adjacency_matrix, pos_encoder, state_decoder)
@@ -1,3 +1,4 @@
+import copy
 import cProfile
 import io
 import json
@@ -220,10 +221,16 @@ def profile(fnc):
     return inner
 
 
+_layout_dicts = {}
+
+
 def read_layout_dict(layout_name):
-    return load_dict_from_file(
-        os.path.join(LAYOUTS_DIR, layout_name + ".layout")
-    )
+    # Layout files are parsed once per process, callers get their own copy to modify
+    if layout_name not in _layout_dicts:
+        _layout_dicts[layout_name] = load_dict_from_file(
+            os.path.join(LAYOUTS_DIR, layout_name + ".layout")
+        )
+    return copy.deepcopy(_layout_dicts[layout_name])
 
 
 class classproperty(property):
@@ -0,0 +1,98 @@
+import json
+import random
+from statistics import NormalDist
+
+from answer_extraction import QUESTION_TYPES
+
+
+def z_value(level):
+    return NormalDist().inv_cdf(0.5 + level / 2)
+
+
+def interleaved_order(strata, seed=0):
+    # Rows of every stratum in a seeded random order, taken round-robin so every prefix of the order is stratified
+    rng = random.Random(seed)
+    shuffled = {}
+    for stratum in sorted(strata):
+        shuffled[stratum] = list(strata[stratum])
+        rng.shuffle(shuffled[stratum])
+    order = []
+    for i in range(max((len(rows) for rows in shuffled.values()), default=0)):
+        for stratum, rows in shuffled.items():
+            if i < len(rows):
+                order.append((stratum, rows[i]))
+    return order
+
+
+class StratifiedAccuracy:
+    '''Accuracy per question type estimated from a sample of the questions of every (game, qtype) stratum.
+
+    Games are weighted by their share of the dataset, like the full-run accuracy. The variance of a stratum
+    uses the (k + 1) / (n + 2) smoothed accuracy, so a few all-correct answers do not look certain, and the
+    finite population correction, so a fully sampled stratum contributes no uncertainty.
+    '''
+    def __init__(self, stratum_sizes):
+        self.sizes = dict(stratum_sizes)
+        self.correct = {stratum: 0 for stratum in self.sizes}
+        self.answered = {stratum: 0 for stratum in self.sizes}
+
+    def add(self, stratum, correct):
+        self.correct[stratum] += correct
+        self.answered[stratum] += 1
+
+    def min_answered(self):
+        return min(self.answered.values(), default=0)
+
+    def estimate(self, qtype):
+        strata = [s for s in self.sizes if s[1] == qtype]
+        total = sum(self.sizes[s] for s in strata)
+        accuracy, variance = 0., 0.
+        for s in strata:
+            n, size = self.answered[s], self.sizes[s]
+            weight = size / total
+            smoothed = (self.correct[s] + 1) / (n + 2)
+            accuracy += weight * (self.correct[s] / n if n > 0 else smoothed)
+            if n < size:
+                variance += weight ** 2 * smoothed * (1 - smoothed) / max(n, 1) * (size - n) / max(size - 1, 1)
+        return accuracy, variance
+
+    def interval(self, qtype, z):
+        accuracy, variance = self.estimate(qtype)
+        return accuracy - z * variance ** 0.5, accuracy + z * variance ** 0.5
+
+    @classmethod
+    def from_results(cls, path, scenario_games, model=None, trial=0):
+        # Estimate of another model from its result stream, over the same rows
+        sizes = {}
+        for game in scenario_games:
+            for qtype in QUESTION_TYPES:
+                sizes[(game, qtype)] = sizes.get((game, qtype), 0) + 1
+        estimate = cls(sizes)
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record['trial'] == trial and (model is None or record['model'] == model) and record['row'] < len(scenario_games):
+                    estimate.add((scenario_games[record['row']], record['qtype']), record['correct'])
+        return estimate
+
+
+def stop_reason(estimate, z, target_width, reference=None, min_per_stratum=5):
+    # None while sampling should go on, otherwise why it can stop
+    if estimate.min_answered() < min_per_stratum:
+        return None
+    widths = [2 * z * estimate.estimate(qtype)[1] ** 0.5 for qtype in QUESTION_TYPES]
+    if all(width <= target_width for width in widths):
+        return f'every interval is at most {target_width} wide'
+    if reference is not None:
+        separated = True
+        for qtype in QUESTION_TYPES:
+            accuracy, variance = estimate.estimate(qtype)
+            reference_accuracy, reference_variance = reference.estimate(qtype)
+            if abs(accuracy - reference_accuracy) <= z * (variance + reference_variance) ** 0.5:
+                separated = False
+        if separated:
+            return 'every question type is separated from the reference model'
+    return None
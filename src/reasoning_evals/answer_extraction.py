@@ -0,0 +1,148 @@
+import json
+import re
+
+from fuzzywuzzy import fuzz, process, utils
+
+QUESTION_TYPES = ['EC', 'TOM', 'JP']
+
+ANSWER_TEXT_REGEXES = [re.compile(r"Action:\s*(.*)"), re.compile(r"Answer:\s*(.*)")]
+ORDINAL_REGEX = re.compile(r'([A-Z])[\.\)]')
+OPTION_PREFIX_REGEX = re.compile(r'^[a-z]\.\s*')
+NORMALIZE_REGEX = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text):
+    return NORMALIZE_REGEX.sub(' ', text.lower()).strip()
+
+
+def parse_options(question):
+    # Options are the lines after 'Available Actions:' / 'Available Answers:', without their 'a. ' ordinals
+    lowered = question.strip().lower()
+    if 'actions' in lowered:
+        lines = lowered.split('available actions:')[-1].split('\n')
+    elif 'answer' in lowered:
+        lines = lowered.split('available answers:')[-1].split('\n')
+    else:
+        lines = []
+    return [OPTION_PREFIX_REGEX.sub('', line).strip() for line in lines if line not in ['', ' ']]
+
+
+def random_option_count(question):
+    # Number of options the random baseline draws from: every line after the heading, blank ones included
+    lowered = question.strip().lower()
+    if 'actions' in lowered:
+        return len(lowered.split('available actions:')[-1].split('\n'))
+    elif 'answer' in lowered:
+        return len(lowered.split('available answers:')[-1].split('\n'))
+    return 0
+
+
+def get_answer_text(inference):
+    for regex in ANSWER_TEXT_REGEXES:
+        match = regex.search(inference)
+        if match:
+            return match.group(1)
+    return None
+
+
+class QuestionOptions:
+    '''The options of one question, parsed once and indexed for matching answers against them.
+
+    `exact` and `normalized` map an option (lowercased, or with punctuation and extra whitespace removed)
+    to its ordinal, `processed` holds the options as the fuzzy scorer sees them.
+    '''
+    def __init__(self, question, correct_ordinals='', options=None):
+        self.options = parse_options(question) if options is None else options
+        self.correct = set(str(correct_ordinals).split(','))
+        self.exact = {}
+        self.normalized = {}
+        for i, option in enumerate(self.options):
+            self.exact.setdefault(option, chr(i + 65))
+            self.normalized.setdefault(normalize(option), chr(i + 65))
+        self.processed = {i: utils.full_process(option) for i, option in enumerate(self.options)}
+
+    def match(self, answer_text):
+        answer_text = OPTION_PREFIX_REGEX.sub('', answer_text.strip().lower()).strip()
+        if answer_text in self.exact:
+            return self.exact[answer_text]
+        normalized = normalize(answer_text)
+        if normalized in self.normalized:
+            return self.normalized[normalized]
+        query = utils.full_process(answer_text)
+        if len(self.processed) == 0 or query == '':
+            return None
+        _, _, index = process.extractOne(query, self.processed, processor=None, scorer=fuzz.WRatio)
+        return chr(index + 65)
+
+    def extract(self, inference):
+        # Same precedence as the original fuzzy matcher: an explicit ordinal in the 'Action:'/'Answer:' line
+        # (or anywhere, without one), then the option that line names.
+        answer_text = get_answer_text(inference)
+        if answer_text is None:
+            answer_text = inference
+        match = ORDINAL_REGEX.search(answer_text)
+        if match:
+            return match.group(1)
+        for marker in ['Action:', 'Answer:']:
+            start = answer_text.find(marker)
+            if start != -1:
+                answer_text = answer_text[start + len(marker):]
+                break
+        return self.match(answer_text)
+
+
+class AnswerExtractor:
+    '''Options of every question of a dataset, keyed by (row, qtype) and parsed once when it is loaded.
+
+    `extract` returns the ordinal an inference selects (or None if it cannot be matched to any option),
+    `score_records` / `score_results_file` re-score saved result records in one pass.
+    '''
+    def __init__(self, df):
+        self.questions = {}
+        for row in range(len(df)):
+            scenario_row = df.iloc[row]
+            for qtype in QUESTION_TYPES:
+                self.questions[(row, qtype)] = QuestionOptions(scenario_row[f'{qtype} Question'], scenario_row[f'{qtype} Answer Ordinal'])
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        # Uses the options a `BenchmarkDataset` parsed when it was built
+        extractor = cls.__new__(cls)
+        extractor.questions = {}
+        for row in range(len(dataset)):
+            for qtype in QUESTION_TYPES:
+                extractor.questions[(row, qtype)] = QuestionOptions(dataset.value(f'{qtype} Question', row), dataset.value(f'{qtype} Answer Ordinal', row),
+                                                                    options=dataset.question_options(row, qtype))
+        return extractor
+
+    def extract(self, row, qtype, inference):
+        return self.questions[(row, qtype)].extract(inference)
+
+    def extract_batch(self, items):
+        # items: (row, qtype, inference) tuples
+        return [self.extract(row, qtype, inference) for row, qtype, inference in items]
+
+    def score_records(self, records):
+        scored = []
+        for record in records:
+            record = dict(record)
+            if record['inference'] is not None:
+                answer = self.extract(record['row'], record['qtype'], record['inference'])
+                record['answer'] = '2' if answer is None else answer
+            elif record['answer'] is None:
+                # The random baseline records its expected accuracy, there is no answer to score
+                scored.append(record)
+                continue
+            record['correct'] = int(record['answer'] in self.questions[(record['row'], record['qtype'])].correct)
+            scored.append(record)
+        return scored
+
+    def score_results_file(self, path):
+        with open(path, 'r') as f:
+            records = []
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return self.score_records(records)
@@ -0,0 +1,139 @@
+import os
+import pickle
+import random
+import sys
+from array import array
+
+import pandas as pd
+
+from answer_extraction import QUESTION_TYPES, parse_options
+
+CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', '.cache')
+
+
+class BenchmarkDataset:
+    '''A benchmark CSV stored column-wise over a table of unique cell values.
+
+    Every cell is an index into `values`, so a game description shared by hundreds of rows is held (and
+    hashed, compared, sent to the prompt builder) as one interned string. Cells are parsed by pandas, as
+    `pd.read_csv` would, and `dtypes` keeps the type of every column so `to_frame` returns the same frame.
+    The answer options of every question are parsed once and stored the same way in `options[qtype]`, and
+    `prefixes[qtype]` holds the static start of its prompt, the game description and the directive joined
+    as the local chat templates send them. `row_ids` are the rows of the original CSV, kept through
+    `subset` / `stratified_sample`.
+    '''
+    def __init__(self, values, columns, dtypes, options, prefixes, row_ids):
+        self.values = values
+        self.columns = columns
+        self.dtypes = dtypes
+        self.options = options
+        self.prefixes = prefixes
+        self.row_ids = row_ids
+
+    @classmethod
+    def from_csv(cls, path):
+        frame = pd.read_csv(path)
+        # A missing cell (NaN) is not equal to itself, all of them share the first entry
+        values = [float('nan')]
+        value_ids = {}
+
+        def intern(value):
+            if pd.isna(value):
+                return 0
+            key = (type(value), value)
+            if key not in value_ids:
+                value_ids[key] = len(values)
+                values.append(sys.intern(value) if isinstance(value, str) else value)
+            return value_ids[key]
+
+        names = [name for name in frame.columns if not name.startswith('Unnamed:')]
+        columns = {name: array('I', (intern(value) for value in frame[name].tolist())) for name in names}
+        dtypes = {name: frame[name].dtype for name in names}
+        options = {}
+        prefixes = {}
+        for qtype in QUESTION_TYPES:
+            if f'{qtype} Question' in columns:
+                options[qtype] = [array('I', (intern(option) for option in parse_options(values[i]))) for i in columns[f'{qtype} Question']]
+            if f'{qtype} Directive' in columns and 'Game Description' in columns:
+                prefixes[qtype] = array('I', (intern(values[g] + '\n' + values[d]) if g != 0 and d != 0 else 0
+                                              for g, d in zip(columns['Game Description'], columns[f'{qtype} Directive'])))
+        return cls(values, columns, dtypes, options, prefixes, array('I', range(len(frame))))
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    def value(self, column, row):
+        return self.values[self.columns[column][row]]
+
+    def row(self, row):
+        return {column: self.values[ids[row]] for column, ids in self.columns.items()}
+
+    def question_options(self, row, qtype):
+        return [self.values[i] for i in self.options[qtype][row]]
+
+    def prompt_prefixes(self):
+        # (directive, game description) -> the two joined, for every question of the dataset
+        return {(self.value(f'{qtype} Directive', row), self.value('Game Description', row)): self.values[ids[row]]
+                for qtype, ids in self.prefixes.items() for row in range(len(self)) if ids[row] != 0}
+
+    def subset(self, rows):
+        return BenchmarkDataset(self.values,
+                                {column: array('I', (ids[r] for r in rows)) for column, ids in self.columns.items()},
+                                self.dtypes,
+                                {qtype: [options[r] for r in rows] for qtype, options in self.options.items()},
+                                {qtype: array('I', (ids[r] for r in rows)) for qtype, ids in self.prefixes.items()},
+                                array('I', (self.row_ids[r] for r in rows)))
+
+    def stratified_sample(self, n, seed=0, column='Game'):
+        # n rows of every value of `column` (all of them if it has fewer), the same rows for the same seed
+        if column not in self.columns:
+            groups = {None: list(range(len(self)))}
+        else:
+            groups = {}
+            for r in range(len(self)):
+                groups.setdefault(self.value(column, r), []).append(r)
+        rng = random.Random(seed)
+        rows = []
+        for value in sorted(groups, key=str):
+            rows.extend(sorted(rng.sample(groups[value], min(n, len(groups[value])))))
+        return self.subset(rows)
+
+    def to_frame(self):
+        # The frame `pd.read_csv` gives for these rows, with the original column types and NaN for missing cells
+        return pd.DataFrame({column: pd.Series([self.values[i] for i in ids], dtype=self.dtypes[column]) for column, ids in self.columns.items()})
+
+    def save(self, path, source_stat=None):
+        with open(path, 'wb') as f:
+            pickle.dump((CACHE_VERSION, source_stat, self.values, self.columns, self.dtypes, self.options, self.prefixes, self.row_ids),
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path, source_stat=None):
+        # None if the cache is from another version of this format or of the source CSV
+        with open(path, 'rb') as f:
+            cache = pickle.load(f)
+        if cache[0] != CACHE_VERSION or cache[1] != source_stat:
+            return None
+        values, columns, dtypes, options, prefixes, row_ids = cache[2:]
+        return cls([sys.intern(v) if isinstance(v, str) else v for v in values], columns, dtypes, options, prefixes, row_ids)
+
+
+def load_dataset(path, cache_dir=DEFAULT_CACHE_DIR):
+    '''Loads a benchmark CSV, from its columnar cache in `cache_dir` when the CSV has not changed since.'''
+    source = os.stat(path)
+    source_stat = (source.st_size, source.st_mtime_ns)
+    if cache_dir is None:
+        return BenchmarkDataset.from_csv(path)
+    cache_path = os.path.join(cache_dir, os.path.splitext(os.path.basename(path))[0] + '.pkl')
+    if os.path.exists(cache_path):
+        try:
+            dataset = BenchmarkDataset.load(cache_path, source_stat)
+        except (pickle.UnpicklingError, EOFError, ValueError):
+            dataset = None
+        if dataset is not None:
+            return dataset
+    dataset = BenchmarkDataset.from_csv(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    dataset.save(cache_path, source_stat)
+    return dataset
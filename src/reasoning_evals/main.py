@@ -7,8 +7,10 @@
 # 4. Score the model after running all inference - separate fuzzy scoring algorithm 
 
 import os 
-from openai import OpenAI, AzureOpenAI
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from llm_coordination_agents.llm_client import get_llm_client, backend_for_model_type
+from llm_coordination_agents.llm_metrics import completion_cost
+from llm_coordination_agents.llm_retry import LLMRequestError
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache
 import torch 
 import re 
 import numpy as np 
@@ -16,9 +18,15 @@ import json
 import pandas as pd 
 from tqdm import tqdm
 from dataclasses import dataclass 
-from fuzzywuzzy import process
+from answer_extraction import AnswerExtractor, QuestionOptions, QUESTION_TYPES
+from dataset import load_dataset
+from rescore import random_baseline
+from adaptive import StratifiedAccuracy, interleaved_order, stop_reason, z_value
 import time 
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import threading
 ISSUES = []
 
 @dataclass
@@ -41,7 +49,7 @@ class EvalDataPoint:
     ec_answer_desc: str
 
 class LLMManager:
-    def __init__(self, model_name, model_type, cache_dir, temperature=0.6, do_sample=True, max_new_tokens=1000, top_p=0.9, frequency_penalty=0.0, presence_penalty=0.0, api_server=True):
+    def __init__(self, model_name, model_type, cache_dir, temperature=0.6, do_sample=True, max_new_tokens=1000, top_p=0.9, frequency_penalty=0.0, presence_penalty=0.0, api_server=True, batch_size=8, reuse_prefix=True):
         self.model_name = model_name 
         self.model_type = model_type
         self.temperature = temperature
@@ -53,46 +61,43 @@ class LLMManager:
         self.presence_penalty = presence_penalty
         self.api_server = api_server
         self.device = 'cuda'
+        # Prompts generated together by local models
+        self.batch_size = batch_size
+        # Shared prompt prefixes (at least `min_prefix_tokens` long) are prefilled once and their KV cache reused
+        self.reuse_prefix = reuse_prefix
+        self.min_prefix_tokens = 64
+        self.max_cached_prefixes = 4
+        self.prefix_cache = {}
+        self.generation_stats = {'batches': 0, 'prompts': 0, 'prompt_tokens': 0, 'padding_tokens': 0, 'generated_tokens': 0, 'seconds': 0.,
+                                 'prefix_tokens_reused': 0, 'prefix_seconds': 0., 'prefill_seconds_saved': 0.}
         self.cost = 0
+        self.cost_lock = threading.Lock()
+        # Separates cached responses of repeated trials over the same prompts
+        self.cache_seed = None
         if not api_server:
             if self.model_type == 'openai':
-                self.akey = os.environ['API_KEY']
-                self.org = os.environ['ORGANIZATION']
-                self.client = OpenAI(api_key = self.akey, organization = self.org)
+                self.backend = 'openai'
+                self.client = get_llm_client()
                 self.inference_fn = self.run_openai_inference
             elif self.model_type == 'mistral':
-                self.device = "cuda" # the device to load the model onto
-                os.environ["TRANSFORMERS_CACHE"] = self.cache_dir
-                self.model = AutoModelForCausalLM.from_pretrained(self.model_name, device_map='auto', cache_dir=cache_dir)
-                self.tokenizer = AutoTokenizer.from_pretrained(self.model_name, cache_dir=cache_dir)
+                self.load_local_model()
                 self.inference_fn = self.run_mistral_inference
             elif self.model_type == 'vicuna':
-                os.environ["TRANSFORMERS_CACHE"] = self.cache_dir
-                self.model = AutoModelForCausalLM.from_pretrained(self.model_name, device_map='auto', cache_dir=cache_dir)
-                self.tokenizer = AutoTokenizer.from_pretrained(self.model_name, cache_dir=cache_dir)
+                self.load_local_model()
                 self.inference_fn = self.run_vicuna_inference
         else:
-            if self.model_type == 'openai':
-                self.akey = os.getenv("AZURE_OPENAI_ENDPOINT")
-                self.org = os.getenv("AZURE_OPENAI_API_KEY")
-                # self.client = OpenAI(api_key = self.akey, organization = self.org)
-                self.client = AzureOpenAI(
-                    azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT"), 
-                    api_key=os.getenv("AZURE_OPENAI_API_KEY"),  
-                    api_version="2023-05-15"
-                )
-                self.inference_fn = self.run_openai_inference
-            else:
-                self.akey = "EMPTY"
-                self.base_url = "http://localhost:8000/v1"
-                self.client = OpenAI(
-                    api_key=self.akey,
-                    base_url=self.base_url,
-                )
-                self.inference_fn = self.run_openai_inference
+            self.backend = backend_for_model_type(self.model_type, azure=True)
+            self.client = get_llm_client()
+            self.inference_fn = self.run_openai_inference
+
+    def load_local_model(self):
+        self.device = 'cuda' if torch.cuda.is_available() else 'cpu' # the device to load the model onto
+        os.environ["TRANSFORMERS_CACHE"] = self.cache_dir
+        self.model = AutoModelForCausalLM.from_pretrained(self.model_name, device_map='auto' if self.device == 'cuda' else None, cache_dir=self.cache_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name, cache_dir=self.cache_dir)
+        if self.tokenizer.pad_token_id is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
 
-                        
-    
     def inference_fn(self):
         if 'mistral' in self.model:
             return self.run_mistral_inference
@@ -100,162 +105,251 @@ class LLMManager:
             return self.run_vicuna_inference
         
 
-    def run_openai_inference(self, messages):
-        completion = self.client.chat.completions.create(
+    def run_openai_inference(self, messages, n=1):
+        completion = self.client.chat(
+            self.backend,
             messages = messages,
             model=self.model_name,
+            cache_seed=self.cache_seed,
+            call_info={'game': 'reasoning_evals', 'agent': self.model_name, 'call_type': 'generator'},
             temperature=self.temperature,
             top_p=self.top_p,
             frequency_penalty=self.frequency_penalty,
-            presence_penalty=self.presence_penalty
+            presence_penalty=self.presence_penalty,
+            **({'n': n} if n > 1 else {})
         )
         # print("INFERENCE STRING: ", completion.choices[0].message.content)
-        total_tokens = completion.usage.total_tokens
-        cur_cost =  0.015 * (total_tokens / 1000)
-        self.cost += cur_cost 
+        with self.cost_lock:
+            self.cost += completion_cost(self.model_name, completion.usage)
         # print(f"COST SO FAR: {self.cost} USD")
+        if n > 1:
+            return [choice.message.content for choice in completion.choices]
         return completion.choices[0].message.content
 
+    def run_samples(self, messages, n):
+        # n responses to the same prompt from one request, or one batched generate call for local models
+        if self.inference_fn == self.run_openai_inference:
+            return self.run_openai_inference(messages, n=n)
+        return self.run_local_batch([messages] * n)
+
         
 
+    def apply_vicuna_chat_template(self, messages): 
+        output = f'''A chat between a curious user and an artificial intelligence assistant. 
+            
+            '''
+        participants = ["USER", "ASSISTANT"]
+        for i, m in enumerate(messages):
+            turn = participants[i%2]
+            if turn == 'USER':
+                output += f"{turn}: {m['content']}\n"
+            else:
+                output += f"{turn}: {m['content']}</s>\n"
+        output += f"ASSISTANT: "
+        return output
+
+    def local_prompt_ids(self, messages):
+        if self.model_type == 'mistral':
+            return self.tokenizer.apply_chat_template(messages)
+        return self.tokenizer.encode(self.apply_vicuna_chat_template(messages))
+
+    def local_generation_kwargs(self):
+        if self.model_type == 'vicuna':
+            return {'max_new_tokens': 1000, 'do_sample': True, 'temperature': 0.7}
+        return {'max_new_tokens': self.max_new_tokens, 'do_sample': self.do_sample, 'temperature': self.temperature}
+
+    def encode_prefix(self, prefix_ids):
+        # KV cache of a shared prompt prefix, computed once and kept for the next prompts that start with it
+        key = tuple(prefix_ids)
+        if key not in self.prefix_cache:
+            if len(self.prefix_cache) >= self.max_cached_prefixes:
+                self.prefix_cache.pop(next(iter(self.prefix_cache)))
+            start_time = time.time()
+            with torch.no_grad():
+                past_key_values = self.model(torch.tensor([prefix_ids], dtype=torch.long, device=self.model.device), use_cache=True).past_key_values
+            if hasattr(past_key_values, 'to_legacy_cache'):
+                past_key_values = past_key_values.to_legacy_cache()
+            elapsed = time.time() - start_time
+            self.generation_stats['prefix_seconds'] += elapsed
+            self.prefix_cache[key] = (past_key_values, elapsed)
+        return self.prefix_cache[key]
+
+    def generate_batch(self, prompts, prefix_ids=None):
+        # Every prompt starts with `prefix_ids` if given. The prefix is then read from its KV cache and only the
+        # rest is padded (on the left, so generation continues right after every prompt) and prefilled.
+        prefix_length = 0 if prefix_ids is None else len(prefix_ids)
+        suffixes = [prompt[prefix_length:] for prompt in prompts]
+        width = max(len(suffix) for suffix in suffixes)
+        input_ids = torch.full((len(prompts), prefix_length + width), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(prompts), prefix_length + width), dtype=torch.long)
+        for row, suffix in enumerate(suffixes):
+            if prefix_length > 0:
+                input_ids[row, :prefix_length] = torch.tensor(prefix_ids, dtype=torch.long)
+                attention_mask[row, :prefix_length] = 1
+            input_ids[row, prefix_length + width - len(suffix):] = torch.tensor(suffix, dtype=torch.long)
+            attention_mask[row, prefix_length + width - len(suffix):] = 1
+
+        generation_kwargs = self.local_generation_kwargs()
+        if prefix_length > 0:
+            past_key_values, prefix_seconds = self.encode_prefix(prefix_ids)
+            generation_kwargs['past_key_values'] = DynamicCache.from_legacy_cache(tuple(
+                (k.expand(len(prompts), -1, -1, -1), v.expand(len(prompts), -1, -1, -1)) for k, v in past_key_values))
+            self.generation_stats['prefix_tokens_reused'] += prefix_length * len(prompts)
+            self.generation_stats['prefill_seconds_saved'] += prefix_seconds * len(prompts)
+
+        start_time = time.time()
+        with torch.no_grad():
+            generated_ids = self.model.generate(input_ids=input_ids.to(self.model.device), attention_mask=attention_mask.to(self.model.device),
+                                                pad_token_id=self.tokenizer.pad_token_id, **generation_kwargs)
+        new_ids = generated_ids[:, prefix_length + width:]
+        self.generation_stats['batches'] += 1
+        self.generation_stats['prompts'] += len(prompts)
+        self.generation_stats['prompt_tokens'] += int(attention_mask.sum())
+        self.generation_stats['padding_tokens'] += int((attention_mask == 0).sum())
+        self.generation_stats['generated_tokens'] += int((new_ids != self.tokenizer.pad_token_id).sum())
+        self.generation_stats['seconds'] += time.time() - start_time
+        return [self.tokenizer.decode(ids, skip_special_tokens=True) for ids in new_ids]
+
+    def run_local_batch(self, messages_list, prefix_keys=None):
+        # Prompts are sorted by length and generated `batch_size` at a time, so a batch is mostly real tokens.
+        # Prompts with the same prefix key (e.g. the game description) are batched together and share the KV cache
+        # of their common token prefix. Outputs are returned in the order of `messages_list`.
+        prompts = [self.local_prompt_ids(messages) for messages in messages_list]
+        groups = {}
+        for i in range(len(prompts)):
+            key = prefix_keys[i] if prefix_keys is not None and self.reuse_prefix else None
+            groups.setdefault(key, []).append(i)
+
+        outputs = [None] * len(prompts)
+        for key, members in groups.items():
+            prefix_ids = None
+            if key is not None and len(members) > 1:
+                # Keep at least one token of every prompt out of the prefix, generation needs an input to start from
+                common = os.path.commonprefix([prompts[i] for i in members])
+                prefix_ids = common[:min(len(prompts[i]) for i in members) - 1]
+                if len(prefix_ids) < self.min_prefix_tokens:
+                    prefix_ids = None
+            order = sorted(members, key=lambda i: len(prompts[i]))
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                for i, output in zip(batch, self.generate_batch([prompts[i] for i in batch], prefix_ids)):
+                    outputs[i] = output
+        return outputs
+
+    def format_generation_stats(self):
+        stats = self.generation_stats
+        padded = stats['prompt_tokens'] + stats['padding_tokens']
+        return (f"LOCAL GENERATION: {stats['prompts']} prompts in {stats['batches']} batches, "
+                f"{stats['generated_tokens']} tokens in {stats['seconds']:.1f}s "
+                f"({stats['generated_tokens'] / stats['seconds'] if stats['seconds'] > 0 else 0.:.1f} tokens/sec), "
+                f"padding: {stats['padding_tokens'] / padded if padded > 0 else 0.:.1%} of prompt tokens, "
+                f"prefix cache: {stats['prefix_tokens_reused']} prompt tokens reused, "
+                f"~{stats['prefill_seconds_saved'] - stats['prefix_seconds']:.1f}s of prefill saved")
+
     def run_mistral_inference(self, messages):
-        encodeds = self.tokenizer.apply_chat_template(messages, return_tensors="pt")
-        model_inputs = encodeds.to(self.device)
-        generated_ids = self.model.generate(model_inputs, max_new_tokens=self.max_new_tokens, do_sample=self.do_sample, temperature=self.temperature)
-        decoded = self.tokenizer.batch_decode(generated_ids)
-        return decoded[0].split('[/INST] ')[-1]
+        return self.run_local_batch([messages])[0]
 
     def run_vicuna_inference(self, messages):
-        def apply_vicuna_chat_template(messages): 
-            output = f'''A chat between a curious user and an artificial intelligence assistant. 
-            
-            '''
-            participants = ["USER", "ASSISTANT"]
-            for i, m in enumerate(messages):
-                turn = participants[i%2]
-                if turn == 'USER':
-                    output += f"{turn}: {m['content']}\n"
-                else:
-                    output += f"{turn}: {m['content']}</s>\n"
-            output += f"ASSISTANT: "
-            return self.tokenizer.encode(output, return_tensors="pt")
-        
-        encodeds = apply_vicuna_chat_template(messages)
-        model_inputs = encodeds.to(self.device)
-        generated_ids = self.model.generate(model_inputs, max_new_tokens=1000, do_sample=True, temperature=0.7)
-        decoded = self.tokenizer.batch_decode(generated_ids)
-        with open('question_inference_log.txt', 'a') as file:
-                    file.write('training example ' + str(self.counter) + ' :\n')
-                    file.write(f"DECODED OUTPUT:\n{decoded}\n")
-        return decoded[0].split("ASSISTANT: ")[-1]
+        return self.run_local_batch([messages])[0]
+
+
+class ResultStream:
+    '''Append-only JSONL log with one record per answered question, keyed by (model, trial, row, qtype).
+
+    Records are flushed as soon as they are appended, so a killed run loses at most the scenarios in flight.
+    With `resume` the records already in the file are loaded and kept, otherwise the file is started afresh.
+    '''
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.records = {}
+        self.lock = threading.Lock()
+        if resume and os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last line of a killed run may be cut off
+                        continue
+                    self.records[self.key(record)] = record
+            print(f"RESUMING FROM {path}: {len(self.records)} ANSWERS ALREADY RECORDED")
+        self.file = open(path, 'a' if resume else 'w')
+        if self.file.tell() > 0:
+            # Start on a fresh line after a cut off record
+            self.file.write('\n')
+
+    @staticmethod
+    def key(record):
+        return (record['model'], record['trial'], record['row'], record['qtype'])
+
+    def get(self, model, trial, row, qtype):
+        return self.records.get((model, trial, row, qtype))
+
+    def append(self, records):
+        with self.lock:
+            for record in records:
+                self.records[self.key(record)] = record
+                self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+
+    def trial_records(self, model, trial):
+        return sorted((r for r in self.records.values() if r['model'] == model and r['trial'] == trial), key=lambda r: (r['row'], QUESTION_TYPES.index(r['qtype'])))
+
+    def close(self):
+        self.file.close()
 
 
 class TestLLMCoordination:
-    def __init__(self, df, game_name, model, model_type, log_file='logs.json', num_trials=3):
+    def __init__(self, df, game_name, model, model_type, log_file='logs.json', num_trials=3, num_workers=1, resume=False, api_server=True, batch_size=8, reuse_prefix=True, multi_sample=True, dataset=None):
         self.game_name = game_name 
         self.df = df 
         self.model = model
         self.model_type = model_type 
-        self.llm = LLMManager(model_name=self.model, model_type=self.model_type, cache_dir='/data4/anthony/cache/hub')
+        self.llm = LLMManager(model_name=self.model, model_type=self.model_type, cache_dir='/data4/anthony/cache/hub', api_server=api_server, batch_size=batch_size, reuse_prefix=reuse_prefix)
         self.log_file = log_file
         self.num_trials = num_trials
         self.issues = []
-        self.log = {
-            'EC_ANSWERS': [],
-            'TOM_ANSWERS': [],
-            'JP_ANSWERS': []
-        }
-        self.counter = 0
-
-    def clear_logs(self):
-        self.log = {
-            'EC_ANSWERS': [],
-            'TOM_ANSWERS': [],
-            'JP_ANSWERS': []
-        }
+        self.results = ResultStream(self.log_file.replace('.','') + "_results.jsonl", resume=resume)
+        # Rows answered at once. Local HF models always run one row at a time.
+        if not self.llm.api_server:
+            num_workers = 1
+        self.num_workers = num_workers
+        # Local HF models generate the questions of several rows together, see `prefetch_local_inferences`
+        self.batch_local = not self.llm.api_server and self.llm.model_type in ['mistral', 'vicuna']
+        self.prefetched = {}
+        # Ask for the samples of all remaining trials of a question at once, see `sample_remaining_trials`
+        self.multi_sample = multi_sample and self.num_trials > 1 and self.llm.model_type != 'baseline'
+        # Scenarios and answer options are built once, from `dataset` (a BenchmarkDataset of `df`) when given
+        self.scenarios = [self.build_scenario(idx) for idx in range(len(self.df))]
+        self.extractor = AnswerExtractor(self.df) if dataset is None else AnswerExtractor.from_dataset(dataset)
+        # The random baseline is scored with its expected accuracy (rows, question types) instead of sampled answers
+        self.random_expected = random_baseline(self.df) if self.llm.model_type == 'baseline' else None
+        # The game description and directive of every question joined once, see `prompt_prefix`
+        self.prompt_prefixes = {} if dataset is None else dataset.prompt_prefixes()
 
     def __len__(self):
         return len(self.df)
 
     def find_answer_fuzzy(self, question_string, inference_string):
-        #global global_counter
-        #with open('question_inference_log.txt', 'a') as log_file:
-        #    lines = question_string.split('\n')
-        #    last_lines = '\n'.join(lines[-10:]) if len(lines) >= 10 else question_string
-        #    log_file.write(f"Log Entry {global_counter}:\nQuestion: {last_lines}\nInference: {inference_string}\n\n")
-        #    global_counter += 1
-        selected_ordinal = 'A'
-        def get_answer_ordinal(inference_string):
-            match = re.search(r'([A-Z])[\.\)]', inference_string)
-            if match:
-                return match.group(1)
-            else:
-                return None
-    
-        def get_answer_text(inference_string):
-            # print(inference_string)
-            action_regex = r"Action:\s*(.*)"
-            answer_regex = r"Answer:\s*(.*)"
-            match = re.search(action_regex, inference_string)
-            if match:
-                return match.group(1)
-            
-            match = re.search(answer_regex, inference_string)
-            if match:
-                return match.group(1)
-            
-            return None
-        
-        # If there is only one instance of Action: action then we get the action string 
-        answer_text = get_answer_text(inference_string)
-        # extract ordinal from the answer 
-        if answer_text == None:
-            answer_text = inference_string
-
-        selected_ordinal = get_answer_ordinal(answer_text)
-        
-        if selected_ordinal is None: 
-            action_list = []
-            # print("QUESTION STRING: ", question_string)
-            if 'actions' in question_string.strip().lower():
-                action_list = question_string.strip().lower().split('available actions:')[-1].split('\n')
-            elif 'answer' in question_string.strip().lower():
-                action_list = question_string.strip().lower().split('available answers:')[-1].split('\n') 
-                # print(action_list)
-            if '' in action_list:
-                action_list = [a for a in action_list if a != '']
-            if ' ' in action_list:
-                action_list = [a for a in action_list if a != ' ']
-            action_list = [re.sub(r'^[a-z]\.\s*', '', action).strip() for action in action_list]
-            action_start = answer_text.find("Action:")
-            if action_start == -1:
-                action_start = answer_text.find("Answer:")
-
-            if action_start == -1:
-                answer_text = re.sub(r'^[a-z]\.\s*', '', answer_text).strip()
-                best_match, score = process.extractOne(answer_text, action_list)
-                selected_ordinal = chr(action_list.index(best_match) + 65)
-            else:
-                answer_text = answer_text[action_start + 7:].strip()
-                answer_text = re.sub(r'^[a-z]\.\s*', '', answer_text).strip()
-                best_match, score = process.extractOne(answer_text, action_list)
-                selected_ordinal = chr(action_list.index(best_match) + 65)
-        
+        # For questions outside the dataset, `self.extractor` has the options of every dataset question parsed already
+        selected_ordinal = QuestionOptions(question_string).extract(inference_string)
+        if selected_ordinal is None:
+            raise ValueError(f"No answer found in: {inference_string}")
         return selected_ordinal
     
-    def run_inference(self, directive, game_desc, question):
+    def build_messages(self, directive, game_desc, question):
+        # Directive and game description come before the question, so every question of a type about a game shares the prompt prefix
         if self.llm.model_type == 'openai':
             messages = [
                 {"role": "system", "content": directive},
                 {"role": "user", "content": game_desc},
                 {"role": "assistant", "content": 'Got it!'},
-               
                 {"role": "user", "content": question},
             ]
         elif self.model_type == 'mistral':
             messages = [
                 # {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": game_desc + '\n' + directive},
+                {"role": "user", "content": self.prompt_prefix(directive, game_desc)},
                 {"role": "assistant", "content": 'Got it! Please provide me with the scenario.'},
                 {"role": "user", "content": question},
             ]
@@ -269,11 +363,19 @@ class TestLLMCoordination:
                 {"role": "assistant", "content": 'I understand. Plase provide the scenario.'},
                 {"role": "user", "content": question + ' Think step by step. '}, 
             ]
-        
+        return messages
+
+    def prompt_prefix(self, directive, game_desc):
+        prefix = self.prompt_prefixes.get((directive, game_desc))
+        return game_desc + '\n' + directive if prefix is None else prefix
+
+    def run_inference(self, directive, game_desc, question):
+        messages = self.build_messages(directive, game_desc, question)
         try:
             inference = self.llm.inference_fn(messages)
-        except:
+        except LLMRequestError:
             inference = 'Explanation: Blah.\n Answer: Z.'
+            self.llm.client.record_fallback(self.llm.model_name)
             ISSUES.append(inference)
         # print(f"INFERENCE: ", inference)
         return inference
@@ -281,84 +383,51 @@ class TestLLMCoordination:
 
 
     def run_ec_inference(self, scenario):
-        # Run inference for EC
-        if self.llm.model_type == 'openai':
-            ec_messages = [
-                {"role": "system", "content": scenario.ec_directive},
-                {"role": "user", "content": scenario.game_desc},
-                {"role": "assistant", "content": 'Got it!'},
-                {"role": "user", "content": scenario.ec_question},
-            ]
-        else:
-            ec_messages = [
-                # {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": scenario.game_desc + '\n' + scenario.ec_directive},
-                {"role": "assistant", "content": 'Got it! Please provide me with the scenario.'},
-                {"role": "user", "content": scenario.ec_question},
-            ]
-        return self.llm.inference_fn(ec_messages)
+        return self.run_inference(scenario.ec_directive, scenario.game_desc, scenario.ec_question)
+
+    def run_tom_inference(self, scenario):
+        return self.run_inference(scenario.tom_directive, scenario.game_desc, scenario.tom_question)
 
-    def run_tom_inference(self,scenario):
-        # Run inference for TOM
-        if self.llm.model_type == 'openai':
-            tom_messages = [
-                {"role": "system", "content": scenario.tom_directive},
-                {"role": "user", "content": scenario.game_desc},
-                {"role": "assistant", "content": 'Got it!'},
-                {"role": "user", "content": scenario.tom_question},
-            ]
-        else:
-            tom_messages = [
-                # {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": scenario.game_desc + '\n' + scenario.tom_directive},
-                {"role": "assistant", "content": 'Got it! Please provide me with the scenario.'},
-                {"role": "user", "content": scenario.tom_question},
-            ]
-        return self.llm.inference_fn(tom_messages)
-    
     def run_jp_inference(self, scenario):
-        # Run inference for JP
-        if self.llm.model_type == 'openai':
-            jp_messages = [
-                {"role": "system", "content": scenario.jp_directive},
-                {"role": "user", "content": scenario.game_desc},
-                {"role": "assistant", "content": 'Got it!'},
-                {"role": "user", "content": scenario.jp_question},
-            ]
-        else:
-            jp_messages = [
-                # {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": scenario.game_desc + '\n' + scenario.jp_directive},
-                {"role": "assistant", "content": 'Got it! Please provide me with the scenario.'},
-                {"role": "user", "content": scenario.jp_question},
-            ]
-        return self.llm.inference_fn(jp_messages)
+        return self.run_inference(scenario.jp_directive, scenario.game_desc, scenario.jp_question)
 
     def save_logs(self, trial_num):
-        # Writing the dictionary to a file in JSON format
-        # time_stamp = datetime.now() 
+        # Rebuilt from the result stream, so it also holds the answers of earlier runs that were resumed
+        log = {f'{qtype}_ANSWERS': [] for qtype in QUESTION_TYPES}
+        for record in self.results.trial_records(self.model, trial_num):
+            if record['inference'] is not None:
+                log[f"{record['qtype']}_ANSWERS"].append(record['inference'])
         save_file = self.log_file.replace('.','') + f"{trial_num}.json"
       
         print(save_file)
         with open(save_file, 'w') as file:
-            json.dump(self.log, file, indent=4)  # `indent` for pretty-printing
+            json.dump(log, file, indent=4)  # `indent` for pretty-printing
+
+    def save_inference_log(self, path=None):
+        # Next to the other logs of this evaluator, so evaluators running side by side (sweep.py) do not overwrite each other
+        if path is None:
+            path = self.log_file.replace('.','') + "_question_inference_log.txt"
+        with open(path, 'w') as file:
+            for trial_num in range(self.num_trials):
+                for record in self.results.trial_records(self.model, trial_num):
+                    if record['inference'] is None:
+                        continue
+                    question = getattr(self.load_scenario(record['row'])[0], f"{record['qtype'].lower()}_question")
+                    lines = question.split('\n')
+                    last_lines = '\n'.join(lines[-10:]) if len(lines) >= 10 else question
+                    file.write('training example ' + str(trial_num * len(self.df) + record['row']) + ' :\n')
+                    file.write(f"{record['qtype']} QUESTION:\n{last_lines}\nINFERENCE: {record['inference']}\n")
+                    if record['issue'] is None:
+                        file.write(f"fuzzywuzzy: {record['answer']}\n\n")
     
-    def random_inference(self, question):
-        # Find the number of options in the question and select a random one
-        action_list = []
-        if 'actions' in question.strip().lower():
-            action_list = question.strip().lower().split('available actions:')[-1].split('\n')
-        elif 'answer' in question.strip().lower():
-            action_list = question.strip().lower().split('available answers:')[-1].split('\n')
-        
-        action_items = len(action_list)
-        options = [chr(65 + i) for i in range(action_items)]
-        return np.random.choice(options)
             
         
 
     
-    def test_one_scenario(self, idx): 
+    def load_scenario(self, idx):
+        return self.scenarios[idx]
+
+    def build_scenario(self, idx):
         scenario_row = self.df.iloc[idx]
         current_game = scenario_row['Game']
         scenario = EvalDataPoint(concept=scenario_row['Concept'],
@@ -376,63 +445,123 @@ class TestLLMCoordination:
                                     tom_answer_desc=scenario_row['TOM Answer'],
                                     ec_answer_ordinal=scenario_row['EC Answer Ordinal'],
                                     ec_answer_desc=scenario_row['EC Answer'])
+        return scenario, current_game
+
+    def answer_question(self, idx, qtype, directive, game_desc, question, current_game, inference=None):
+        # Returns the answer, the raw inference and the issue (if any). `inference` is given when it was generated in a batch
+        if inference is None:
+            inference = self.run_inference(directive, game_desc, question)
+        answer = self.extractor.extract(idx, qtype, inference)
+        issue = None
+        if answer is None:
+            issue = {'type': qtype, 'question': question, 'inference': inference, 'game': current_game}
+            answer = '2'
+        return answer, inference, issue
+
+    def question_record(self, idx, qtype, trial_num):
+        # The result record of one question, from the result stream or by asking it. Returns (record, is_new).
+        record = self.results.get(self.model, trial_num, idx, qtype)
+        if record is not None:
+            return record, False
+        scenario, current_game = self.load_scenario(idx)
+        question = getattr(scenario, f'{qtype.lower()}_question')
         if self.llm.model_type == 'baseline':
-            if self.llm.model_name == 'random':
-                ec_answer_llm = self.random_inference(scenario.ec_question)
-                tom_answer_llm = self.random_inference(scenario.tom_question)
-                jp_answer_llm = self.random_inference(scenario.jp_question)
-        
-        else:        
-            ec_inference = self.run_inference(scenario.ec_directive, scenario.game_desc, scenario.ec_question) 
-            self.log['EC_ANSWERS'].append(ec_inference)
-            try:
-                with open('question_inference_log.txt', 'a') as file:
-                    file.write('training example ' + str(self.counter) + ' :\n')
-                    lines = scenario.ec_question.split('\n')
-                    last_lines = '\n'.join(lines[-10:]) if len(lines) >= 10 else scenario.ec_question
-                    file.write(f"EC QUESTION:\n{last_lines}\nINFERENCE: {ec_inference}\n")
-                    ec_answer_llm = self.find_answer_fuzzy(scenario.ec_question, ec_inference)
-                    file.write(f"fuzzywuzzy: {ec_answer_llm}\n\n")
-                    
-            except:
-                self.issues.append({'type': 'EC','question': scenario.ec_question, 'inference': ec_inference, 'game': current_game})
-                ec_answer_llm = '2'
-
-            tom_inference = self.run_inference(scenario.tom_directive, scenario.game_desc, scenario.tom_question)
-            self.log['TOM_ANSWERS'].append(tom_inference)
-            try:
-                with open('question_inference_log.txt', 'a') as file:
-                    file.write('training example ' + str(self.counter) + ' :\n')
-                    lines = scenario.tom_question.split('\n')
-                    last_lines = '\n'.join(lines[-10:]) if len(lines) >= 10 else scenario.tom_question
-                    file.write(f"TOM QUESTION:\n{last_lines}\nINFERENCE: {tom_inference}\n")
-                    tom_answer_llm = self.find_answer_fuzzy(scenario.tom_question,tom_inference)
-                    file.write(f"fuzzywuzzy: {tom_answer_llm}\n\n")
-            except:
-                self.issues.append({'type': 'TOM','question': scenario.tom_question, 'inference': tom_inference, 'game': current_game})
-                tom_answer_llm = '2'
-                
-            jp_inference = self.run_inference(scenario.jp_directive, scenario.game_desc, scenario.jp_question)
-            self.log['JP_ANSWERS'].append(jp_inference)
+            record = {'model': self.model, 'trial': trial_num, 'row': idx, 'qtype': qtype, 'game': current_game,
+                      'inference': None, 'answer': None, 'issue': None,
+                      'correct': float(self.random_expected[idx, QUESTION_TYPES.index(qtype)])}
+            return record, True
+        inference = self.prefetched.pop((trial_num, idx, qtype), None)
+        if inference is None and self.multi_sample:
+            inference = self.sample_remaining_trials(idx, qtype, trial_num, scenario)
+        answer, inference, issue = self.answer_question(idx, qtype, getattr(scenario, f'{qtype.lower()}_directive'), scenario.game_desc, question, current_game,
+                                                        inference=inference)
+        record = {'model': self.model, 'trial': trial_num, 'row': idx, 'qtype': qtype, 'game': current_game,
+                  'inference': inference, 'answer': str(answer), 'issue': issue,
+                  'correct': int(str(answer) in getattr(scenario, f'{qtype.lower()}_answer_ordinal').split(','))}
+        return record, True
+
+    def run_scenario(self, idx, trial_num):
+        # Only reads shared state, so scenarios can run on several threads at once. The outcome is applied
+        # by `record_scenario`, in row order. Questions already in the result stream are not asked again.
+        outcome = {'game': self.load_scenario(idx)[1], 'records': [], 'issues': []}
+        correct = {}
+        for qtype in QUESTION_TYPES:
+            record, is_new = self.question_record(idx, qtype, trial_num)
+            if is_new:
+                outcome['records'].append(record)
+            if record['issue'] is not None:
+                outcome['issues'].append(record['issue'])
+            correct[qtype] = record['correct']
+
+        outcome['scores'] = np.array([correct[qtype] for qtype in QUESTION_TYPES])
+        return outcome
+
+    def record_scenario(self, outcome):
+        self.results.append(outcome['records'])
+        self.issues.extend(outcome['issues'])
+
+    def test_one_scenario(self, idx, trial_num=0): 
+        outcome = self.run_scenario(idx, trial_num)
+        self.record_scenario(outcome)
+        return outcome['scores'], outcome['game']
+
+    def pending_trials(self, idx, qtype, trial_num):
+        # Trials from `trial_num` on that still need an answer to the question, with `multi_sample` all of them
+        trials = range(trial_num, self.num_trials) if self.multi_sample else [trial_num]
+        return [t for t in trials if self.results.get(self.model, t, idx, qtype) is None and (t, idx, qtype) not in self.prefetched]
+
+    def sample_remaining_trials(self, idx, qtype, trial_num, scenario):
+        # One request (n > 1) samples the question for this trial and every later one, the later samples wait in
+        # `prefetched` for their trial. Returns None if the request fails, the question is then asked on its own.
+        trials = self.pending_trials(idx, qtype, trial_num)
+        if len(trials) <= 1 or trials[0] != trial_num:
+            return None
+        messages = self.build_messages(getattr(scenario, f'{qtype.lower()}_directive'), scenario.game_desc, getattr(scenario, f'{qtype.lower()}_question'))
+        try:
+            samples = self.llm.run_samples(messages, len(trials))
+        except LLMRequestError:
+            return None
+        for t, sample in zip(trials[1:], samples[1:]):
+            self.prefetched[(t, idx, qtype)] = sample
+        return samples[0]
+
+    def prefetch_local_inferences(self, trial_num, rows):
+        # Generates every unanswered question of `rows` in one length-grouped batched pass of the local model
+        keys, messages, prefix_keys = [], [], []
+        for idx in rows:
+            scenario, _ = self.load_scenario(idx)
+            for qtype in QUESTION_TYPES:
+                for t in self.pending_trials(idx, qtype, trial_num):
+                    keys.append((t, idx, qtype))
+                    prefix_keys.append(scenario.game_desc)
+                    messages.append(self.build_messages(getattr(scenario, f'{qtype.lower()}_directive'), scenario.game_desc, getattr(scenario, f'{qtype.lower()}_question')))
+        if len(messages) > 0:
+            self.prefetched.update(zip(keys, self.llm.run_local_batch(messages, prefix_keys)))
+
+    def scenario_outcomes(self, trial_num):
+        # Yields (row, outcome) in row order, with several workers up to `num_workers` rows are answered at once
+        if self.batch_local:
+            # A chunk of rows at a time, so a killed run only loses the chunk being generated
+            chunk_size = 4 * self.llm.batch_size
+            for first in range(0, len(self.df), chunk_size):
+                rows = range(first, min(first + chunk_size, len(self.df)))
+                self.prefetch_local_inferences(trial_num, rows)
+                for sc in rows:
+                    yield sc, self.run_scenario(sc, trial_num)
+            return
+        if self.num_workers <= 1:
+            for sc in range(len(self.df)):
+                yield sc, self.run_scenario(sc, trial_num)
+            return
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = [executor.submit(self.run_scenario, sc, trial_num) for sc in range(len(self.df))]
             try:
-                with open('question_inference_log.txt', 'a') as file:
-                    file.write('training example ' + str(self.counter) + ' :\n')
-                    lines = scenario.jp_question.split('\n')
-                    last_lines = '\n'.join(lines[-10:]) if len(lines) >= 10 else scenario.jp_question
-                    file.write(f"JP QUESTION:\n{last_lines}\nINFERENCE: {jp_inference}\n")
-                    jp_answer_llm = self.find_answer_fuzzy(scenario.jp_question, jp_inference)
-                    file.write(f"fuzzywuzzy: {jp_answer_llm}\n\n")
-            except:
-                self.issues.append({'type': 'TOM', 'question': scenario.jp_question, 'inference': jp_inference, 'game': current_game})
-                jp_answer_llm = '2'
+                for sc, future in enumerate(futures):
+                    yield sc, future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
 
-        scores = [1 if ec_answer_llm in scenario.ec_answer_ordinal.split(',') else 0, 
-                  1 if tom_answer_llm in scenario.tom_answer_ordinal.split(',') else 0, 
-                  1 if jp_answer_llm in scenario.jp_answer_ordinal.split(',') else 0] 
-
-        self.counter += 1
-        return np.array(scores), current_game
-    
     def evaluate_llm(self):
         scores = []
         game_wise_scores = {'Overcooked': [], 'Hanabi': [], 'CollabGames': []}
@@ -440,12 +569,12 @@ class TestLLMCoordination:
             results = []
             game_wise_results = {'Overcooked': [], 'Hanabi': [], 'CollabGames': []}
             print("CONDUCTING TRIAL NUMBER: ", t_num)
-            for sc in tqdm(range(len(self.df))):
-                res, current_game = self.test_one_scenario(sc)
+            self.llm.cache_seed = t_num
+            for sc, outcome in tqdm(self.scenario_outcomes(t_num), total=len(self.df)):
+                self.record_scenario(outcome)
+                res, current_game = outcome['scores'], outcome['game']
                 results.append(res)
                 game_wise_results[current_game].append(res)
-                time.sleep(0.5)
-                self.save_logs(t_num)
                 # print(game_wise_results)
                 if sc % 10 ==0:
                     print("COST SO FAR: ", self.llm.cost)
@@ -462,9 +591,11 @@ class TestLLMCoordination:
                 print("COST FOR THIS TRIAL WAS: ", self.llm.cost)
             except:
                 pass
+            if self.batch_local:
+                print(self.llm.format_generation_stats())
             scores.append(score)
             self.save_logs(t_num)
-            self.clear_logs()
+        self.save_inference_log()
 
         return {'accuracy': np.mean(np.array(scores), axis=0), 
                 'standard error': (np.array(scores).std(axis=0) / np.sqrt(self.num_trials)),
@@ -475,29 +606,86 @@ class TestLLMCoordination:
                 'CollabGames accuracy': np.mean(np.array(game_wise_scores['CollabGames']), axis=0),
                 'CollabGames standard error': np.std(np.array(game_wise_scores['CollabGames']), axis=0) / np.sqrt(self.num_trials)
                 }
+
+    def evaluate_adaptive(self, target_width=0.1, reference=None, level=0.95, seed=0, min_per_stratum=5):
+        '''Evaluates a stratified random sample of the questions (trial 0) until the accuracy is known well enough.
+
+        Questions are drawn round-robin over (game, qtype) strata and answered `num_workers` at a time. After each
+        round the stratified accuracy intervals are updated, and sampling stops once every interval is at most
+        `target_width` wide, or once every question type is separated from the `reference` estimate (a
+        StratifiedAccuracy of another model, see `StratifiedAccuracy.from_results`).
+        '''
+        # Every answer is for trial 0, later trials are never asked for. A full run (`evaluate_llm`) would ask each
+        # question once with multi-sampling (n = num_trials), and once per trial otherwise
+        full_run_calls_per_question = 1 if self.multi_sample else self.num_trials
+        self.multi_sample = False
+        self.llm.cache_seed = 0
+        z = z_value(level)
+        strata = {}
+        for idx in range(len(self.df)):
+            for qtype in QUESTION_TYPES:
+                strata.setdefault((self.load_scenario(idx)[1], qtype), []).append(idx)
+        estimate = StratifiedAccuracy({stratum: len(rows) for stratum, rows in strata.items()})
+        order = interleaved_order(strata, seed)
+        round_size = 3 * max(self.num_workers, 1)
+        asked, reason = 0, None
+        with ThreadPoolExecutor(max_workers=max(self.num_workers, 1)) as executor:
+            for start in tqdm(range(0, len(order), round_size)):
+                sample = order[start:start + round_size]
+                for (stratum, idx), (record, is_new) in zip(sample, executor.map(lambda item: self.question_record(item[1], item[0][1], 0), sample)):
+                    if is_new:
+                        self.results.append([record])
+                        asked += 1
+                    if record['issue'] is not None:
+                        self.issues.append(record['issue'])
+                    estimate.add(stratum, record['correct'])
+                reason = stop_reason(estimate, z, target_width, reference, min_per_stratum)
+                if reason is not None:
+                    break
+        answered = sum(estimate.answered.values())
+        full_run = len(order) * full_run_calls_per_question
+        return {'accuracy': [estimate.estimate(qtype)[0] for qtype in QUESTION_TYPES],
+                'interval': [estimate.interval(qtype, z) for qtype in QUESTION_TYPES],
+                'reference accuracy': None if reference is None else [reference.estimate(qtype)[0] for qtype in QUESTION_TYPES],
+                'questions answered': answered,
+                'calls made': asked,
+                'calls saved': full_run - asked,
+                'full run calls': full_run,
+                'stopped because': reason or 'every question was answered'}
     
-def write_results_to_file(model_nm, timestamp, model_type, result_table, trial_num, game_name='all'):
-    with open(f'gpt_4_temp_results/{model_nm}_{timestamp}_trial_{trial_num}_output.txt', 'w') as f:
-        f.write('TEST FILE: ' + str(game_name) + '\n')
-        f.write('MODEL: ' + str(model) + '\n')
-        f.write('MODEL TYPE: ' + str(model_type) + '\n')
-        f.write(f"Environment Comprehension Score: {result_table['EC_SCORE']} +/- {result_table['EC_SE']}\n")
-        f.write(f"Theory of Mind Score: {result_table['TOM_SCORE']} +/- {result_table['TOM_SE']}\n")
-        f.write(f"Joint Planning Score: {result_table['JP_SCORE']} +/- {result_table['JP_SE']}\n")
 
-        # Game Wise Scores
-        f.write(f"Overcooked Environment Comprehension Score: {result_table['Overcooked accuracy'][0]} +/- {result_table['Overcooked standard error'][0]}\n")
-        f.write(f"Overcooked Theory of Mind Score: {result_table['Overcooked accuracy'][1]} +/- {result_table['Overcooked standard error'][1]}\n")
-        f.write(f"Overcooked Joint Planning Score: {result_table['Overcooked accuracy'][2]} +/- {result_table['Overcooked standard error'][2]}\n")
+SCORE_NAMES = {'EC': 'Environment Comprehension', 'TOM': 'Theory of Mind', 'JP': 'Joint Planning'}
+GAMES = ['Overcooked', 'Hanabi', 'CollabGames']
 
-        f.write(f"Hanabi Environment Comprehension Score: {result_table['Hanabi accuracy'][0]} +/- {result_table['Hanabi standard error'][0]}\n")
-        f.write(f"Hanabi Theory of Mind Score: {result_table['Hanabi accuracy'][1]} +/- {result_table['Hanabi standard error'][1]}\n")
-        f.write(f"Hanabi Joint Planning Score: {result_table['Hanabi accuracy'][2]} +/- {result_table['Hanabi standard error'][2]}\n")
 
-        f.write(f"CollabGames Environment Comprehension Score: {result_table['CollabGames accuracy'][0]} +/- {result_table['CollabGames standard error'][0]}\n")
-        f.write(f"CollabGames Theory of Mind Score: {result_table['CollabGames accuracy'][1]} +/- {result_table['CollabGames standard error'][1]}\n")
-        f.write(f"CollabGames Joint Planning Score: {result_table['CollabGames accuracy'][2]} +/- {result_table['CollabGames standard error'][2]}\n")
-        f.write(f"Problems: {evaluator.issues}\n")
+def format_report(game_name, model, model_type, result_table, issues):
+    lines = ['TEST FILE: ' + str(game_name), 'MODEL: ' + str(model), 'MODEL TYPE: ' + str(model_type)]
+    for qtype in QUESTION_TYPES:
+        lines.append(f"{SCORE_NAMES[qtype]} Score: {result_table[f'{qtype}_SCORE']} +/- {result_table[f'{qtype}_SE']}")
+    # Game Wise Scores
+    for game in GAMES:
+        for i, qtype in enumerate(QUESTION_TYPES):
+            lines.append(f"{game} {SCORE_NAMES[qtype]} Score: {result_table[f'{game} accuracy'][i]} +/- {result_table[f'{game} standard error'][i]}")
+    lines.append(f"Problems: {issues}")
+    return '\n'.join(lines) + '\n'
+
+
+def format_adaptive_report(model, model_type, adaptive_results, level=0.95):
+    lines = ['MODEL: ' + str(model), 'MODEL TYPE: ' + str(model_type)]
+    for i, qtype in enumerate(QUESTION_TYPES):
+        low, high = adaptive_results['interval'][i]
+        line = f"{SCORE_NAMES[qtype]} Score: {adaptive_results['accuracy'][i]:.3f} ({level:.0%} CI {low:.3f} - {high:.3f})"
+        if adaptive_results['reference accuracy'] is not None:
+            line += f", reference: {adaptive_results['reference accuracy'][i]:.3f}"
+        lines.append(line)
+    lines.append(f"Stopped after {adaptive_results['questions answered']} questions: {adaptive_results['stopped because']}")
+    lines.append(f"Calls made: {adaptive_results['calls made']}, saved against a full run of {adaptive_results['full run calls']} calls: {adaptive_results['calls saved']}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_results_to_file(model, model_nm, timestamp, model_type, result_table, trial_num, issues, game_name='all'):
+    with open(f'gpt_4_temp_results/{model_nm}_{timestamp}_trial_{trial_num}_output.txt', 'w') as f:
+        f.write(format_report(game_name, model, model_type, result_table, issues))
 
 
 def format_results(results):
@@ -515,15 +703,27 @@ def format_results(results):
             'CollabGames standard error': results['CollabGames standard error']
             }
 
-def extract_test_df(df, n):
-    # Extract n samples from each 'Game' from the dataframe
-    return df.groupby('Game').apply(lambda x: x.sample(n)).reset_index(drop=True)
     
 TEST = False 
 if __name__ == '__main__':
-    df = pd.read_csv('data/single_turn_trials.csv')
-    # if TEST:
-    #     df = extract_test_df(df, 2)
+    parser = argparse.ArgumentParser(description='Run the single turn reasoning evaluation.')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('EVAL_NUM_WORKERS', 8)), help='Scenarios evaluated concurrently (1 runs them sequentially)')
+    parser.add_argument('--local', action='store_true', help='Load mistral/vicuna/llama weights in this process instead of querying a server')
+    parser.add_argument('--batch-size', type=int, default=8, help='Prompts generated together by a local model')
+    parser.add_argument('--no-prefix-cache', action='store_true', help='Prefill the shared game description again for every local prompt')
+    parser.add_argument('--no-multi-sample', action='store_true', help='Send each trial of a question as its own request instead of one request with n=num_trials')
+    parser.add_argument('--sample', type=int, default=None, help='Evaluate only this many scenarios of every game')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the --sample subsample')
+    parser.add_argument('--resume', action='store_true', help='Keep the answers already in the result stream of this model and only ask the rest')
+    parser.add_argument('--adaptive', action='store_true', help='Sample questions until the accuracy intervals are narrow enough instead of running every trial')
+    parser.add_argument('--target-width', type=float, default=0.1, help='--adaptive stops once every interval is at most this wide')
+    parser.add_argument('--reference', default=None, help='--adaptive also stops once separated from the model in this result stream')
+    parser.add_argument('--level', type=float, default=0.95, help='Confidence level of the --adaptive intervals')
+    args = parser.parse_args()
+    dataset = load_dataset('data/single_turn_trials.csv')
+    if args.sample is not None:
+        dataset = dataset.stratified_sample(args.sample, args.seed)
+    df = dataset.to_frame()
     game_name = 'all'
     if 'Game' not in df:
         df['Game'] = game_name
@@ -554,50 +754,26 @@ if __name__ == '__main__':
         model_nm = model
     if not os.path.exists('logs'):
         os.makedirs('logs')
-    evaluator = TestLLMCoordination(df, game_name, model, model_type, f'logs/{game_name}_{model_type}_{model_nm}')
-    results = evaluator.evaluate_llm()
-    result_table = format_results(results)
-    print('TEST FILE: ', game_name)
-    print('MODEL: ', model)
-    print('MODEL TYPE: ', model_type)
-    print(f"Environment Comprehension Score: {result_table['EC_SCORE']} +/- {result_table['EC_SE']}")
-    print(f"Theory of Mind Score: {result_table['TOM_SCORE']} +/- {result_table['TOM_SE']}")
-    print(f"Joint Planning Score: {result_table['JP_SCORE']} +/- {result_table['JP_SE']}")
-
-    # Game Wise Scores
-    print(f"Overcooked Environment Comprehension Score: {result_table['Overcooked accuracy'][0]} +/- {result_table['Overcooked standard error'][0]}")
-    print(f"Overcooked Theory of Mind Score: {result_table['Overcooked accuracy'][1]} +/- {result_table['Overcooked standard error'][1]}")
-    print(f"Overcooked Joint Planning Score: {result_table['Overcooked accuracy'][2]} +/- {result_table['Overcooked standard error'][2]}")
-
-    print(f"Hanabi Environment Comprehension Score: {result_table['Hanabi accuracy'][0]} +/- {result_table['Hanabi standard error'][0]}")
-    print(f"Hanabi Theory of Mind Score: {result_table['Hanabi accuracy'][1]} +/- {result_table['Hanabi standard error'][1]}")
-    print(f"Hanabi Joint Planning Score: {result_table['Hanabi accuracy'][2]} +/- {result_table['Hanabi standard error'][2]}")
-
-    print(f"CollabGames Environment Comprehension Score: {result_table['CollabGames accuracy'][0]} +/- {result_table['CollabGames standard error'][0]}")
-    print(f"CollabGames Theory of Mind Score: {result_table['CollabGames accuracy'][1]} +/- {result_table['CollabGames standard error'][1]}")
-    print(f"CollabGames Joint Planning Score: {result_table['CollabGames accuracy'][2]} +/- {result_table['CollabGames standard error'][2]}")
-    print(f"Problems: {evaluator.issues}")
+    evaluator = TestLLMCoordination(df, game_name, model, model_type, f'logs/{game_name}_{model_type}_{model_nm}', num_workers=args.workers, resume=args.resume, api_server=not args.local, batch_size=args.batch_size, reuse_prefix=not args.no_prefix_cache,
+                                    multi_sample=not args.no_multi_sample, dataset=dataset)
+    if args.adaptive:
+        reference = None
+        if args.reference is not None:
+            reference = StratifiedAccuracy.from_results(args.reference, [game for _, game in evaluator.scenarios])
+        report = format_adaptive_report(model, model_type, evaluator.evaluate_adaptive(args.target_width, reference, args.level, args.seed), args.level)
+        evaluator.results.close()
+    else:
+        results = evaluator.evaluate_llm()
+        evaluator.results.close()
+        result_table = format_results(results)
+        report = format_report(game_name, model, model_type, result_table, evaluator.issues)
+    print(report, end='')
+    if get_llm_client().cache is not None:
+        print("RESPONSE CACHE: ", get_llm_client().cache.stats())
+    print("LLM REQUEST COUNTERS: ", get_llm_client().counter_summary())
+    print(get_llm_client().metrics.format_summary())
     with open(f'{model_nm}_{timestamp}_output.txt', 'w') as f:
-        f.write('TEST FILE: ' + str(game_name) + '\n')
-        f.write('MODEL: ' + str(model) + '\n')
-        f.write('MODEL TYPE: ' + str(model_type) + '\n')
-        f.write(f"Environment Comprehension Score: {result_table['EC_SCORE']} +/- {result_table['EC_SE']}\n")
-        f.write(f"Theory of Mind Score: {result_table['TOM_SCORE']} +/- {result_table['TOM_SE']}\n")
-        f.write(f"Joint Planning Score: {result_table['JP_SCORE']} +/- {result_table['JP_SE']}\n")
-
-        # Game Wise Scores
-        f.write(f"Overcooked Environment Comprehension Score: {result_table['Overcooked accuracy'][0]} +/- {result_table['Overcooked standard error'][0]}\n")
-        f.write(f"Overcooked Theory of Mind Score: {result_table['Overcooked accuracy'][1]} +/- {result_table['Overcooked standard error'][1]}\n")
-        f.write(f"Overcooked Joint Planning Score: {result_table['Overcooked accuracy'][2]} +/- {result_table['Overcooked standard error'][2]}\n")
-
-        f.write(f"Hanabi Environment Comprehension Score: {result_table['Hanabi accuracy'][0]} +/- {result_table['Hanabi standard error'][0]}\n")
-        f.write(f"Hanabi Theory of Mind Score: {result_table['Hanabi accuracy'][1]} +/- {result_table['Hanabi standard error'][1]}\n")
-        f.write(f"Hanabi Joint Planning Score: {result_table['Hanabi accuracy'][2]} +/- {result_table['Hanabi standard error'][2]}\n")
-
-        f.write(f"CollabGames Environment Comprehension Score: {result_table['CollabGames accuracy'][0]} +/- {result_table['CollabGames standard error'][0]}\n")
-        f.write(f"CollabGames Theory of Mind Score: {result_table['CollabGames accuracy'][1]} +/- {result_table['CollabGames standard error'][1]}\n")
-        f.write(f"CollabGames Joint Planning Score: {result_table['CollabGames accuracy'][2]} +/- {result_table['CollabGames standard error'][2]}\n")
-        f.write(f"Problems: {evaluator.issues}\n")
+        f.write(report)
     print(ISSUES)
 
     
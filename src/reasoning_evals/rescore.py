@@ -0,0 +1,125 @@
+# Re-scores saved result streams (logs/*_results.jsonl) without calling any model: answers are extracted again
+# from the raw inferences, accuracies are recomputed per game, concept and question type with bootstrap
+# confidence intervals, and compared against the expected accuracy of the random baseline.
+#
+#   python rescore.py logs/all_openai_gpt-35-turbo_results.jsonl --data data/single_turn_trials.csv
+
+import argparse
+import json
+
+import numpy as np
+
+from answer_extraction import AnswerExtractor, QUESTION_TYPES, random_option_count
+from dataset import load_dataset
+
+
+def correctness_array(records, num_rows):
+    # (trials, rows, question types) array of 0/1, NaN where a question has no record
+    trials = sorted({r['trial'] for r in records})
+    scores = np.full((len(trials), num_rows, len(QUESTION_TYPES)), np.nan)
+    for r in records:
+        scores[trials.index(r['trial']), r['row'], QUESTION_TYPES.index(r['qtype'])] = r['correct']
+    return scores
+
+
+def random_baseline(df):
+    # Expected accuracy of `random_inference`: the share of the options it draws from that are correct
+    expected = np.zeros((len(df), len(QUESTION_TYPES)))
+    for row in range(len(df)):
+        scenario_row = df.iloc[row]
+        for q, qtype in enumerate(QUESTION_TYPES):
+            num_options = random_option_count(scenario_row[f'{qtype} Question'])
+            options = {chr(65 + i) for i in range(num_options)}
+            correct = set(str(scenario_row[f'{qtype} Answer Ordinal']).split(','))
+            expected[row, q] = len(options & correct) / num_options if num_options > 0 else 0.
+    return expected
+
+
+def bootstrap_ci(per_row, num_samples=10000, level=0.95, seed=0):
+    # Resamples scenarios with replacement, all samples at once: (num_samples, rows) indices into `per_row`
+    rng = np.random.default_rng(seed)
+    samples = rng.integers(0, len(per_row), size=(num_samples, len(per_row)))
+    means = np.nanmean(per_row[samples], axis=1)
+    tail = (1 - level) / 2 * 100
+    return np.nanpercentile(means, [tail, 100 - tail], axis=0)
+
+
+def group_rows(df):
+    groups = {'all': np.arange(len(df))}
+    for column in ['Game', 'Concept']:
+        if column in df:
+            for value, rows in df.groupby(column, sort=True).indices.items():
+                groups[f'{column.lower()}: {value}'] = rows
+    return groups
+
+
+def rescore(records, df, num_samples=10000, level=0.95, seed=0):
+    '''Accuracy per group (all rows, each game and each concept) and question type.
+
+    Accuracy and standard error are computed over trials like `evaluate_llm`, the confidence interval by
+    bootstrapping scenarios (averaged over trials), `random` is the expected accuracy of the random baseline.
+    '''
+    scores = correctness_array(records, len(df))
+    baseline = random_baseline(df)
+    table = {}
+    for group, rows in group_rows(df).items():
+        per_trial = np.nanmean(scores[:, rows], axis=1)
+        low, high = bootstrap_ci(np.nanmean(scores[:, rows], axis=0), num_samples, level, seed)
+        table[group] = {
+            'rows': len(rows),
+            'accuracy': per_trial.mean(axis=0).tolist(),
+            'standard error': (per_trial.std(axis=0) / np.sqrt(len(per_trial))).tolist(),
+            'ci low': low.tolist(),
+            'ci high': high.tolist(),
+            'random': baseline[rows].mean(axis=0).tolist(),
+        }
+    return table
+
+
+def format_table(table, level=0.95):
+    header = f"{'GROUP':<40}{'ROWS':>6}"
+    for qtype in QUESTION_TYPES:
+        header += f"  {qtype + f' ACCURACY [{level:.0%} CI] (RANDOM)':<34}"
+    lines = [header]
+    for group, stats in table.items():
+        line = f"{group:<40}{stats['rows']:>6}"
+        for q in range(len(QUESTION_TYPES)):
+            cell = f"{stats['accuracy'][q]:.3f} [{stats['ci low'][q]:.3f}, {stats['ci high'][q]:.3f}] ({stats['random'][q]:.3f})"
+            line += f"  {cell:<34}"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def load_records(path, extractor):
+    # Answers are extracted again from the raw inferences, so changes to the extractor apply to old runs
+    records = extractor.score_results_file(path)
+    return {model: [r for r in records if r['model'] == model] for model in sorted({r['model'] for r in records})}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Re-score saved reasoning evaluation results without running any model.')
+    parser.add_argument('results', nargs='+', help='Result streams (*_results.jsonl) written by main.py')
+    parser.add_argument('--data', default='data/single_turn_trials.csv', help='The dataset the results were produced on')
+    parser.add_argument('--sample', type=int, default=None, help='The --sample the results were produced with')
+    parser.add_argument('--sample-seed', type=int, default=0, help='The --seed the results were produced with')
+    parser.add_argument('--bootstrap', type=int, default=10000, help='Bootstrap samples')
+    parser.add_argument('--level', type=float, default=0.95, help='Confidence level of the intervals')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Also write the tables to this JSON file')
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.data)
+    if args.sample is not None:
+        dataset = dataset.stratified_sample(args.sample, args.sample_seed)
+    df = dataset.to_frame()
+    extractor = AnswerExtractor.from_dataset(dataset)
+    tables = {}
+    for path in args.results:
+        for model, records in load_records(path, extractor).items():
+            tables[model] = rescore(records, df, args.bootstrap, args.level, args.seed)
+            print(f"MODEL: {model} ({path})")
+            print(format_table(tables[model], args.level))
+            print()
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(tables, f, indent=4)
@@ -0,0 +1,145 @@
+# Evaluates several models on the single turn benchmark in one process and writes one comparison table.
+#
+#   python sweep.py --model gpt-35-turbo openai 3 --model gpt-4-0125 openai 3 --local-model mistralai/Mistral-7B-Instruct-v0.2 mistral 1
+#
+# The dataset is loaded once and every API model goes through the shared LLM client (one response cache, connection
+# pool and rate limiter). API models run side by side, so each provider's rate limit stays saturated. Models loaded
+# in-process run one after the other on their own worker.
+
+import argparse
+import gc
+import json
+import os
+import threading
+import traceback
+from datetime import datetime
+
+import torch
+
+from dataset import load_dataset
+from llm_coordination_agents.llm_client import get_llm_client
+from answer_extraction import QUESTION_TYPES
+from main import GAMES, TestLLMCoordination, format_report, format_results
+
+
+def model_short_name(model):
+    return model.split('/')[-1]
+
+
+class Sweep:
+    '''Runs `TestLLMCoordination.evaluate_llm` for a list of (model, model_type, num_trials, local) entries.
+
+    API models get one thread each and share the client's concurrency limit, local models share a single thread
+    and are released before the next one is loaded. `results` maps every model to its formatted result table.
+    '''
+    def __init__(self, dataset, entries, game_name='all', num_workers=8, resume=False):
+        # Results, reports and log files are per model, a model listed twice would overwrite its own
+        models = [entry[0] for entry in entries]
+        duplicates = sorted({model for model in models if models.count(model) > 1})
+        if len(duplicates) > 0:
+            raise ValueError(f"Models listed more than once in the sweep: {', '.join(duplicates)}")
+        self.dataset = dataset
+        self.df = dataset.to_frame()
+        if 'Game' not in self.df:
+            self.df['Game'] = game_name
+        self.entries = entries
+        self.game_name = game_name
+        self.num_workers = num_workers
+        self.resume = resume
+        self.results = {}
+        self.reports = {}
+        self.failures = {}
+        self._lock = threading.Lock()
+
+    def evaluate(self, model, model_type, num_trials, local):
+        evaluator = TestLLMCoordination(self.df, self.game_name, model, model_type, f'logs/{self.game_name}_{model_type}_{model_short_name(model)}',
+                                        num_trials=num_trials, num_workers=self.num_workers, resume=self.resume, api_server=not local, dataset=self.dataset)
+        try:
+            result_table = format_results(evaluator.evaluate_llm())
+        finally:
+            evaluator.results.close()
+        with self._lock:
+            self.results[model] = result_table
+            self.reports[model] = format_report(self.game_name, model, model_type, result_table, evaluator.issues)
+        return evaluator
+
+    def _run_entries(self, entries):
+        for model, model_type, num_trials, local in entries:
+            try:
+                evaluator = self.evaluate(model, model_type, num_trials, local)
+                if local:
+                    # Free the weights before the next local model is loaded
+                    del evaluator
+                    gc.collect()
+                    if torch.cuda.is_available():
+                        torch.cuda.empty_cache()
+            except Exception:
+                with self._lock:
+                    self.failures[model] = traceback.format_exc()
+                print(f"MODEL {model} FAILED:\n{self.failures[model]}")
+
+    def run(self):
+        workers = [threading.Thread(target=self._run_entries, args=([entry],), name=f'sweep-{entry[0]}') for entry in self.entries if not entry[3]]
+        local_entries = [entry for entry in self.entries if entry[3]]
+        if len(local_entries) > 0:
+            workers.append(threading.Thread(target=self._run_entries, args=(local_entries,), name='sweep-local'))
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return self.results
+
+
+def format_comparison(results):
+    columns = [(f'{qtype}', 'accuracy', 'standard error', i) for i, qtype in enumerate(QUESTION_TYPES)]
+    columns += [(f'{game} {qtype}', f'{game} accuracy', f'{game} standard error', i) for game in GAMES for i, qtype in enumerate(QUESTION_TYPES)]
+    width = max([len('MODEL')] + [len(model) for model in results]) + 2
+    lines = ['MODEL'.ljust(width) + ''.join(f'{name:>20}' for name, _, _, _ in columns)]
+    for model, result_table in results.items():
+        table = {'accuracy': [result_table[f'{qtype}_SCORE'] for qtype in QUESTION_TYPES],
+                 'standard error': [result_table[f'{qtype}_SE'] for qtype in QUESTION_TYPES], **result_table}
+        cells = ''.join(f"{f'{table[accuracy][i]:.3f} +/- {table[se][i]:.3f}':>20}" for _, accuracy, se, i in columns)
+        lines.append(model.ljust(width) + cells)
+    return '\n'.join(lines) + '\n'
+
+
+def to_json(results):
+    return {model: {key: value.tolist() if hasattr(value, 'tolist') else value for key, value in result_table.items()} for model, result_table in results.items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate several models on the single turn reasoning benchmark.')
+    parser.add_argument('--model', nargs=3, action='append', default=[], metavar=('MODEL', 'MODEL_TYPE', 'TRIALS'), help='A model served through the LLM client')
+    parser.add_argument('--local-model', nargs=3, action='append', default=[], metavar=('MODEL', 'MODEL_TYPE', 'TRIALS'), help='A model loaded in this process')
+    parser.add_argument('--data', default='data/single_turn_trials.csv')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('EVAL_NUM_WORKERS', 8)), help='Scenarios evaluated concurrently per API model')
+    parser.add_argument('--sample', type=int, default=None, help='Evaluate only this many scenarios of every game')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the --sample subsample')
+    parser.add_argument('--resume', action='store_true', help='Keep the answers already in the result streams and only ask the rest')
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.data)
+    if args.sample is not None:
+        dataset = dataset.stratified_sample(args.sample, args.seed)
+    entries = [(model, model_type, int(trials), False) for model, model_type, trials in args.model]
+    entries += [(model, model_type, int(trials), True) for model, model_type, trials in args.local_model]
+    if not os.path.exists('logs'):
+        os.makedirs('logs')
+
+    sweep = Sweep(dataset, entries, num_workers=args.workers, resume=args.resume)
+    results = sweep.run()
+    for model in results:
+        print(sweep.reports[model], end='')
+    comparison = format_comparison(results)
+    print(comparison, end='')
+    if len(sweep.failures) > 0:
+        print("FAILED MODELS: ", list(sweep.failures))
+    print("LLM REQUEST COUNTERS: ", get_llm_client().counter_summary())
+    print(get_llm_client().metrics.format_summary())
+    timestamp = datetime.now()
+    with open(f'sweep_{timestamp}_output.txt', 'w') as f:
+        f.write(comparison)
+        for model in results:
+            f.write('\n' + sweep.reports[model])
+    with open(f'sweep_{timestamp}_output.json', 'w') as f:
+        json.dump(to_json(results), f, indent=4)
@@ -0,0 +1,57 @@
+from adaptive import StratifiedAccuracy, interleaved_order, stop_reason, z_value
+
+
+def test_interleaved_order_is_stratified_and_seeded():
+    strata = {('Hanabi', 'EC'): [0, 1, 2, 3], ('Overcooked', 'EC'): [4, 5]}
+    order = interleaved_order(strata, seed=3)
+    assert order == interleaved_order(strata, seed=3)
+    assert sorted(row for _, row in order) == list(range(6))
+    # Every prefix alternates between the strata while both still have rows
+    assert [stratum[0] for stratum, _ in order[:4]] == ['Hanabi', 'Overcooked', 'Hanabi', 'Overcooked']
+
+
+def test_estimate_weights_games_by_their_size():
+    estimate = StratifiedAccuracy({('A', 'EC'): 30, ('B', 'EC'): 10})
+    for _ in range(30):
+        estimate.add(('A', 'EC'), 1)
+    for _ in range(10):
+        estimate.add(('B', 'EC'), 0)
+    accuracy, variance = estimate.estimate('EC')
+    assert accuracy == 0.75
+    # Both strata are fully sampled, so nothing is uncertain
+    assert variance == 0.
+
+
+def test_interval_narrows_with_more_answers():
+    sizes = {('A', 'EC'): 100}
+    few, many = StratifiedAccuracy(sizes), StratifiedAccuracy(sizes)
+    for i in range(10):
+        few.add(('A', 'EC'), i % 2)
+    for i in range(60):
+        many.add(('A', 'EC'), i % 2)
+    z = z_value(0.95)
+    few_low, few_high = few.interval('EC', z)
+    many_low, many_high = many.interval('EC', z)
+    assert few_low < many_low < 0.5 < many_high < few_high
+
+
+def full_estimate(correct, answered, size=20):
+    estimate = StratifiedAccuracy({(game, qtype): size for game in ['A'] for qtype in ['EC', 'TOM', 'JP']})
+    for stratum in estimate.sizes:
+        for i in range(answered):
+            estimate.add(stratum, int(i < correct))
+    return estimate
+
+
+def test_stop_reason_waits_for_the_minimum_per_stratum():
+    assert stop_reason(full_estimate(2, 4, size=4), z_value(0.95), 1., min_per_stratum=5) is None
+    assert stop_reason(full_estimate(2, 4, size=4), z_value(0.95), 1., min_per_stratum=4) is not None
+
+
+def test_stop_reason_stops_on_width_or_separation():
+    z = z_value(0.95)
+    estimate = full_estimate(5, 10)
+    assert stop_reason(estimate, z, target_width=0.01) is None
+    assert 'wide' in stop_reason(estimate, z, target_width=1.)
+    assert 'separated' in stop_reason(estimate, z, target_width=0.01, reference=full_estimate(10, 10))
+    assert stop_reason(estimate, z, target_width=0.01, reference=full_estimate(5, 10)) is None
@@ -0,0 +1,47 @@
+from answer_extraction import AnswerExtractor, QuestionOptions, parse_options, random_option_count
+
+QUESTION = "Which action should Alice take?\nAvailable Actions:\nA. Pick up onion.\nB. Place onion in pot.\nC. Wait.\n"
+
+
+def test_parse_options_drops_ordinals_and_blank_lines():
+    assert parse_options(QUESTION) == ['pick up onion.', 'place onion in pot.', 'wait.']
+    assert parse_options("Who is closer?\nAvailable Answers:\nA. Alice\n\nB. Bob") == ['alice', 'bob']
+    assert parse_options("No options here") == []
+
+
+def test_random_option_count_counts_every_line_after_the_heading():
+    # The trailing newline is an (empty) option the random baseline can draw
+    assert random_option_count(QUESTION) == 4
+    assert random_option_count("No options here") == 0
+
+
+def test_extract_prefers_an_explicit_ordinal():
+    options = QuestionOptions(QUESTION, 'B')
+    assert options.extract("Explanation: the pot needs onions.\nAction: B. Place onion in pot.") == 'B'
+    assert options.extract("I would go with C) here") == 'C'
+
+
+def test_extract_matches_the_named_option():
+    options = QuestionOptions(QUESTION)
+    assert options.extract("Action: place onion in pot.") == 'B'
+    assert options.extract("Action: Place   onion in the pot!") == 'B'
+    assert options.extract("Answer: wait") == 'C'
+
+
+def test_extract_without_options_finds_nothing():
+    assert QuestionOptions("No options here").extract("Action: something") is None
+
+
+def test_score_records_rescores_inferences_and_keeps_expected_accuracies():
+    extractor = AnswerExtractor.__new__(AnswerExtractor)
+    extractor.questions = {(0, 'EC'): QuestionOptions(QUESTION, 'B,C')}
+    records = [
+        {'row': 0, 'qtype': 'EC', 'inference': 'Action: wait.', 'answer': 'A', 'correct': 0},
+        {'row': 0, 'qtype': 'EC', 'inference': 'Action: pick up onion.', 'answer': 'B', 'correct': 1},
+        {'row': 0, 'qtype': 'EC', 'inference': None, 'answer': None, 'correct': 0.5},
+    ]
+    scored = extractor.score_records(records)
+    assert [r['answer'] for r in scored] == ['C', 'A', None]
+    assert [r['correct'] for r in scored] == [1, 0, 0.5]
+    # The records passed in are left as they were
+    assert records[0]['answer'] == 'A'
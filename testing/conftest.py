@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The packages live under src/, the reasoning eval scripts import each other by module name
+for path in [os.path.join(ROOT, 'src', 'reasoning_evals'), os.path.join(ROOT, 'src')]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
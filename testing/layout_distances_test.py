@@ -0,0 +1,78 @@
+import math
+from collections import deque
+
+from overcooked_ai_py.mdp.layout_geometry import LayoutGeometry
+from llm_coordination_agents.layout_distances import LayoutDistances
+
+# Two rooms joined by a gate (G) and by a long corridor along the bottom
+TERRAIN = [
+    "XXXXXXX",
+    "X  G  X",
+    "X XXX X",
+    "X     X",
+    "XXXXXXX",
+]
+
+
+def reference_distance(distances, p1, p2, walls=(), sinks=()):
+    # Plain BFS over the cells of the table, a closed gate cannot be a destination either
+    if p2 in walls:
+        return math.inf
+    seen = {p1: 0}
+    queue = deque([p1])
+    while queue:
+        cell = queue.popleft()
+        if cell == p2:
+            return seen[cell]
+        if cell in sinks and cell != p1:
+            continue
+        for i in distances.neighbors[distances.index[cell]]:
+            neighbor = distances.cells[i]
+            if neighbor not in seen and neighbor not in walls:
+                seen[neighbor] = seen[cell] + 1
+                queue.append(neighbor)
+    return math.inf
+
+
+def make_distances():
+    return LayoutDistances(LayoutGeometry(TERRAIN))
+
+
+def test_distance_matches_bfs_for_every_pair_and_blocker():
+    distances = make_distances()
+    gate = (3, 1)
+    for p1 in distances.cells:
+        for p2 in distances.cells:
+            assert distances.distance(p1, p2) == reference_distance(distances, p1, p2)
+            assert distances.distance(p1, p2, walls=(gate,)) == reference_distance(distances, p1, p2, walls=(gate,))
+            for sink in [(1, 3), (5, 3), (3, 3)]:
+                assert distances.distance(p1, p2, walls=(gate,), sinks=(sink,)) == reference_distance(distances, p1, p2, walls=(gate,), sinks=(sink,))
+
+
+def test_gate_shortens_the_route_when_open():
+    distances = make_distances()
+    assert distances.distance((2, 1), (4, 1)) == 2
+    assert distances.distance((2, 1), (4, 1), walls=((3, 1),)) == 10
+    assert distances.distance((2, 1), (3, 1), walls=((3, 1),)) == math.inf
+
+
+def test_next_step_and_path_follow_a_shortest_route():
+    distances = make_distances()
+    walls = ((3, 1),)
+    for p1 in distances.cells:
+        for p2 in distances.cells:
+            if p1 in walls or p2 in walls:
+                continue
+            path = distances.path(p1, p2, walls=walls)
+            assert len(path) == distances.distance(p1, p2, walls=walls)
+            assert not any(cell in walls for cell in path)
+            steps = [p1] + path
+            assert all(abs(a[0] - b[0]) + abs(a[1] - b[1]) == 1 for a, b in zip(steps, steps[1:]))
+            assert distances.next_step(p1, p2, walls=walls) == (path[0] if len(path) > 0 else None)
+
+
+def test_no_route_through_a_blocked_corridor():
+    distances = make_distances()
+    walls = ((3, 1), (3, 3))
+    assert distances.path((1, 1), (5, 1), walls=walls) is None
+    assert distances.next_step((1, 1), (5, 1), walls=walls) is None
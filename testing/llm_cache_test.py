@@ -0,0 +1,30 @@
+from llm_coordination_agents.llm_cache import LLMResponseCache, cache_key
+
+MESSAGES = [{'role': 'user', 'content': 'Which action?'}]
+
+
+def test_cache_key_ignores_parameter_order_but_not_content():
+    key = cache_key('gpt-4', MESSAGES, {'temperature': 0.6, 'top_p': 0.9})
+    assert key == cache_key('gpt-4', MESSAGES, {'top_p': 0.9, 'temperature': 0.6})
+    assert key != cache_key('gpt-4', MESSAGES, {'temperature': 0.7, 'top_p': 0.9})
+    assert key != cache_key('gpt-35-turbo', MESSAGES, {'temperature': 0.6, 'top_p': 0.9})
+    assert key != cache_key('gpt-4', MESSAGES, {'temperature': 0.6, 'top_p': 0.9}, cache_seed=1)
+
+
+def test_cache_round_trip_and_stats(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / 'cache.sqlite'))
+    key = cache_key('gpt-4', MESSAGES, {})
+    assert cache.get(key) is None
+    cache.put(key, 'gpt-4', '{"choices": []}')
+    assert cache.get(key) == '{"choices": []}'
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'evictions': 0, 'entries': 1}
+
+
+def test_cache_evicts_the_least_recently_used(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / 'cache.sqlite'), max_entries=2, evict_fraction=0.5)
+    cache.put('a', 'm', '1')
+    cache.put('b', 'm', '2')
+    cache.get('a')
+    cache.put('c', 'm', '3')
+    assert len(cache) == 2
+    assert cache.get('b') is None and cache.get('a') == '1'
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('openai')
+
+from llm_coordination_agents.llm_retry import CircuitBreaker, RetryPolicy
+
+
+class FakeResponse:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class FakeError(Exception):
+    def __init__(self, retry_after):
+        self.response = FakeResponse({'retry-after': retry_after})
+
+
+def test_backoff_grows_is_capped_and_honours_retry_after():
+    policy = RetryPolicy(base_delay=1., max_delay=8., seed=0)
+    for attempt in range(1, 8):
+        delay = policy.backoff(attempt)
+        cap = min(8., 2 ** (attempt - 1))
+        assert cap / 2 <= delay <= cap
+    assert policy.backoff(1, FakeError('30')) == 30.
+    assert policy.backoff(1, FakeError('not a number')) <= 1.
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=60.)
+    assert not breaker.record_failure()
+    breaker.record_success()
+    assert not breaker.record_failure()
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert breaker.is_open() and breaker.trips == 1
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    async def run():
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+        breaker.record_failure()
+        first, second = asyncio.create_task(breaker.wait()), asyncio.create_task(breaker.wait())
+        await asyncio.sleep(0.1)
+        # One caller probes, the other waits for its result
+        assert sorted([first.done(), second.done()]) == [False, True]
+        probe, waiter = (first, second) if first.done() else (second, first)
+        assert probe.result() is True
+        breaker.record_success()
+        assert await asyncio.wait_for(waiter, 1.) is False
+        assert await breaker.wait() is False
+
+    asyncio.run(run())
+
+
+def test_failed_probe_reopens_the_breaker():
+    async def run():
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+        breaker.record_failure()
+        assert await asyncio.wait_for(breaker.wait(), 1.) is True
+        assert breaker.record_failure()
+        assert breaker.is_open() and breaker.trips == 2
+
+    asyncio.run(run())
+
+
+def test_released_probe_hands_over_to_a_waiter():
+    async def run():
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.01)
+        breaker.record_failure()
+        assert await asyncio.wait_for(breaker.wait(), 1.) is True
+        waiter = asyncio.create_task(breaker.wait())
+        await asyncio.sleep(0.02)
+        assert not waiter.done()
+        breaker.release(True)
+        assert await asyncio.wait_for(waiter, 1.) is True
+
+    asyncio.run(run())
@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+from llm_coordination_agents.rate_limiter import RateLimiter, TokenBucket, estimate_prompt_tokens
+
+
+def test_estimate_prompt_tokens_is_a_quarter_of_the_characters():
+    assert estimate_prompt_tokens([{'role': 'user', 'content': 'a' * 40}, {'role': 'assistant', 'content': 'b' * 9}]) == 12
+
+
+def test_bucket_starts_full_and_waits_once_empty():
+    async def run():
+        bucket = TokenBucket(600)
+        start = time.monotonic()
+        await bucket.acquire(600)
+        assert time.monotonic() - start < 0.05
+        # 600 per minute is 10 per second
+        await bucket.acquire(1)
+        assert time.monotonic() - start >= 0.09
+
+    asyncio.run(run())
+
+
+def test_adjust_puts_the_bucket_into_debt_and_never_overfills():
+    bucket = TokenBucket(60)
+    bucket.adjust(100)
+    assert bucket.tokens < 0
+    bucket.adjust(-1000)
+    assert bucket.tokens == bucket.capacity
+
+
+def test_limits_are_matched_by_longest_prefix():
+    limiter = RateLimiter({'openai': {'gpt-4': (10, 1000), 'gpt-4o': (20, 2000)}})
+    assert limiter._limit_for('openai', 'gpt-4o-mini') == (20, 2000)
+    assert limiter._limit_for('openai', 'gpt-4-0125') == (10, 1000)
+    assert limiter._limit_for('openai', 'llama') is None
+    assert limiter._limit_for('local', 'gpt-4') is None
+
+
+def test_unlimited_models_are_admitted_at_once_and_settle_corrects_the_estimate():
+    async def run():
+        limiter = RateLimiter({'openai': {'gpt-4': (10, 1000)}})
+        await limiter.acquire('local', 'llama', 10 ** 9)
+        await limiter.acquire('openai', 'gpt-4', 300)
+        request_bucket, token_bucket = limiter._buckets_for('openai', 'gpt-4')
+        assert round(request_bucket.tokens) == 9 and round(token_bucket.tokens) == 700
+        limiter.settle('openai', 'gpt-4', 300, 100)
+        assert round(token_bucket.tokens) == 900
+
+    asyncio.run(run())
+
+
+def test_cancelled_acquire_returns_its_request_slot():
+    async def run():
+        limiter = RateLimiter({'openai': {'gpt-4': (10, 60)}})
+        request_bucket, token_bucket = limiter._buckets_for('openai', 'gpt-4')
+        token_bucket.adjust(60)
+        waiting = asyncio.create_task(limiter.acquire('openai', 'gpt-4', 30))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert round(request_bucket.tokens) == 10
+
+    asyncio.run(run())
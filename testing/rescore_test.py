@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+from rescore import bootstrap_ci, correctness_array, rescore, random_baseline
+
+
+def make_frame():
+    question = "Pick one\nAvailable Answers:\nA. yes\nB. no"
+    return pd.DataFrame({
+        'Game': ['Hanabi', 'Overcooked'],
+        'Concept': ['x', 'x'],
+        'EC Question': [question, question],
+        'EC Answer Ordinal': ['A', 'A,B'],
+        'TOM Question': [question + "\nC. maybe\nD. never", 'No options'],
+        'TOM Answer Ordinal': ['C', 'A'],
+        'JP Question': [question, question],
+        'JP Answer Ordinal': ['D', 'B'],
+    })
+
+
+def test_random_baseline_is_the_share_of_correct_options():
+    expected = random_baseline(make_frame())
+    np.testing.assert_allclose(expected, [[1 / 3, 1 / 5, 0.], [2 / 3, 0., 1 / 3]])
+
+
+def test_correctness_array_leaves_missing_questions_nan():
+    records = [{'trial': 0, 'row': 1, 'qtype': 'TOM', 'correct': 1}, {'trial': 2, 'row': 0, 'qtype': 'EC', 'correct': 0}]
+    scores = correctness_array(records, 2)
+    assert scores.shape == (2, 2, 3)
+    assert scores[0, 1, 1] == 1 and scores[1, 0, 0] == 0
+    assert np.isnan(scores).sum() == 10
+
+
+def test_bootstrap_ci_is_seeded_and_brackets_the_mean():
+    per_row = np.array([[1., 0.], [0., 0.], [1., 1.], [1., 0.]])
+    low, high = bootstrap_ci(per_row, num_samples=2000, seed=1)
+    np.testing.assert_array_equal(low, bootstrap_ci(per_row, num_samples=2000, seed=1)[0])
+    assert np.all(low <= per_row.mean(axis=0)) and np.all(per_row.mean(axis=0) <= high)
+    assert np.all(low >= 0.) and np.all(high <= 1.)
+
+
+def test_rescore_groups_by_game_and_concept():
+    records = [{'trial': t, 'row': row, 'qtype': qtype, 'correct': int(row == 0)}
+               for t in range(2) for row in range(2) for qtype in ['EC', 'TOM', 'JP']]
+    table = rescore(records, make_frame(), num_samples=100)
+    assert list(table) == ['all', 'game: Hanabi', 'game: Overcooked', 'concept: x']
+    assert table['all']['accuracy'] == [0.5, 0.5, 0.5]
+    assert table['game: Hanabi']['accuracy'] == [1., 1., 1.]
+    assert table['game: Overcooked']['standard error'] == [0., 0., 0.]